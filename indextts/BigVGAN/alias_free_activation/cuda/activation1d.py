@@ -6,6 +6,7 @@ import torch.nn as nn
 # load fused CUDA kernel: this enables importing anti_alias_activation_cuda
 from indextts.BigVGAN.alias_free_activation.cuda import load
 from indextts.BigVGAN.alias_free_activation.torch.resample import DownSample1d, UpSample1d
+from indextts.BigVGAN.alias_free_torch.act import replicate_tail
 
 anti_alias_activation_cuda = load.load()
 
@@ -50,7 +51,12 @@ class Activation1d(nn.Module):
 
         self.fused = fused  # Whether to use fused CUDA kernel or not
 
-    def forward(self, x):
+    def forward(self, x, lengths=None):
+        if lengths is not None:
+            # right padded batch, the kernel only replicates the edges of the whole batch
+            x = self.upsample(replicate_tail(x, lengths))
+            x = replicate_tail(self.act(x), lengths * self.up_ratio)
+            return self.downsample(x)
         if not self.fused:
             x = self.upsample(x)
             x = self.act(x)
@@ -1,11 +1,24 @@
 # Adapted from https://github.com/junjun3518/alias-free-torch under the Apache License 2.0
 #   LICENSE is in incl_licenses directory.
 
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
+from ..activations import Snake, SnakeBeta
 from .resample import DownSample1d, UpSample1d
 
 
+def replicate_tail(x, lengths):
+    """
+    ``x`` (B, C, T) with the samples after the first ``lengths[b]`` of every row replaced by its last valid sample,
+    the right padded rows of a batch then see the replicate padding of the filters as if they were decoded alone.
+    """
+    positions = torch.arange(x.size(-1), device=x.device)
+    index = torch.minimum(positions.unsqueeze(0), (lengths - 1).clamp(min=0).unsqueeze(1))
+    return x.gather(-1, index.unsqueeze(1).expand_as(x))
+
+
 class Activation1d(nn.Module):
     def __init__(self,
                  activation,
@@ -21,9 +34,82 @@ class Activation1d(nn.Module):
         self.downsample = DownSample1d(down_ratio, down_kernel_size)
 
     # x: [B,C,T]
-    def forward(self, x):
+    def forward(self, x, lengths=None):
+        """``lengths``: (B,) valid samples of each row of a right padded batch, the padding does not reach them"""
+        if lengths is not None:
+            x = self.upsample(replicate_tail(x, lengths))
+            x = replicate_tail(self.act(x), lengths * self.up_ratio)
+            return self.downsample(x)
         x = self.upsample(x)
         x = self.act(x)
         x = self.downsample(x)
 
-        return x
\ No newline at end of file
+        return x
+
+
+class FusedActivation1d(Activation1d):
+    """
+    Inference path of ``Activation1d`` for CPU with the same parameters and outputs.
+
+    Snake / SnakeBeta is computed with in-place ops and written directly into the padded input of the
+    lowpass filter, which saves the full-size temporaries of the activation and the replicate padding copy
+    of ``DownSample1d``. Channels are processed in blocks of at most ``max_block_elements`` input elements,
+    so the 2x upsampled intermediates only exist for one block at a time. Channel blocks of a contiguous
+    (1, C, T) input are contiguous, the filters run on them without copies.
+
+    Falls back to ``Activation1d.forward`` when gradients are enabled, the input is not on CPU or for padded batches.
+    """
+
+    def __init__(self, *args, max_block_elements: int = 1 << 20, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_block_elements = max_block_elements
+
+    def _snake_params(self):
+        """per-channel (alpha, 1 / beta) of the activation as (1, C, 1), or None for other activations"""
+        act = self.act
+        if not isinstance(act, (Snake, SnakeBeta)):
+            return None
+        alpha = act.alpha.view(1, -1, 1)
+        beta = act.beta.view(1, -1, 1) if isinstance(act, SnakeBeta) else alpha
+        if act.alpha_logscale:
+            alpha, beta = torch.exp(alpha), torch.exp(beta)
+        return alpha, 1.0 / (beta + act.no_div_by_zero)
+
+    def _forward_block(self, x, params):
+        if params is None:
+            return Activation1d.forward(self, x)
+        alpha, inv_beta = params
+        up, lowpass = self.upsample, self.downsample.lowpass
+        C = x.shape[1]
+        # `UpSample1d` scales by `ratio` after the convolution, a power of two scales the filter exactly
+        x = F.pad(x, (up.pad, up.pad), mode="replicate")
+        x = F.conv_transpose1d(x, (up.filter * up.ratio).expand(C, -1, -1), stride=up.stride, groups=C)
+        x = x[..., up.pad_left:-up.pad_right]
+        # snake is written into the padded input of the lowpass filter, only the edges are replicated
+        length = x.shape[-1]
+        out = x.new_empty(x.shape[0], C, lowpass.pad_left + length + lowpass.pad_right)
+        t = x * alpha
+        t.sin_()
+        t.mul_(t)
+        torch.addcmul(x, t, inv_beta, out=out[..., lowpass.pad_left:lowpass.pad_left + length])
+        out[..., :lowpass.pad_left] = out[..., lowpass.pad_left:lowpass.pad_left + 1]
+        out[..., lowpass.pad_left + length:] = out[..., lowpass.pad_left + length - 1:lowpass.pad_left + length]
+        return F.conv1d(out, lowpass.filter.expand(C, -1, -1), stride=lowpass.stride, groups=C)
+
+    def forward(self, x, lengths=None):
+        if torch.is_grad_enabled() or x.device.type != "cpu" or lengths is not None:
+            return super().forward(x, lengths)
+        params = self._snake_params()
+        B, C, T = x.shape
+        block = max(self.max_block_elements // (B * T), 1)
+        if block >= C:
+            return self._forward_block(x, params)
+        if params is None:
+            # the activation is applied to all channels at once
+            return super().forward(x)
+        out = x.new_empty(B, C, T)
+        for start in range(0, C, block):
+            end = min(start + block, C)
+            block_params = tuple(p[:, start:end] for p in params)
+            out[:, start:end] = self._forward_block(x[:, start:end], block_params)
+        return out
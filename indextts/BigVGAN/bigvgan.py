@@ -371,9 +371,17 @@ class BigVGAN(
                 ch = h.upsample_initial_channel // (2 ** (i + 1))
                 self.conds.append(nn.Conv1d(h.speaker_embedding_dim, ch, 1))
 
-    def forward(self, x, mel_refer, lens=None):
-        # Speaker reference
-        speaker_embedding = self.speaker_encoder(mel_refer, lens)
+    def get_speaker_embedding(self, mel_refer, lens=None):
+        """
+        ECAPA-TDNN embedding (b, 1, spk_dim) of the reference mel (b, frames, n_mels), it only depends on the voice,
+        compute it once and pass it to `forward(speaker_embedding=...)` for every chunk of that voice.
+        """
+        return self.speaker_encoder(mel_refer, lens)
+
+    def forward(self, x, mel_refer, lens=None, speaker_embedding=None):
+        # Speaker reference, `mel_refer` is only used if no precomputed `speaker_embedding` is given
+        if speaker_embedding is None:
+            speaker_embedding = self.get_speaker_embedding(mel_refer, lens)
         n_batch = x.size(0)
         contrastive_loss = None
         if n_batch * 2 == speaker_embedding.size(0):
@@ -3,6 +3,7 @@
 
 # Adapted from https://github.com/jik876/hifi-gan under the MIT license.
 #   LICENSE is in incl_licenses directory.
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -12,11 +13,47 @@ from torch.nn.utils import remove_weight_norm, spectral_norm, weight_norm
 import indextts.BigVGAN.activations as activations
 
 from indextts.BigVGAN.ECAPA_TDNN import ECAPA_TDNN
+from indextts.BigVGAN.alias_free_torch.act import replicate_tail
 from indextts.BigVGAN.utils import get_padding, init_weights
 
 LRELU_SLOPE = 0.1
 
 
+def _masked(x, mask):
+    """zero the padded frames of a batch, ``mask`` is (b, 1, t) or None"""
+    return x if mask is None else x * mask
+
+
+def _length_mask(x, lengths):
+    """(b, 1, t) mask of the first ``lengths[i]`` frames of each row of ``x`` (b, c, t)"""
+    positions = torch.arange(x.size(-1), device=x.device)
+    return (positions.unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(1).to(x.dtype)
+
+
+class PreparedVoice:
+    """
+    Speaker conditioning of `BigVGAN` precomputed once per voice by `BigVGAN.prepare_voice()`:
+    the 1x1 convs over the constant speaker embedding are reduced to (b, channels, 1) biases
+    that `forward(prepared_voice=...)` adds to the upsampling path.
+    """
+
+    def __init__(self, speaker_embedding, cond_bias, up_biases=None):
+        self.speaker_embedding = speaker_embedding
+        self.cond_bias = cond_bias
+        self.up_biases = up_biases
+
+    def tensors(self):
+        return [self.speaker_embedding, self.cond_bias] + list(self.up_biases or [])
+
+    def nbytes(self):
+        return sum(t.numel() * t.element_size() for t in self.tensors())
+
+    def to(self, device=None, dtype=None):
+        up_biases = [t.to(device=device, dtype=dtype) for t in self.up_biases] if self.up_biases is not None else None
+        return PreparedVoice(self.speaker_embedding.to(device=device, dtype=dtype),
+                             self.cond_bias.to(device=device, dtype=dtype), up_biases)
+
+
 class AMPBlock1(torch.nn.Module):
     def __init__(self, h, channels, kernel_size=3, dilation=(1, 3, 5), activation=None):
         super(AMPBlock1, self).__init__()
@@ -46,7 +83,7 @@ class AMPBlock1(torch.nn.Module):
         if self.h.get("use_cuda_kernel", False):
             from indextts.BigVGAN.alias_free_activation.cuda.activation1d import Activation1d
         else:
-            from indextts.BigVGAN.alias_free_torch import Activation1d
+            from indextts.BigVGAN.alias_free_torch import FusedActivation1d as Activation1d
         if activation == 'snake':  # periodic nonlinearity with snake function and anti-aliasing
             self.activations = nn.ModuleList([
                 Activation1d(
@@ -62,14 +99,14 @@ class AMPBlock1(torch.nn.Module):
         else:
             raise NotImplementedError("activation incorrectly specified. check the config file and look for 'activation'.")
 
-    def forward(self, x):
+    def forward(self, x, mask=None, lengths=None):
         acts1, acts2 = self.activations[::2], self.activations[1::2]
         for c1, c2, a1, a2 in zip(self.convs1, self.convs2, acts1, acts2):
-            xt = a1(x)
+            xt = _masked(a1(x, lengths), mask)
             xt = c1(xt)
-            xt = a2(xt)
+            xt = _masked(a2(xt, lengths), mask)
             xt = c2(xt)
-            x = xt + x
+            x = _masked(xt + x, mask)
 
         return x
 
@@ -97,7 +134,7 @@ class AMPBlock2(torch.nn.Module):
         if self.h.get("use_cuda_kernel", False):
             from indextts.BigVGAN.alias_free_activation.cuda.activation1d import Activation1d
         else:
-            from indextts.BigVGAN.alias_free_torch import Activation1d
+            from indextts.BigVGAN.alias_free_torch import FusedActivation1d as Activation1d
 
         if activation == 'snake':  # periodic nonlinearity with snake function and anti-aliasing
             self.activations = nn.ModuleList([
@@ -114,11 +151,11 @@ class AMPBlock2(torch.nn.Module):
         else:
             raise NotImplementedError("activation incorrectly specified. check the config file and look for 'activation'.")
 
-    def forward(self, x):
+    def forward(self, x, mask=None, lengths=None):
         for c, a in zip(self.convs, self.activations):
-            xt = a(x)
+            xt = _masked(a(x, lengths), mask)
             xt = c(xt)
-            x = xt + x
+            x = _masked(xt + x, mask)
 
         return x
 
@@ -169,7 +206,8 @@ class BigVGAN(torch.nn.Module):
         if use_cuda_kernel:
             from indextts.BigVGAN.alias_free_activation.cuda.activation1d import Activation1d
         else:
-            from indextts.BigVGAN.alias_free_torch import Activation1d
+            # falls back to the plain torch activation when training or off CPU
+            from indextts.BigVGAN.alias_free_torch import FusedActivation1d as Activation1d
 
         # post conv
         if h.activation == "snake":  # periodic nonlinearity with snake function and anti-aliasing
@@ -198,32 +236,73 @@ class BigVGAN(torch.nn.Module):
 
         # self.logit_scale = nn.Parameter(torch.ones([]) * np.log(1 / 0.07))
 
-    def forward(self, x, mel_ref, lens=None):
-        speaker_embedding = self.speaker_encoder(mel_ref, lens)
-        n_batch = x.size(0)
+    def get_speaker_embedding(self, mel_ref, lens=None):
+        """
+        ECAPA-TDNN embedding (b, 1, spk_dim) of the reference mel (b, frames, n_mels), it only depends on the voice,
+        compute it once and pass it to `forward(speaker_embedding=...)` for every chunk of that voice.
+        """
+        return self.speaker_encoder(mel_ref, lens)
+
+    def prepare_voice(self, mel_ref=None, lens=None, speaker_embedding=None) -> PreparedVoice:
+        """
+        Precompute the speaker conditioning of `forward()` for one voice, then the cost of every
+        vocoder call only depends on the latents.
+        """
+        if speaker_embedding is None:
+            speaker_embedding = self.get_speaker_embedding(mel_ref, lens)
+        embedding = speaker_embedding.transpose(1, 2)
+        up_biases = None
+        if self.cond_in_each_up_layer:
+            up_biases = [cond(embedding) for cond in self.conds]
+        return PreparedVoice(speaker_embedding, self.cond_layer(embedding), up_biases)
+
+    def forward(self, x, mel_ref, lens=None, speaker_embedding=None, x_lens=None, prepared_voice=None):
+        """
+        Args:
+            x: (b, t, gpt_dim) GPT latents
+            mel_ref: (b, frames, n_mels) reference mel, only used if `speaker_embedding` is None
+            lens: relative lengths of `mel_ref` for the speaker encoder
+            speaker_embedding: (b, 1, spk_dim) precomputed `get_speaker_embedding(mel_ref, lens)` output
+            x_lens: (b,) latent frames of each row of a right padded batch, the padding is zeroed before
+                every convolution and replaced by the last valid sample before every anti-aliased activation,
+                so every row is decoded as if it was alone, see `decode_batch()`
+            prepared_voice: `prepare_voice()` output, replaces `mel_ref` and `speaker_embedding`
+        """
         contrastive_loss = None
-        if n_batch * 2 == speaker_embedding.size(0):
-            spe_emb_chunk1, spe_emb_chunk2 = speaker_embedding[:n_batch, :, :], speaker_embedding[n_batch:, :, :]
-            contrastive_loss = self.cal_clip_loss(spe_emb_chunk1.squeeze(1), spe_emb_chunk2.squeeze(1), self.logit_scale.exp())
+        if prepared_voice is None:
+            if speaker_embedding is None:
+                speaker_embedding = self.get_speaker_embedding(mel_ref, lens)
+            n_batch = x.size(0)
+            if n_batch * 2 == speaker_embedding.size(0):
+                spe_emb_chunk1, spe_emb_chunk2 = speaker_embedding[:n_batch, :, :], speaker_embedding[n_batch:, :, :]
+                contrastive_loss = self.cal_clip_loss(spe_emb_chunk1.squeeze(1), spe_emb_chunk2.squeeze(1), self.logit_scale.exp())
 
-            speaker_embedding = speaker_embedding[:n_batch, :, :]
-        speaker_embedding = speaker_embedding.transpose(1, 2)
+                speaker_embedding = speaker_embedding[:n_batch, :, :]
+            prepared_voice = self.prepare_voice(speaker_embedding=speaker_embedding)
 
         # upsample feat
         if self.feat_upsample:
+            x = x.transpose(1, 2)
+            if x_lens is not None:
+                # the interpolation of a single row clamps at its last frame
+                x = replicate_tail(x, x_lens)
             x = torch.nn.functional.interpolate(
-                x.transpose(1, 2),
+                x,
                 scale_factor=[4],
                 mode="linear",
             ).squeeze(1)
         else:
             x = x.transpose(1, 2)
+        # frames of each row at the current resolution
+        frames = x_lens * (4 if self.feat_upsample else 1) if x_lens is not None else None
+        mask = _length_mask(x, frames) if frames is not None else None
+        x = _masked(x, mask)
 
         ### bigVGAN ###
         # pre conv
         x = self.conv_pre(x)
 
-        x = x + self.cond_layer(speaker_embedding)
+        x = _masked(x + prepared_voice.cond_bias.to(x.dtype), mask)
 
         for i in range(self.num_upsamples):
             # upsampling
@@ -231,24 +310,55 @@ class BigVGAN(torch.nn.Module):
                 x = self.ups[i][i_up](x)
 
             if self.cond_in_each_up_layer:
-                x = x + self.conds[i](speaker_embedding)
+                x = x + prepared_voice.up_biases[i].to(x.dtype)
+            if frames is not None:
+                frames = frames * self.h.upsample_rates[i]
+                mask = _length_mask(x, frames)
+                x = _masked(x, mask)
 
             # AMP blocks
             xs = None
             for j in range(self.num_kernels):
                 if xs is None:
-                    xs = self.resblocks[i * self.num_kernels + j](x)
+                    xs = self.resblocks[i * self.num_kernels + j](x, mask, frames)
                 else:
-                    xs += self.resblocks[i * self.num_kernels + j](x)
+                    xs += self.resblocks[i * self.num_kernels + j](x, mask, frames)
             x = xs / self.num_kernels
 
         # post conv
-        x = self.activation_post(x)
+        x = _masked(self.activation_post(x, frames), mask)
         x = self.conv_post(x)
         x = torch.tanh(x)
 
         return x, contrastive_loss
 
+    @property
+    def hop_length(self):
+        """output samples per latent frame"""
+        return int(np.prod(self.h.upsample_rates)) * (4 if self.feat_upsample else 1)
+
+    def decode_batch(self, latents, mel_ref=None, speaker_embedding=None, prepared_voice=None):
+        """
+        Vocode latents of different lengths in one forward pass.
+
+        Args:
+            latents: list of (1, t_i, gpt_dim) or (t_i, gpt_dim) latents
+            mel_ref, speaker_embedding, prepared_voice: as in `forward()`, one speaker is broadcast to all rows
+        Returns:
+            list of (1, t_i * hop_length) waveforms
+        """
+        latents = [latent.reshape(-1, latent.size(-1)) for latent in latents]
+        if len(latents) == 1:
+            wav, _ = self(latents[0].unsqueeze(0), mel_ref, speaker_embedding=speaker_embedding,
+                          prepared_voice=prepared_voice)
+            return [wav[0]]
+        x_lens = torch.tensor([latent.size(0) for latent in latents], device=latents[0].device)
+        x = latents[0].new_zeros(len(latents), int(x_lens.max()), latents[0].size(-1))
+        for i, latent in enumerate(latents):
+            x[i, :latent.size(0)] = latent
+        wav, _ = self(x, mel_ref, speaker_embedding=speaker_embedding, x_lens=x_lens, prepared_voice=prepared_voice)
+        return [wav[i, :, :length * self.hop_length] for i, length in enumerate(x_lens.tolist())]
+
     def remove_weight_norm(self):
         print('Removing weight norm...')
         for l in self.ups:
@@ -0,0 +1,183 @@
+"""
+Batch synthesis of a JSONL manifest with one model load: ``indextts batch manifest.jsonl --out-dir outputs``.
+
+Every row is ``{"prompt_audio": ..., "text": ..., "output": ..., "options": {...}}`` like ``tests/cases.jsonl``,
+``prompt_audio`` (reference audio or ``.voice`` profile) is relative to the manifest, ``output`` defaults to the row
+number (``000042.wav``) and ``options`` are generation kwargs (``num_beams``, ``top_p``, ...,
+``max_text_tokens_per_sentence``), a row with any other option fails. Other keys of a row are an error, except
+``infer_mode`` of ``tests/cases.jsonl``, which is reported and ignored. Rows are synthesized grouped by voice so its
+conditioning is computed once, and their sentences are batched together by ``BatchScheduler``. Rows whose output
+already exists are skipped, so an interrupted run resumes where it stopped; outputs are written to a ``.part`` file
+first. ``--shard i/N`` only synthesizes every N-th row starting at row i, to split a manifest across machines.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from typing import Dict, List, Tuple
+
+from indextts.scheduler import GENERATION_DEFAULTS
+from indextts.utils.pipeline import PipelineStage
+from indextts.utils.sinks import open_sink
+
+OUTPUT_FORMATS = ("wav", "flac", "opus", "pcm")
+# `options` a row may set, they are passed on to `BatchScheduler.submit()`
+ROW_OPTIONS = frozenset(GENERATION_DEFAULTS) | {"max_text_tokens_per_sentence"}
+ROW_KEYS = frozenset({"prompt_audio", "text", "output", "options"})
+# keys of other manifests (`tests/cases.jsonl`) that a batch run does not use, with the reason
+IGNORED_ROW_KEYS = {"infer_mode": "every row is synthesized by BatchScheduler"}
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {count}), got {value!r}")
+    return index, count
+
+
+def load_manifest(path: str) -> List[Dict]:
+    """
+    The rows of ``path`` with their ``row`` number, prompt paths resolved against the manifest directory.
+    Raise ``ValueError`` for a row with an unknown key, the keys of ``IGNORED_ROW_KEYS`` are reported on stderr.
+    """
+    rows = []
+    ignored: Dict[str, int] = {}
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if not isinstance(row.get("text"), str) or not row.get("prompt_audio"):
+                raise ValueError(f"{path}:{line_number}: `text` and `prompt_audio` are required")
+            unknown = sorted(set(row) - ROW_KEYS - set(IGNORED_ROW_KEYS))
+            if unknown:
+                raise ValueError(f"{path}:{line_number}: unknown keys: {', '.join(unknown)}, "
+                                 f"a row has {', '.join(sorted(ROW_KEYS))}")
+            for key in set(row) & set(IGNORED_ROW_KEYS):
+                ignored[key] = ignored.get(key, 0) + 1
+            row["row"] = len(rows)
+            row["prompt_audio"] = os.path.join(base_dir, row["prompt_audio"])
+            rows.append(row)
+    for key, count in sorted(ignored.items()):
+        print(f">> {path}: `{key}` of {count} rows is ignored, {IGNORED_ROW_KEYS[key]}", file=sys.stderr)
+    return rows
+
+
+def select_rows(rows: List[Dict], out_dir: str, fmt: str, shard: Tuple[int, int] = (0, 1)) -> Tuple[List, int]:
+    """
+    The rows of ``shard`` whose output does not exist yet, with their output path, grouped by voice
+    (in manifest order within a voice). Also return the number of rows skipped because they are done.
+    """
+    index, count = shard
+    selected, skipped = [], 0
+    for row in rows:
+        if row["row"] % count != index:
+            continue
+        output = os.path.join(out_dir, row.get("output") or f"{row['row']:06d}.{fmt}")
+        if os.path.exists(output):
+            skipped += 1
+            continue
+        selected.append((row, output))
+    selected.sort(key=lambda item: item[0]["prompt_audio"])
+    return selected, skipped
+
+
+def save_audio(item):
+    """Write ``(output, sampling_rate, wav)`` through a ``.part`` file, the output only exists once complete."""
+    output, sampling_rate, wav = item
+    stem, ext = os.path.splitext(output)
+    part = f"{stem}.part{ext}"
+    with open_sink(part, sampling_rate) as sink:
+        sink.write(wav)
+    os.replace(part, output)
+    return sink.seconds
+
+
+def run_batch(scheduler, selected: List, max_inflight=32, verbose=True) -> Dict[str, float]:
+    """
+    Submit the selected rows to the running ``scheduler``, at most ``max_inflight`` rows at a time,
+    and write each output on a background thread as soon as its row is done.
+    """
+    stats = {"done": 0, "failed": 0, "seconds": 0.0}
+    writer = PipelineStage(save_audio, name="writer", max_pending=4)
+    inflight = deque()
+    pending = iter(selected)
+    start_time = time.perf_counter()
+    while True:
+        for row, output in pending:
+            options = dict(row.get("options") or {})
+            rejected = sorted(set(options) - ROW_OPTIONS)
+            if rejected:
+                stats["failed"] += 1
+                print(f">> row {row['row']} failed: unsupported options: {', '.join(rejected)}", file=sys.stderr)
+                continue
+            inflight.append((row, output, scheduler.submit(row["prompt_audio"], row["text"], **options)))
+            if len(inflight) >= max_inflight:
+                break
+        if not inflight:
+            break
+        row, output, future = inflight.popleft()
+        try:
+            sampling_rate, wav = future.result()
+        except Exception as e:
+            stats["failed"] += 1
+            print(f">> row {row['row']} failed: {type(e).__name__}: {e}", file=sys.stderr)
+            continue
+        writer.put((output, sampling_rate, wav))
+        stats["done"] += 1
+        if verbose:
+            print(f">> [{stats['done'] + stats['failed']}/{len(selected)}] row {row['row']} -> {output}")
+    stats["seconds"] = sum(writer.close())
+    stats["elapsed"] = time.perf_counter() - start_time
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="indextts batch", description="IndexTTS batch synthesis of a JSONL manifest")
+    parser.add_argument("manifest", type=str, help="JSONL rows with prompt_audio, text and optional output, options")
+    parser.add_argument("--out-dir", type=str, required=True, help="Directory of the synthesized audio files")
+    parser.add_argument("--format", type=str, default="wav", choices=OUTPUT_FORMATS,
+                        help="Format of the outputs without an explicit `output` name")
+    parser.add_argument("--shard", type=parse_shard, default=(0, 1),
+                        help="i/N: only synthesize the rows whose number is i modulo N")
+    parser.add_argument("--batch-size", type=int, default=8, help="Max sentences per GPT batch")
+    parser.add_argument("--max-inflight", type=int, default=32, help="Max rows submitted at once")
+    parser.add_argument("-c", "--config", type=str, default="checkpoints/config.yaml")
+    parser.add_argument("--model_dir", type=str, default="checkpoints")
+    parser.add_argument("--fp16", action=argparse.BooleanOptionalAction, default=True,
+                        help="Use FP16 for inference if available, --no-fp16 to disable")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps).")
+    parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="Quantize the GPT weights, CPU only")
+    args = parser.parse_args(argv)
+
+    rows = load_manifest(args.manifest)
+    selected, skipped = select_rows(rows, args.out_dir, args.format, args.shard)
+    print(f">> manifest: {len(rows)} rows, shard {args.shard[0]}/{args.shard[1]}: "
+          f"{len(selected)} to synthesize, {skipped} already done")
+    if not selected:
+        return 0
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    from indextts.infer import IndexTTS
+    from indextts.scheduler import BatchScheduler
+
+    tts = IndexTTS(cfg_path=args.config, model_dir=args.model_dir, is_fp16=args.fp16, device=args.device,
+                   quantize=args.quantize)
+    with BatchScheduler(tts, max_batch_size=args.batch_size) as scheduler:
+        stats = run_batch(scheduler, selected, max_inflight=args.max_inflight)
+        scheduler_stats = scheduler.stats()
+    rtf = stats["elapsed"] / stats["seconds"] if stats["seconds"] > 0 else float("nan")
+    print(f">> {stats['done']} rows done, {stats['failed']} failed, {stats['seconds']:.1f}s of audio "
+          f"in {stats['elapsed']:.1f}s, RTF {rtf:.4f}, average batch size {scheduler_stats['avg_batch_size']:.2f}")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
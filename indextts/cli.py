@@ -5,25 +5,40 @@ import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 warnings.filterwarnings("ignore", category=FutureWarning)
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # indextts batch manifest.jsonl --out-dir ...
+        from indextts.batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
     import argparse
-    parser = argparse.ArgumentParser(description="IndexTTS Command Line")
+    parser = argparse.ArgumentParser(description="IndexTTS Command Line",
+                                     epilog="Run `indextts batch --help` for the synthesis of a JSONL manifest.")
     parser.add_argument("text", type=str, help="Text to be synthesized")
-    parser.add_argument("-v", "--voice", type=str, required=True, help="Path to the audio prompt file (wav format)")
+    parser.add_argument("-v", "--voice", type=str, default=None, help="Path to the audio prompt file (wav format)")
+    parser.add_argument("--voice-profile", type=str, default=None, help="Path to a precomputed voice profile (.voice). If --voice is also given, the profile is exported from it unless it already was from the same audio")
     parser.add_argument("-o", "--output_path", type=str, default="gen.wav", help="Path to the output wav file")
     parser.add_argument("-c", "--config", type=str, default="checkpoints/config.yaml", help="Path to the config file. Default is 'checkpoints/config.yaml'")
     parser.add_argument("--model_dir", type=str, default="checkpoints", help="Path to the model directory. Default is 'checkpoints'")
     parser.add_argument("--fp16", action="store_true", default=True, help="Use FP16 for inference if available")
     parser.add_argument("-f", "--force", action="store_true", default=False, help="Force to overwrite the output file if it exists")
     parser.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps)." )
+    parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="Quantize the GPT weights, CPU only")
     args = parser.parse_args()
     if len(args.text.strip()) == 0:
         print("ERROR: Text is empty.")
         parser.print_help()
         sys.exit(1)
-    if not os.path.exists(args.voice):
+    if args.voice is None and args.voice_profile is None:
+        print("ERROR: One of --voice or --voice-profile is required.")
+        parser.print_help()
+        sys.exit(1)
+    if args.voice is not None and not os.path.exists(args.voice):
         print(f"Audio prompt file {args.voice} does not exist.")
         parser.print_help()
         sys.exit(1)
+    if args.voice is None and not os.path.exists(args.voice_profile):
+        print(f"Voice profile file {args.voice_profile} does not exist.")
+        parser.print_help()
+        sys.exit(1)
     if not os.path.exists(args.config):
         print(f"Config file {args.config} does not exist.")
         parser.print_help()
@@ -55,8 +70,15 @@ def main():
             print("WARNING: Running on CPU may be slow.")
 
     from indextts.infer import IndexTTS
-    tts = IndexTTS(cfg_path=args.config, model_dir=args.model_dir, is_fp16=args.fp16, device=args.device)
-    tts.infer(audio_prompt=args.voice, text=args.text.strip(), output_path=output_path)
+    from indextts.utils.voice_cache import is_profile_of
+    tts = IndexTTS(cfg_path=args.config, model_dir=args.model_dir, is_fp16=args.fp16, device=args.device,
+                   quantize=args.quantize)
+    audio_prompt = args.voice
+    if args.voice_profile is not None:
+        if args.voice is not None and not is_profile_of(args.voice_profile, args.voice):
+            tts.export_voice_profile(args.voice, args.voice_profile)
+        audio_prompt = args.voice_profile
+    tts.infer(audio_prompt=audio_prompt, text=args.text.strip(), output_path=output_path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,253 @@
+"""
+Iteration-level (continuous) batching of mel code generation for ``UnifiedVoice``.
+"""
+
+from collections import deque
+from typing import Any, Deque, List, Optional
+
+import torch
+import torch.nn.functional as F
+from torch.nn.utils.rnn import pad_sequence
+from transformers import LogitsProcessorList
+from transformers.generation.logits_process import (RepetitionPenaltyLogitsProcessor, TemperatureLogitsWarper,
+                                                    TopKLogitsWarper, TopPLogitsWarper)
+
+from indextts.gpt.kv_cache import cat_prefix_kv
+
+
+class DecodeRow:
+    """
+    One sequence of a ``ContinuousBatchDecoder``.
+
+    Args:
+        text_tokens: (1, L) or (L,) text token ids
+        conds_latent: (1, 32, dim) conditioning latents of the voice from ``UnifiedVoice.get_conditioning()``
+        max_generate_length: limit of generated codes for this row
+        payload: anything the caller wants to get back with the finished row
+        prefix_kv: KV cache of ``conds_latent`` from ``UnifiedVoice.get_prefix_kv()``, skips it in the prefill
+    """
+
+    def __init__(self, text_tokens: torch.Tensor, conds_latent: torch.Tensor, max_generate_length: int, payload: Any = None,
+                 prefix_kv=None):
+        self.text_tokens = text_tokens.view(-1)
+        self.conds_latent = conds_latent
+        self.prefix_kv = prefix_kv
+        self.max_generate_length = max_generate_length
+        self.payload = payload
+        self.codes: List[int] = []
+        # mel position of the next input token
+        self.position = 0
+        # token ids seen by the repetition penalty, the prompt is fake ids `1` followed by start_mel_token
+        self.history: List[int] = []
+
+    @property
+    def generated_length(self):
+        return len(self.codes)
+
+    def is_finished(self, stop_mel_token: int) -> bool:
+        if not self.codes:
+            return False
+        return self.codes[-1] == stop_mel_token or len(self.codes) >= self.max_generate_length
+
+    def output(self) -> torch.Tensor:
+        """generated codes (1, n), ends with stop_mel_token unless ``max_generate_length`` was reached"""
+        return torch.tensor([self.codes], dtype=torch.long)
+
+
+class ContinuousBatchDecoder:
+    """
+    Decode loop around ``GPT2InferenceModel.forward`` and its KV cache that schedules at the iteration level:
+    finished rows are evicted from the batch after every decode step and queued rows are admitted
+    in their place, so short sentences do not wait for the longest sentence of their batch.
+
+    Newly admitted rows are prefilled together, their KV cache is left padded to the length of the
+    running batch (or the other way round) and merged along the batch dimension. Positions that are padding
+    for every row left in the batch are dropped from the cache after an eviction. Every row keeps its own
+    mel position, which is passed to ``GPT2InferenceModel.forward(mel_position_ids=...)``.
+
+    Only sampling and greedy decoding are supported, beam search needs the whole batch in lock step.
+    Sampling parameters are shared by all rows.
+    """
+
+    def __init__(self, gpt, max_batch_size=8, max_generate_length: Optional[int] = None, do_sample=True,
+                 top_p=0.8, top_k=30, temperature=1.0, repetition_penalty=10.0):
+        self.gpt = gpt
+        self.model = gpt.inference_model
+        self.max_batch_size = max_batch_size
+        self.max_generate_length = max_generate_length or gpt.max_mel_tokens - 1
+        self.start_mel_token = gpt.start_mel_token
+        self.stop_mel_token = gpt.stop_mel_token
+        self.do_sample = do_sample
+        self.logits_processor = LogitsProcessorList()
+        if repetition_penalty is not None and repetition_penalty != 1.0:
+            self.logits_processor.append(RepetitionPenaltyLogitsProcessor(penalty=repetition_penalty))
+        if do_sample:
+            # same order as `GenerationMixin._get_logits_warper()`
+            if temperature is not None and temperature != 1.0:
+                self.logits_processor.append(TemperatureLogitsWarper(temperature))
+            if top_k is not None and top_k != 0:
+                self.logits_processor.append(TopKLogitsWarper(top_k=top_k, min_tokens_to_keep=1))
+            if top_p is not None and top_p < 1.0:
+                self.logits_processor.append(TopPLogitsWarper(top_p=top_p, min_tokens_to_keep=1))
+        self._waiting: Deque[DecodeRow] = deque()
+        self._rows: List[DecodeRow] = []
+        self._past = None
+        self._mask: Optional[torch.Tensor] = None
+        self.steps = 0
+        self.generated_tokens = 0
+
+    @property
+    def num_running(self) -> int:
+        return len(self._rows)
+
+    @property
+    def num_waiting(self) -> int:
+        return len(self._waiting)
+
+    def __len__(self):
+        return len(self._rows) + len(self._waiting)
+
+    def pending(self) -> List[DecodeRow]:
+        """The rows that are not finished, the running rows then the queued ones."""
+        return self._rows + list(self._waiting)
+
+    def add(self, text_tokens: torch.Tensor, conds_latent: torch.Tensor, payload: Any = None,
+            max_generate_length: Optional[int] = None, prefix_kv=None) -> DecodeRow:
+        """Queue a row, it is admitted at the next ``step()`` with a free slot."""
+        row = DecodeRow(text_tokens, conds_latent, max_generate_length or self.max_generate_length, payload,
+                        prefix_kv=prefix_kv)
+        self._waiting.append(row)
+        return row
+
+    @torch.no_grad()
+    def step(self) -> List[DecodeRow]:
+        """
+        Run one decode step for the running rows, then admit queued rows into free slots.
+        Return the rows that finished in this step, they are no longer part of the batch.
+        """
+        self.steps += 1
+        if self._rows:
+            self._decode()
+        admit = min(self.max_batch_size - len(self._rows), len(self._waiting))
+        if admit > 0:
+            self._prefill([self._waiting.popleft() for _ in range(admit)])
+        return self._evict()
+
+    def remove(self, rows: List[DecodeRow]):
+        """Drop unfinished rows from the batch or the queue, e.g. the rows of a request that failed."""
+        removed = set(id(row) for row in rows)
+        self._waiting = deque(row for row in self._waiting if id(row) not in removed)
+        keep = [i for i, row in enumerate(self._rows) if id(row) not in removed]
+        if len(keep) < len(self._rows):
+            self._select(keep)
+
+    def run(self):
+        """Step until all rows are finished, yield the rows in the order they finish."""
+        while len(self) > 0:
+            yield from self.step()
+
+    def generate(self, text_tokens: List[torch.Tensor], conds_latents: List[torch.Tensor]) -> List[torch.Tensor]:
+        """Generate codes for all rows, return the codes (1, n) of each row in input order."""
+        rows = [self.add(tokens, conds) for tokens, conds in zip(text_tokens, conds_latents)]
+        for _ in self.run():
+            pass
+        return [row.output() for row in rows]
+
+    def _decode(self):
+        device = self._mask.device
+        input_ids = torch.tensor([[row.codes[-1]] for row in self._rows], dtype=torch.long, device=device)
+        positions = torch.tensor([[row.position] for row in self._rows], dtype=torch.long, device=device)
+        attention_mask = F.pad(self._mask, (0, 1), value=1)
+        outputs = self._forward(input_ids=input_ids, past_key_values=self._past, attention_mask=attention_mask,
+                                mel_position_ids=positions)
+        self._past = outputs.past_key_values
+        self._mask = attention_mask
+        for row in self._rows:
+            row.position += 1
+        self._sample(self._rows, outputs.logits[:, -1])
+
+    def _prefill(self, rows: List[DecodeRow]):
+        conds_latent = torch.cat([row.conds_latent for row in rows], dim=0)
+        text_inputs = pad_sequence([row.text_tokens for row in rows], batch_first=True,
+                                   padding_value=self.gpt.stop_text_token)
+        input_ids, inputs_embeds, attention_mask = self.gpt.prepare_gpt_inputs(conds_latent, text_inputs)
+        self.model.store_mel_emb(inputs_embeds)
+        if all(row.prefix_kv is not None for row in rows):
+            self.model.store_prefix_kv(cat_prefix_kv([row.prefix_kv for row in rows]))
+        try:
+            outputs = self._forward(input_ids=input_ids, attention_mask=attention_mask)
+        finally:
+            self.model.store_mel_emb(None)
+            self.model.store_prefix_kv(None)
+        for row in rows:
+            row.history = [1, self.start_mel_token]
+            # `generate()` places the first generated code at mel position 2, keep it for identical outputs
+            row.position = 2
+        self._sample(rows, outputs.logits[:, -1])
+        self._merge(rows, outputs.past_key_values, attention_mask)
+
+    def _forward(self, **kwargs):
+        # rows are merged and evicted on the tuple `past_key_values`, the static cache can not be used here
+        static_kv_cache, self.model.static_kv_cache = self.model.static_kv_cache, False
+        try:
+            return self.model(use_cache=True, return_dict=True, **kwargs)
+        finally:
+            self.model.static_kv_cache = static_kv_cache
+
+    def _sample(self, rows: List[DecodeRow], logits: torch.Tensor):
+        history = pad_sequence([torch.tensor(row.history) for row in rows], batch_first=True,
+                               padding_value=self.start_mel_token).to(logits.device)
+        scores = self.logits_processor(history, logits)
+        if self.do_sample:
+            probs = F.softmax(scores, dim=-1, dtype=torch.float32)
+            next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
+        else:
+            next_tokens = torch.argmax(scores, dim=-1)
+        for row, token in zip(rows, next_tokens.tolist()):
+            row.codes.append(token)
+            row.history.append(token)
+        self.generated_tokens += len(rows)
+
+    def _merge(self, rows: List[DecodeRow], past, mask: torch.Tensor):
+        if self._past is None:
+            self._rows, self._past, self._mask = list(rows), past, mask
+            return
+        diff = mask.shape[1] - self._mask.shape[1]
+        if diff > 0:
+            self._past, self._mask = _pad_left(self._past, self._mask, diff)
+        elif diff < 0:
+            past, mask = _pad_left(past, mask, -diff)
+        self._past = tuple(
+            tuple(torch.cat([a, b], dim=0) for a, b in zip(layer_a, layer_b))
+            for layer_a, layer_b in zip(self._past, past)
+        )
+        self._mask = torch.cat([self._mask, mask], dim=0)
+        self._rows.extend(rows)
+
+    def _evict(self) -> List[DecodeRow]:
+        finished = [row for row in self._rows if row.is_finished(self.stop_mel_token)]
+        if finished:
+            self._select([i for i, row in enumerate(self._rows) if not row.is_finished(self.stop_mel_token)])
+        return finished
+
+    def _select(self, keep: List[int]):
+        """Keep the running rows at the indices ``keep`` and their KV cache."""
+        if not keep:
+            self._rows, self._past, self._mask = [], None, None
+            return
+        index = torch.tensor(keep, dtype=torch.long, device=self._mask.device)
+        self._rows = [self._rows[i] for i in keep]
+        self._mask = self._mask.index_select(0, index)
+        self._past = self.model._reorder_cache(self._past, index)
+        # drop the columns that are padding for every remaining row,
+        # the order of the other columns is kept and positions are part of the embeddings
+        used = self._mask.any(dim=0)
+        if not used.all():
+            columns = used.nonzero().squeeze(1)
+            self._mask = self._mask[:, columns]
+            self._past = tuple(tuple(t.index_select(2, columns) for t in layer) for layer in self._past)
+
+
+def _pad_left(past, mask: torch.Tensor, n: int):
+    past = tuple(tuple(F.pad(t, (0, 0, n, 0)) for t in layer) for layer in past)
+    return past, F.pad(mask, (n, 0), value=0)
@@ -0,0 +1,207 @@
+"""
+Preallocated KV cache for the GPT2 mel decoder.
+"""
+
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from transformers.cache_utils import Cache
+
+
+class StaticKVCache(Cache):
+    """
+    KV cache with static shape ``(layers, batch, heads, max_length, head_dim)``, allocated once per ``generate()``
+    call, new keys and values are written in place instead of concatenating a new tensor every step.
+
+    Beam search does not move the cached rows: ``reorder_cache()`` only updates ``row_map``, the buffer row that holds
+    every position of every beam, and the attention of a decode step reads the keys and values through it with
+    ``attention_scores()`` / ``attention_output()``. The rows of a beam are ``num_beams`` consecutive rows, the order
+    of HuggingFace's beam search.
+    """
+
+    def __init__(self, num_layers: int, batch_size: int, num_heads: int, head_dim: int, max_length: int,
+                 device=None, dtype=torch.float32, num_beams: int = 1):
+        if batch_size % num_beams != 0:
+            raise ValueError(f"batch_size {batch_size} is not a multiple of num_beams {num_beams}")
+        self.num_layers = num_layers
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.num_beams = num_beams
+        self.shape = (num_layers, batch_size, num_heads, max_length, head_dim)
+        self.device = torch.device(device) if device is not None else torch.device("cpu")
+        # every position is written before it is read, pages of positions never reached are not touched
+        self.key_cache = torch.empty(self.shape, device=self.device, dtype=dtype)
+        self.value_cache = torch.empty(self.shape, device=self.device, dtype=dtype)
+        self.seq_length = 0
+        # (batch, max_length) buffer row of every position of every row, None while it is the row itself
+        self.row_map: Optional[torch.Tensor] = None
+        self._group_index = None
+
+    def reset(self):
+        self.seq_length = 0
+        self.row_map = None
+        self._group_index = None
+
+    def nbytes(self) -> int:
+        return 2 * self.key_cache.numel() * self.key_cache.element_size()
+
+    def _ensure_dtype(self, dtype: torch.dtype):
+        # the dtype of the states is only known under autocast once the first layer ran
+        if self.key_cache.dtype != dtype:
+            assert self.seq_length == 0, "can not change the dtype of a filled cache"
+            self.key_cache = self.value_cache = None
+            self.key_cache = torch.empty(self.shape, device=self.device, dtype=dtype)
+            self.value_cache = torch.empty(self.shape, device=self.device, dtype=dtype)
+
+    def load_prefix(self, prefix_kv) -> "StaticKVCache":
+        """Reset and copy a tuple ``past_key_values`` of ``batch_size`` rows into the first positions."""
+        self.reset()
+        self._ensure_dtype(prefix_kv[0][0].dtype)
+        for layer_idx, (key, value) in enumerate(prefix_kv):
+            self.key_cache[layer_idx, :, :, :key.shape[2]] = key
+            self.value_cache[layer_idx, :, :, :value.shape[2]] = value
+        self.seq_length = prefix_kv[0][0].shape[2]
+        return self
+
+    def update(self, key_states: torch.Tensor, value_states: torch.Tensor, layer_idx: int,
+               cache_kwargs: Optional[Dict[str, Any]] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Write key/value states (batch, heads, t, head_dim) of ``layer_idx`` after the cached positions and return
+        the buffer rows of all positions, which are the keys and values of the rows as long as ``row_map`` is None.
+        ``advance()`` must be called once all layers are updated.
+        """
+        start = self.seq_length
+        end = start + key_states.shape[-2]
+        if end > self.max_length:
+            raise ValueError(f"StaticKVCache is full: {end} > max_length {self.max_length}")
+        if layer_idx == 0:
+            self._ensure_dtype(key_states.dtype)
+            if self.row_map is not None:
+                assert end - start == 1, "only single token steps after a beam reorder"
+                # the new position of a row is in its own buffer row, see `reorder_cache()`
+                group_start = torch.arange(self.batch_size, device=self.device) // self.num_beams * self.num_beams
+                self._group_index = (self.row_map[:, :end] - group_start.unsqueeze(1)).view(
+                    -1, self.num_beams, end)
+        self.key_cache[layer_idx, :, :, start:end] = key_states
+        self.value_cache[layer_idx, :, :, start:end] = value_states
+        return self.key_cache[layer_idx, :, :, :end], self.value_cache[layer_idx, :, :, :end]
+
+    def advance(self, n: int):
+        self.seq_length += n
+
+    def reorder_cache(self, beam_idx: torch.LongTensor):
+        """
+        Row ``b`` takes the cached positions of row ``beam_idx[b]``: only ``row_map`` is reordered, the positions
+        written after it go to the own buffer row of ``b``, which no other row maps to yet.
+        """
+        beam_idx = beam_idx.to(self.device)
+        rows = torch.arange(self.batch_size, device=self.device)
+        if self.row_map is None:
+            if torch.equal(beam_idx, rows):
+                return
+            self.row_map = rows.unsqueeze(1).repeat(1, self.max_length)
+        if not torch.equal(beam_idx // self.num_beams, rows // self.num_beams):
+            raise ValueError(f"beam_idx mixes the rows of different beams of {self.num_beams} rows")
+        self.row_map[:, :self.seq_length] = self.row_map[beam_idx, :self.seq_length]
+
+    def attention_scores(self, query: torch.Tensor, key: torch.Tensor) -> torch.Tensor:
+        """``query @ key^T`` (batch, heads, t, positions) of the keys returned by ``update()`` read through ``row_map``."""
+        if self.row_map is None:
+            return torch.matmul(query, key.transpose(-1, -2))
+        batch_size, num_heads, _, head_dim = query.shape
+        index = self._group_index  # (groups, beams, positions) buffer row in the group
+        num_groups, num_beams, length = index.shape
+        # scores of the query of every beam against the keys of every buffer row of the group:
+        # (groups, buffer rows, heads, beams, positions), the keys are read once like the rows of a plain batch
+        query = query.reshape(num_groups, 1, num_beams, num_heads, head_dim).transpose(2, 3)
+        scores = torch.matmul(query, key.view(num_groups, num_beams, num_heads, length, head_dim).transpose(-1, -2))
+        index = index[:, None, None].expand(num_groups, 1, num_heads, num_beams, length)
+        scores = scores.gather(1, index).squeeze(1)  # (groups, heads, beams, positions)
+        return scores.transpose(1, 2).reshape(batch_size, num_heads, 1, length)
+
+    def attention_output(self, weights: torch.Tensor, value: torch.Tensor) -> torch.Tensor:
+        """``weights @ value`` (batch, heads, t, head_dim) of the values returned by ``update()`` read through ``row_map``."""
+        if self.row_map is None:
+            return torch.matmul(weights, value)
+        batch_size, num_heads, _, length = weights.shape
+        head_dim = value.shape[-1]
+        index = self._group_index
+        num_groups, num_beams, _ = index.shape
+        weights = weights.reshape(num_groups, num_beams, num_heads, length).transpose(1, 2)
+        # every weight moves to the buffer row holding its position, the other rows get 0
+        index = index[:, None, None].expand(num_groups, 1, num_heads, num_beams, length)
+        spread = weights.new_zeros(num_groups, num_beams, num_heads, num_beams, length)
+        spread.scatter_(1, index, weights.unsqueeze(1))
+        output = torch.matmul(spread, value.view(num_groups, num_beams, num_heads, length, head_dim)).sum(1)
+        return output.transpose(1, 2).reshape(batch_size, num_heads, 1, head_dim)
+
+    def get_seq_length(self, layer_idx: Optional[int] = 0) -> int:
+        return self.seq_length
+
+    def get_max_length(self) -> Optional[int]:
+        return self.max_length
+
+
+def expand_prefix_kv(prefix_kv, batch_size: int):
+    """
+    Broadcast a tuple ``past_key_values`` of one row, or repeat each of its rows, to ``batch_size`` rows
+    (e.g. ``num_beams`` copies per row), in the order of ``repeat_interleave``.
+    """
+    rows = prefix_kv[0][0].shape[0]
+    if rows == batch_size:
+        return prefix_kv
+    if rows == 1:
+        return tuple(tuple(t.expand(batch_size, *t.shape[1:]) for t in layer) for layer in prefix_kv)
+    return tuple(tuple(t.repeat_interleave(batch_size // rows, dim=0) for t in layer) for layer in prefix_kv)
+
+
+def cat_prefix_kv(prefixes):
+    """Stack the tuple ``past_key_values`` of several voices along the batch dimension."""
+    return tuple(
+        tuple(torch.cat([prefix[layer_idx][i] for prefix in prefixes], dim=0) for i in range(2))
+        for layer_idx in range(len(prefixes[0]))
+    )
+
+
+def gpt2_forward_with_static_cache(transformer, inputs_embeds: torch.Tensor, cache: StaticKVCache,
+                                   attention_mask: Optional[torch.Tensor] = None,
+                                   position_ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    ``GPT2Model.forward(inputs_embeds=...)`` that reads and writes ``cache`` in place, return the last hidden state.
+    The attention math is the one of ``GPT2Attention._attn``, for any number of positions up to ``cache.max_length``.
+    """
+    batch_size, seq_len = inputs_embeds.shape[:2]
+    if position_ids is None:
+        position_ids = torch.arange(cache.seq_length, cache.seq_length + seq_len, device=inputs_embeds.device).unsqueeze(0)
+    hidden_states = inputs_embeds + transformer.wpe(position_ids)
+    hidden_states = transformer.drop(hidden_states)
+    if attention_mask is not None:
+        attention_mask = attention_mask.view(batch_size, -1)[:, None, None, :].to(dtype=transformer.dtype)
+        attention_mask = (1.0 - attention_mask) * torch.finfo(transformer.dtype).min
+    for layer_idx, block in enumerate(transformer.h):
+        attn = block.attn
+        residual = hidden_states
+        query, key, value = attn.c_attn(block.ln_1(hidden_states)).split(attn.split_size, dim=2)
+        query = attn._split_heads(query, attn.num_heads, attn.head_dim)
+        key = attn._split_heads(key, attn.num_heads, attn.head_dim)
+        value = attn._split_heads(value, attn.num_heads, attn.head_dim)
+        key, value = cache.update(key, value, layer_idx)
+        # `GPT2Attention._attn` with the causal mask built here, its `bias` buffer only covers `n_positions`
+        # which does not count the conditioning latents
+        weights = cache.attention_scores(query, key)
+        if attn.scale_attn_weights:
+            weights = weights / value.size(-1) ** 0.5
+        if attn.scale_attn_by_inverse_layer_idx:
+            weights = weights / float(attn.layer_idx + 1)
+        causal_mask = torch.ones(seq_len, key.shape[-2], dtype=torch.bool, device=key.device)
+        causal_mask = causal_mask.tril(key.shape[-2] - seq_len)
+        weights = weights.masked_fill(~causal_mask, torch.finfo(weights.dtype).min)
+        if attention_mask is not None:
+            weights = weights + attention_mask
+        weights = attn.attn_dropout(torch.softmax(weights, dim=-1).type(value.dtype))
+        attn_output = cache.attention_output(weights, value)
+        attn_output = attn.c_proj(attn._merge_heads(attn_output, attn.num_heads, attn.head_dim))
+        hidden_states = attn.resid_dropout(attn_output) + residual
+        hidden_states = hidden_states + block.mlp(block.ln_2(hidden_states))
+    cache.advance(seq_len)
+    return transformer.ln_f(hidden_states)
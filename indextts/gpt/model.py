@@ -9,6 +9,7 @@ from transformers.utils.model_parallel_utils import (assert_device_map,
                                                      get_device_map)
 
 from indextts.gpt.conformer_encoder import ConformerEncoder
+from indextts.gpt.kv_cache import StaticKVCache, expand_prefix_kv, gpt2_forward_with_static_cache
 from indextts.gpt.perceiver import PerceiverResampler
 from indextts.utils.arch_util import AttentionBlock
 from indextts.utils.typical_sampling import TypicalLogitsWarper
@@ -38,7 +39,14 @@ class ResBlock(nn.Module):
 
 
 class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
-    def __init__(self, config, gpt, text_pos_emb, embeddings, norm, linear, kv_cache=False):
+    def __init__(self, config, gpt, text_pos_emb, embeddings, norm, linear, kv_cache=False, static_kv_cache=False,
+                 static_cache_length=None):
+        """
+        ``static_kv_cache``: use a preallocated ``StaticKVCache`` instead of HuggingFace's tuple ``past_key_values``,
+            requires ``kv_cache``.
+        ``static_cache_length``: positions of the ``StaticKVCache`` when ``prepare_static_cache()`` was not called,
+            the longest prompt plus generated codes, default ``config.n_positions``.
+        """
         super().__init__(config)
         # Note: the argument named `text_pos_emb` here actually represents the mel position embedding
         self.transformer = gpt
@@ -47,11 +55,19 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
         self.final_norm = norm
         self.lm_head = nn.Sequential(norm, linear)
         self.kv_cache = kv_cache
+        self.static_kv_cache = static_kv_cache and kv_cache
+        self._static_cache = None
+        self.static_cache_length = static_cache_length or config.n_positions
+        # (max_length, num_beams) of the next `generate()` call
+        self._static_cache_spec = None
 
         # Model parallel
         self.model_parallel = False
         self.device_map = None
         self.cached_mel_emb = None
+        self.cached_prefix_kv = None
+        # final-norm hidden states of the last position of every forward pass, collected when not None
+        self.collected_latents = None
 
     def parallelize(self, device_map=None):
         self.device_map = (
@@ -82,6 +98,39 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
     def store_mel_emb(self, mel_emb):
         self.cached_mel_emb = mel_emb
 
+    def store_prefix_kv(self, prefix_kv):
+        """
+        ``prefix_kv``: KV cache of the leading positions of ``cached_mel_emb`` from ``UnifiedVoice.get_prefix_kv()``,
+            the first forward pass starts after them instead of recomputing them.
+        """
+        self.cached_prefix_kv = prefix_kv
+
+    def prepare_static_cache(self, max_length, num_beams=1):
+        """Size the ``StaticKVCache`` of the next ``generate()`` call: ``max_length`` positions, beams of ``num_beams`` rows."""
+        self._static_cache_spec = (min(max_length, self.static_cache_length), num_beams)
+
+    def get_static_cache(self, batch_size, device) -> StaticKVCache:
+        """
+        The preallocated cache for ``batch_size`` rows, reset for a new sequence.
+        It is reallocated when the batch size, device or ``prepare_static_cache()`` size changes.
+        """
+        max_length, num_beams = self._static_cache_spec or (self.static_cache_length, 1)
+        cache = self._static_cache
+        if (cache is None or cache.batch_size != batch_size or cache.device != torch.device(device)
+                or cache.max_length != max_length or cache.num_beams != num_beams):
+            self._static_cache = None  # release the old buffers first
+            gpt_config = self.transformer.config
+            cache = StaticKVCache(gpt_config.n_layer, batch_size, gpt_config.n_head,
+                                  gpt_config.n_embd // gpt_config.n_head, max_length,
+                                  device=device, dtype=self.transformer.dtype, num_beams=num_beams)
+            self._static_cache = cache
+        cache.reset()
+        return cache
+
+    def release_static_cache(self):
+        self._static_cache = None
+        self._static_cache_spec = None
+
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, **kwargs):
         token_type_ids = kwargs.get("token_type_ids", None)  # usually None
         if not self.kv_cache:
@@ -128,16 +177,24 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
             output_attentions=None,
             output_hidden_states=None,
             return_dict=None,
+            mel_position_ids=None,
     ):
-        assert self.cached_mel_emb is not None
+        """
+        ``mel_position_ids``: (b, 1) mel position of each row for single token steps,
+            used when the rows of the batch are at different decode steps (continuous batching).
+        """
+        assert self.cached_mel_emb is not None or mel_position_ids is not None
         assert inputs_embeds is None  # Not supported by this inference model.
         assert labels is None  # Training not supported by this inference model.
         return_dict = (
             return_dict if return_dict is not None else self.config.use_return_dict
         )
         # Create embedding
-        mel_len = self.cached_mel_emb.shape[1]
-        if input_ids.shape[1] != 1:
+        if mel_position_ids is not None:
+            assert input_ids.shape[1] == 1
+            emb = self.embeddings(input_ids) + self.text_pos_embedding.emb(mel_position_ids)
+        elif input_ids.shape[1] != 1:
+            mel_len = self.cached_mel_emb.shape[1]
             text_inputs = input_ids[:, mel_len:]
             text_emb = self.embeddings(text_inputs)
             text_emb = text_emb + self.text_pos_embedding(text_emb)
@@ -148,11 +205,30 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
             else:  # this outcome only occurs once per loop in most cases
                 mel_emb = self.cached_mel_emb
             emb = torch.cat([mel_emb, text_emb], dim=1)
+            if past_key_values is None and self.cached_prefix_kv is not None:
+                prefix_len = self.cached_prefix_kv[0][0].shape[2]
+                emb = emb[:, prefix_len:]
+                if position_ids is not None:
+                    position_ids = position_ids[:, prefix_len:]
+                past_key_values = expand_prefix_kv(self.cached_prefix_kv, emb.shape[0])
+                if self.static_kv_cache and not self.model_parallel:
+                    past_key_values = self.get_static_cache(emb.shape[0], emb.device).load_prefix(past_key_values)
         else:
+            mel_len = self.cached_mel_emb.shape[1]
             emb = self.embeddings(input_ids)
             emb = emb + self.text_pos_embedding.get_fixed_embedding(
                 attention_mask.shape[1] - mel_len, attention_mask.device
             )
+        if self.static_kv_cache and not self.model_parallel:
+            if past_key_values is None:
+                past_key_values = self.get_static_cache(emb.shape[0], emb.device)
+            hidden_states = gpt2_forward_with_static_cache(self.transformer, emb, past_key_values,
+                                                           attention_mask=attention_mask, position_ids=position_ids)
+            lm_logits = self._lm_head(hidden_states)
+            if not return_dict:
+                return (lm_logits, past_key_values)
+            return CausalLMOutputWithCrossAttentions(logits=lm_logits, past_key_values=past_key_values)
+
         transformer_outputs = self.transformer(
             inputs_embeds=emb,
             past_key_values=past_key_values,
@@ -177,7 +253,7 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
                 torch.cuda.set_device(self.transformer.first_device)
             hidden_states = hidden_states.to(self.lm_head.weight.device)
 
-        lm_logits = self.lm_head(hidden_states)
+        lm_logits = self._lm_head(hidden_states)
 
         if not return_dict:
             return (lm_logits,) + transformer_outputs[1:]
@@ -191,6 +267,14 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
             cross_attentions=transformer_outputs.cross_attentions,
         )
 
+    def _lm_head(self, hidden_states):
+        if self.collected_latents is None:
+            return self.lm_head(hidden_states)
+        # same modules as `lm_head`, the normed states are the latents of `UnifiedVoice.forward(return_latent=True)`
+        latents = self.lm_head[0](hidden_states)
+        self.collected_latents.append(latents[:, -1:])
+        return self.lm_head[1](latents)
+
     @staticmethod
     def _reorder_cache(past, beam_idx):
         """
@@ -385,7 +469,7 @@ class UnifiedVoice(nn.Module):
         for module in embeddings:
             module.weight.data.normal_(mean=0.0, std=.02)
 
-    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False):
+    def post_init_gpt2_config(self, use_deepspeed=False, kv_cache=False, half=False, static_kv_cache=False):
         seq_length = self.max_mel_tokens + self.max_text_tokens + 2
         gpt_config = GPT2Config(
             vocab_size=self.number_mel_codes,
@@ -405,6 +489,9 @@ class UnifiedVoice(nn.Module):
             self.final_norm,
             self.mel_head,
             kv_cache=kv_cache,
+            static_kv_cache=static_kv_cache,
+            # [cond][start_text][text][stop_text][start_mel][codes], the KV of the last code is never computed
+            static_cache_length=self.cond_num + self.max_text_tokens + self.max_mel_tokens + 2,
         )
         if use_deepspeed and half and torch.cuda.is_available():
             import deepspeed
@@ -520,7 +607,7 @@ class UnifiedVoice(nn.Module):
 
     def forward(self, speech_conditioning_latent, text_inputs, text_lengths, mel_codes, wav_lengths,
                 cond_mel_lengths=None, types=None, text_first=True, raw_mels=None, return_attentions=False,
-                return_latent=False, clip_inputs=False):
+                return_latent=False, clip_inputs=False, conds_latent=None):
         """
         Forward pass that uses both text and voice in either text conditioning mode or voice conditioning mode
         (actuated by `text_first`).
@@ -535,9 +622,13 @@ class UnifiedVoice(nn.Module):
         If return_attentions is specified, only logits are returned.
         If return_latent is specified, loss & logits are not computed or returned. Only the predicted latents are returned.
         If clip_inputs is True, the inputs will be clipped to the smallest input size across each input modality.
+        If conds_latent is given, it is used as the output of `get_conditioning()` and speech_conditioning_input is ignored.
         """
 
-        speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent, cond_mel_lengths)
+        if conds_latent is None:
+            speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent, cond_mel_lengths)
+        else:
+            speech_conditioning_latent = conds_latent
         # Types are expressed by expanding the text embedding space.
         if types is not None:
             text_inputs = text_inputs * (1 + types).unsqueeze(-1)
@@ -588,6 +679,58 @@ class UnifiedVoice(nn.Module):
         loss_mel = F.cross_entropy(mel_logits, mel_targets.long())
         return loss_text.mean(), loss_mel.mean(), mel_logits
 
+    def get_latents(self, conds_latent, text_inputs, text_lengths, mel_codes, mel_lengths, prefix_kv=None):
+        """
+        Batched `forward(return_latent=True)` for right padded rows, the padding of the text is masked out
+        so every row gets the latents it would get alone.
+        Args:
+            conds_latent: (b, 32, dim) or (1, 32, dim) `get_conditioning()` output
+            text_inputs: (b, L) text tokens, right padded
+            text_lengths: (b,) valid text tokens of each row
+            mel_codes: (b, T) mel codes, right padded
+            mel_lengths: (b,) valid mel codes of each row
+            prefix_kv: precomputed `get_prefix_kv(conds_latent)`, skips the conditioning positions
+        Returns:
+            latents: (b, T, dim), row i is valid for the first `mel_lengths[i]` frames
+        """
+        b, L = text_inputs.shape
+        device = text_inputs.device
+        text_lengths = text_lengths.to(device)
+        text_inputs = self.set_text_padding(text_inputs.clone(), text_lengths)
+        text_inputs = F.pad(text_inputs, (0, 1), value=self.stop_text_token)
+        text_inputs, _ = self.build_aligned_inputs_and_targets(text_inputs, self.start_text_token, self.stop_text_token)
+        text_emb = self.text_embedding(text_inputs) + self.text_pos_embedding(text_inputs)
+        # the mel padding is after the valid codes, the causal mask keeps it out of their latents
+        mel_codes = self.set_mel_padding(mel_codes.clone(), mel_lengths)
+        mel_codes = F.pad(mel_codes, (0, 1), value=self.stop_mel_token)
+        mel_codes, _ = self.build_aligned_inputs_and_targets(mel_codes, self.start_mel_token, self.stop_mel_token)
+        mel_emb = self.mel_embedding(mel_codes) + self.mel_pos_embedding(mel_codes)
+
+        # [start][text][stop] are valid, the text padding between them and the mel codes is masked
+        text_mask = torch.arange(L + 2, device=device).unsqueeze(0) < (text_lengths.unsqueeze(1) + 2)
+        mel_mask = torch.ones(mel_codes.shape, dtype=torch.bool, device=device)
+        cond_len = conds_latent.shape[1]
+        if prefix_kv is not None:
+            emb = torch.cat([text_emb, mel_emb], dim=1)
+            past_key_values = expand_prefix_kv(prefix_kv, b)
+        else:
+            emb = torch.cat([conds_latent.expand(b, -1, -1), text_emb, mel_emb], dim=1)
+            past_key_values = None
+        attention_mask = torch.cat([torch.ones((b, cond_len), dtype=torch.bool, device=device), text_mask, mel_mask],
+                                   dim=1).long()
+        gpt_out = self.gpt(inputs_embeds=emb, attention_mask=attention_mask, past_key_values=past_key_values,
+                           use_cache=False, return_dict=True)
+        enc = self.final_norm(gpt_out.last_hidden_state[:, -mel_codes.shape[1]:])
+        # strip off the last two positions like `forward(return_latent=True)`
+        return enc[:, :-2]
+
+    def incremental_latents(self, conds_latent, text_inputs, prefix_kv=None) -> "IncrementalLatents":
+        """
+        `IncrementalLatents` of one row: the latents of `forward(return_latent=True)` for a growing code sequence,
+        computed in O(n) total instead of a full forward pass over all codes for every update.
+        """
+        return IncrementalLatents(self, conds_latent, text_inputs, prefix_kv=prefix_kv)
+
     def prepare_gpt_inputs(
         self,
         conditional_latents: torch.Tensor,
@@ -603,44 +746,37 @@ class UnifiedVoice(nn.Module):
             input_ids: (b, s+1) the input ids for the GPT2InferenceModel.generate()
             inputs_embeds: (b, s+1, dim) the input embeddings for the GPT2InferenceModel.forward()
             attention_mask: (b, s+1) the attention mask for the GPT2InferenceModel.generate()
+
+        Padding is placed between the conditioning and the text: [cond][pad][text], so the conditioning
+        prefix is at the same positions in every row and its KV cache from `get_prefix_kv()` can be reused.
         """
         b, L = text_inputs.shape[:2]
         device = text_inputs.device
         single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
         if not single_cond:
             assert conditional_latents.shape[0] == b, f"batch size mismatch: {conditional_latents.shape[0]} vs {b}"
-        batched_mel_emb = []
-        attention_masks = []
-        target_len = conditional_latents.shape[1] + L + 2
-        for i in range(b):
-            valid_mask = (text_inputs[i] != self.stop_text_token) & (text_inputs[i] != self.start_text_token)
-            text_input = text_inputs[i][valid_mask]
-            text_input = F.pad(text_input, (1, 0), value=self.start_text_token)
-            text_input = F.pad(text_input, (0, 1), value=self.stop_text_token)
-            text_input_pos = torch.arange(0, text_input.size(-1), device=device)
-            text_emb = self.text_embedding(text_input) + self.text_pos_embedding.emb(text_input_pos)
-            # concatenate [conditional latents][text embeddings]
-            conds_text_emb = [
-                conditional_latents.squeeze(0) if single_cond else conditional_latents[i],
-                text_emb,
-            ]
-            # +1 for the start_mel_token
-            attention_mask = torch.ones(target_len+1, dtype=torch.long, device=device)
-            # check this text input is padded
-            padding: int = L + 2 - text_input.size(-1)
-            # pad left of [cond][text] -> [pad][cond][text]
-            if padding > 0:
-                pad = torch.zeros((padding, conditional_latents.size(-1)), dtype=text_emb.dtype, device=device) # [p, dim]
-                conds_text_emb.insert(0, pad)
-                attention_mask[:padding] = 0
-            mel_emb = torch.cat(conds_text_emb) #[s, dim]
-            assert mel_emb.shape[0] == target_len, f"mel_emb.shape: {mel_emb.shape}, target_len: {target_len}"
-            batched_mel_emb.append(mel_emb)
-            attention_masks.append(attention_mask)
-        # [b, s, dim]
-        batched_mel_emb = torch.stack(batched_mel_emb, dim=0)
-        # [b, s+1]
-        attention_mask = torch.stack(attention_masks, dim=0)
+        cond_len = conditional_latents.shape[1]
+        # start/stop tokens are dropped from the text and added back around it: [start][text][stop]
+        valid_mask = (text_inputs != self.stop_text_token) & (text_inputs != self.start_text_token)
+        padding = L - valid_mask.sum(dim=1, keepdim=True)  # (b, 1)
+        # the text is right aligned in L+2 columns, column `padding` holds start_text_token
+        columns = torch.arange(L + 2, device=device).unsqueeze(0)
+        text_input = torch.full((b, L + 2), self.stop_text_token, dtype=text_inputs.dtype, device=device)
+        text_input.scatter_(1, padding, self.start_text_token)
+        rows, cols = valid_mask.nonzero(as_tuple=True)
+        text_input[rows, (padding.squeeze(1)[rows] + valid_mask.cumsum(dim=1)[rows, cols])] = text_inputs[rows, cols]
+        is_text = columns >= padding  # (b, L+2)
+        text_input_pos = columns - padding
+        # only the text positions are embedded, the padding stays zero
+        text_emb = self.text_embedding(text_input[is_text]) + self.text_pos_embedding.emb(text_input_pos[is_text])
+        # [cond][pad][text] -> [b, s, dim]
+        dtype = torch.promote_types(conditional_latents.dtype, text_emb.dtype)
+        batched_mel_emb = torch.zeros((b, cond_len + L + 2, conditional_latents.shape[-1]), dtype=dtype, device=device)
+        batched_mel_emb[:, :cond_len] = conditional_latents
+        batched_mel_emb[:, cond_len:][is_text] = text_emb.to(dtype)
+        # [b, s+1], +1 for the start_mel_token
+        attention_mask = torch.ones((b, cond_len + L + 3), dtype=torch.long, device=device)
+        attention_mask[:, cond_len:cond_len + L + 2] = is_text.long()
         # [b, s+1]
         fake_inputs = torch.ones(
             (
@@ -652,24 +788,44 @@ class UnifiedVoice(nn.Module):
         )
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
+    def get_prefix_kv(self, conds_latent: torch.Tensor):
+        """
+        KV cache of the conditioning latents (b, 32, dim), the prefix of every prompt built by `prepare_gpt_inputs()`.
+        It only depends on the voice and can be passed to `inference_speech(prefix_kv=...)` for every sentence.
+        Returns:
+            tuple of (key, value) per layer, each in shape (b, heads, 32, head_dim)
+        """
+        return self.gpt(inputs_embeds=conds_latent, use_cache=True, return_dict=True).past_key_values
+
     def inference_speech(self, speech_conditioning_mel, text_inputs, cond_mel_lengths=None, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9, conds_latent=None, prefix_kv=None,
+                         return_latent=False, **hf_generate_kwargs):
         """
         Args:
             speech_conditioning_mel: (b, n_mels, frames) or (n_mels, frames)
             text_inputs: (b, L)
             cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
+            conds_latent: precomputed `get_conditioning()` output in shape (b, 32, dim) or (1, 32, dim), skips the conditioning encoder
+            prefix_kv: precomputed `get_prefix_kv(conds_latent)`, the conditioning prefix is not run through the GPT again
             input_tokens: additional tokens for generation in shape (b, s) or (s,)
             max_generate_length: limit the number of generated tokens
+            return_latent: also return the final-norm hidden states collected during generation, (b, n, dim) aligned
+                with the codes: row t is the state that predicted code t. They stand in for the latents of a second
+                `forward(return_latent=True)` pass, but come from the generation context, where mel positions are
+                one ahead of that pass, so they are close to its latents but not identical.
             hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
+        Returns:
+            codes (b, n), or `(codes, latents)` if `return_latent`
         """
-        if speech_conditioning_mel.ndim == 2:
-            speech_conditioning_mel = speech_conditioning_mel.unsqueeze(0)
-        if cond_mel_lengths is None:
-            cond_mel_lengths = torch.tensor([speech_conditioning_mel.shape[-1]], device=speech_conditioning_mel.device)
-        conds_latent = self.get_conditioning(speech_conditioning_mel, cond_mel_lengths)
+        if conds_latent is None:
+            if speech_conditioning_mel.ndim == 2:
+                speech_conditioning_mel = speech_conditioning_mel.unsqueeze(0)
+            if cond_mel_lengths is None:
+                cond_mel_lengths = torch.tensor([speech_conditioning_mel.shape[-1]], device=speech_conditioning_mel.device)
+            conds_latent = self.get_conditioning(speech_conditioning_mel, cond_mel_lengths)
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
         self.inference_model.store_mel_emb(inputs_embeds)
+        self.inference_model.store_prefix_kv(prefix_kv)
         if input_tokens is None:
             inputs = input_ids
         else:
@@ -695,14 +851,94 @@ class UnifiedVoice(nn.Module):
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
-        output = self.inference_model.generate(inputs, 
-                                            bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
-                                            eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
-                                            max_length=max_length, logits_processor=logits_processor,
-                                            num_return_sequences=num_return_sequences,
-                                            **hf_generate_kwargs)
+        return_dict_in_generate = as_dict = hf_generate_kwargs.pop("return_dict_in_generate", False)
+        if return_latent and hf_generate_kwargs.get("num_beams", 1) > 1:
+            # `beam_indices` tells which beam row produced every token of the returned sequences
+            hf_generate_kwargs["output_scores"] = True
+            return_dict_in_generate = True
+        if return_latent:
+            self.inference_model.collected_latents = []
+        if self.inference_model.static_kv_cache:
+            # the KV of the last generated code is never computed
+            self.inference_model.prepare_static_cache(max_length - 1, hf_generate_kwargs.get("num_beams", 1))
+        try:
+            output = self.inference_model.generate(inputs,
+                                                bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
+                                                eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
+                                                max_length=max_length, logits_processor=logits_processor,
+                                                num_return_sequences=num_return_sequences,
+                                                return_dict_in_generate=return_dict_in_generate,
+                                                **hf_generate_kwargs)
+            collected_latents = self.inference_model.collected_latents
+        finally:
+            self.inference_model.store_prefix_kv(None)
+            self.inference_model.collected_latents = None
+            # the cache is sized for this call, it is not kept between sentences
+            self.inference_model.release_static_cache()
         if isinstance(output, torch.Tensor):
-            return output[:, trunc_index:]
-        # GenerateOutput
-        output.sequences = output.sequences[:, trunc_index:]
-        return output
+            output = output[:, trunc_index:]
+            codes = output
+        else:
+            # GenerateOutput
+            output.sequences = output.sequences[:, trunc_index:]
+            codes = output.sequences
+        if not return_latent:
+            return output
+        latents = self._gather_latents(collected_latents, codes.shape[1], getattr(output, "beam_indices", None))
+        return (output if as_dict else codes), latents
+
+    @staticmethod
+    def _gather_latents(collected_latents, length, beam_indices=None):
+        """
+        Latents of the returned sequences from the states collected at every step, (rows, steps, dim) per step,
+        following `beam_indices` (b, n) of beam search, where -1 marks positions after the end of a sequence.
+        """
+        states = torch.cat(collected_latents, dim=1)[:, :length]  # (rows, steps, dim)
+        if beam_indices is None:
+            return states
+        beam_indices = beam_indices[:, :length].clamp(min=0)
+        if beam_indices.shape[1] < length:
+            beam_indices = F.pad(beam_indices, (0, length - beam_indices.shape[1]))
+        steps = torch.arange(length, device=states.device)
+        return states[beam_indices.to(states.device), steps]
+
+
+class IncrementalLatents:
+    """
+    Latents of `UnifiedVoice.forward(return_latent=True)` for the mel codes of one row as they are generated.
+
+    The latent of frame t is the final-norm hidden state at the mel input position t, `[start_mel]` for t = 0 and
+    code t - 1 after it, so with the causal attention it only depends on the codes before t. The KV cache of the
+    conditioning, text and the mel inputs already seen is kept, and every call only runs the new positions.
+    """
+
+    def __init__(self, gpt: UnifiedVoice, conds_latent, text_inputs, prefix_kv=None):
+        self.gpt = gpt
+        text_inputs = F.pad(text_inputs, (0, 1), value=gpt.stop_text_token)
+        text_inputs, _ = gpt.build_aligned_inputs_and_targets(text_inputs, gpt.start_text_token, gpt.stop_text_token)
+        emb = gpt.text_embedding(text_inputs) + gpt.text_pos_embedding(text_inputs)
+        if prefix_kv is None:
+            emb = torch.cat([conds_latent, emb], dim=1)
+        self.past_key_values = gpt.gpt(inputs_embeds=emb, past_key_values=prefix_kv, use_cache=True,
+                                       return_dict=True).past_key_values
+        self.latents = emb.new_zeros((1, 0, emb.shape[-1]))
+
+    def __call__(self, codes: torch.Tensor) -> torch.Tensor:
+        """
+        Args:
+            codes: (1, n) all codes generated so far, the codes of earlier calls must not change
+        Returns:
+            latents: (1, n, dim), the same as `forward(return_latent=True)` of ``codes``
+        """
+        begin, end = self.latents.shape[1], codes.shape[1]
+        if end <= begin:
+            return self.latents[:, :end]
+        gpt = self.gpt
+        inputs = F.pad(codes[:, :end - 1], (1, 0), value=gpt.start_mel_token)[:, begin:end]
+        positions = torch.arange(begin, end, device=inputs.device)
+        emb = gpt.mel_embedding(inputs) + gpt.mel_pos_embedding.emb(positions).unsqueeze(0)
+        gpt_out = gpt.gpt(inputs_embeds=emb, past_key_values=self.past_key_values, use_cache=True, return_dict=True)
+        self.past_key_values = gpt_out.past_key_values
+        latents = gpt.final_norm(gpt_out.last_hidden_state)
+        self.latents = torch.cat([self.latents, latents.to(self.latents.dtype)], dim=1)
+        return self.latents
@@ -1,14 +1,16 @@
 import os
 import sys
+import threading
 import time
 from subprocess import CalledProcessError
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 import torch
 import torchaudio
 from torch.nn.utils.rnn import pad_sequence
 from omegaconf import OmegaConf
 from tqdm import tqdm
+from transformers import StoppingCriteriaList
 
 import warnings
 
@@ -17,15 +19,24 @@ warnings.filterwarnings("ignore", category=UserWarning)
 
 from indextts.BigVGAN.models import BigVGAN as Generator
 from indextts.gpt.model import UnifiedVoice
+from indextts.utils.bucketing import bucket_by_token_budget, bucket_lengths_by_budget, padding_waste
 from indextts.utils.checkpoint import load_checkpoint
 from indextts.utils.feature_extractors import MelSpectrogramFeatures
 
 from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.pipeline import PipelineStage
+from indextts.utils.sinks import AudioSink
+from indextts.utils.quantization import (QUANTIZE_MODES, load_quantized_gpt, quantize_gpt, quantized_checkpoint_path,
+                                         save_quantized_gpt)
+from indextts.utils.streaming import CodeStreamer, Crossfader, LatentWindowVocoder
+from indextts.utils.voice_cache import VOICE_PROFILE_EXT, VoiceCache, VoiceConditioning
 
 
 class IndexTTS:
     def __init__(
         self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", is_fp16=True, device=None, use_cuda_kernel=None,
+        voice_cache_size=8, voice_cache_max_bytes=256 * 1024 * 1024, static_kv_cache=False, prefix_kv_cache=True,
+        quantize=None,
     ):
         """
         Args:
@@ -34,6 +45,14 @@ class IndexTTS:
             is_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
+            voice_cache_size (int): max number of reference audios whose speaker conditioning is cached, ``0`` to disable.
+            voice_cache_max_bytes (None | int): max total bytes of cached speaker conditioning tensors.
+            static_kv_cache (bool): use a KV cache of static shape, preallocated per sentence batch for GPT generation,
+                beam search reads the cached rows of every beam through an index map instead of copying them.
+            prefix_kv_cache (bool): compute the GPT KV cache of the speaker conditioning once per voice
+                and reuse it for every sentence instead of running the conditioning through the GPT again.
+            quantize (None | str): ``"int8"`` to run the GPT2 blocks and ``mel_head`` with dynamically quantized
+                int8 weights, CPU only. The quantized weights are saved next to the GPT checkpoint on first use.
         """
         if device is not None:
             self.device = device
@@ -57,6 +76,7 @@ class IndexTTS:
         self.model_dir = model_dir
         self.dtype = torch.float16 if self.is_fp16 else None
         self.stop_mel_token = self.cfg.gpt.stop_mel_token
+        self.prefix_kv_cache = prefix_kv_cache
 
         # Comment-off to load the VQ-VAE model for debugging tokenizer
         #   https://github.com/index-tts/index-tts/issues/34
@@ -73,7 +93,10 @@ class IndexTTS:
         # print(">> vqvae weights restored from:", self.dvae_path)
         self.gpt = UnifiedVoice(**self.cfg.gpt)
         self.gpt_path = os.path.join(self.model_dir, self.cfg.gpt_checkpoint)
-        load_checkpoint(self.gpt, self.gpt_path)
+        if quantize is not None:
+            self.load_quantized_gpt(quantize)
+        else:
+            load_checkpoint(self.gpt, self.gpt_path)
         self.gpt = self.gpt.to(self.device)
         if self.is_fp16:
             self.gpt.eval().half()
@@ -90,9 +113,11 @@ class IndexTTS:
                 print(f">> DeepSpeed加载失败，回退到标准推理: {e}")
                 print("See more details https://www.deepspeed.ai/tutorials/advanced-install/")
 
-            self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=True)
+            self.gpt.post_init_gpt2_config(use_deepspeed=use_deepspeed, kv_cache=True, half=True,
+                                           static_kv_cache=static_kv_cache)
         else:
-            self.gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+            self.gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False,
+                                           static_kv_cache=static_kv_cache)
 
         if self.use_cuda_kernel:
             # preload the CUDA kernel for BigVGAN
@@ -122,78 +147,169 @@ class IndexTTS:
         print(">> TextNormalizer loaded")
         self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
         print(">> bpe model loaded from:", self.bpe_path)
-        # 缓存参考音频mel：
-        self.cache_audio_prompt = None
-        self.cache_cond_mel = None
+        # 缓存参考音频的 cond_mel / GPT 条件 latent / 说话人 embedding，按音频内容哈希索引
+        self.voice_cache = VoiceCache(capacity=voice_cache_size, max_bytes=voice_cache_max_bytes)
         # 进度引用显示（可选）
         self.gr_progress = None
         self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
 
-    def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30):
+    def load_quantized_gpt(self, mode):
+        """Load the quantized GPT weights saved next to ``gpt_path``, quantizing and saving them if missing or stale."""
+        if mode not in QUANTIZE_MODES:
+            raise ValueError(f"unsupported quantize mode: {mode}, expected one of {QUANTIZE_MODES}")
+        if self.device != "cpu":
+            raise ValueError(f"quantize={mode!r} is only supported on CPU, got device {self.device}")
+        if load_quantized_gpt(self.gpt, self.gpt_path, mode):
+            print(">> quantized GPT weights restored from:", quantized_checkpoint_path(self.gpt_path, mode))
+            return
+        load_checkpoint(self.gpt, self.gpt_path)
+        quantize_gpt(self.gpt, mode)
+        try:
+            print(">> quantized GPT weights saved to:", save_quantized_gpt(self.gpt, self.gpt_path, mode))
+        except OSError as e:
+            print(f">> Failed to save the quantized GPT weights: {e}", file=sys.stderr)
+
+    def get_voice_conditioning(self, audio_prompt, verbose=False) -> VoiceConditioning:
+        """
+        Return the speaker conditioning of ``audio_prompt``, computing it only on a cache miss.
+        The cache is keyed by the hash of the audio file content, not by its path.
+
+        ``audio_prompt`` can be a reference audio file, a ``.voice`` profile file or a ``VoiceConditioning``.
+        """
+        if isinstance(audio_prompt, VoiceConditioning):
+            return audio_prompt
+        key = VoiceCache.hash_file(audio_prompt)
+        voice = self.voice_cache.get(key)
+        if voice is None:
+            if str(audio_prompt).endswith(VOICE_PROFILE_EXT):
+                voice = self.load_voice_profile(audio_prompt, key=key)
+            else:
+                voice = self.compute_voice_conditioning(audio_prompt, key=key)
+            self.voice_cache.put(key, voice)
+            if verbose:
+                print(f"cond_mel shape: {voice.cond_mel.shape}", "dtype:", voice.cond_mel.dtype)
+        if verbose:
+            print(">> voice cache:", self.voice_cache.stats())
+        return voice
+
+    def compute_voice_conditioning(self, audio_prompt, key=None) -> VoiceConditioning:
+        audio, sr = torchaudio.load(audio_prompt)
+        audio = torch.mean(audio, dim=0, keepdim=True)
+        if audio.shape[0] > 1:
+            audio = audio[0].unsqueeze(0)
+        audio = torchaudio.transforms.Resample(sr, 24000)(audio)
+        cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
+        cond_mel_lengths = torch.tensor([cond_mel.shape[-1]], device=self.device)
+        with torch.no_grad():
+            with torch.amp.autocast(cond_mel.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                gpt_cond_latent = self.gpt.get_conditioning(cond_mel, cond_mel_lengths)
+                speaker_embedding = self.bigvgan.get_speaker_embedding(cond_mel.transpose(1, 2))
+        voice = VoiceConditioning(cond_mel, gpt_cond_latent, speaker_embedding, key=key)
+        self.get_prefix_kv(voice)
+        self.get_vocoder_voice(voice)
+        return voice
+
+    def export_voice_profile(self, audio_prompt, profile_path) -> str:
+        """
+        Write the speaker conditioning of ``audio_prompt`` to a ``.voice`` profile file.
+        Loading the profile later skips audio decoding, resampling and the conditioning encoders.
+        """
+        voice = self.get_voice_conditioning(audio_prompt)
+        if os.path.dirname(profile_path) != "":
+            os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        voice.save(profile_path, model_version=self.model_version)
+        print(">> voice profile saved to:", profile_path)
+        return profile_path
+
+    def load_voice_profile(self, profile_path, key=None) -> VoiceConditioning:
+        voice = VoiceConditioning.load(profile_path, model_version=self.model_version)
+        voice = voice.to(self.device, dtype=torch.float16 if self.is_fp16 else torch.float32)
+        voice.key = key
+        self.get_prefix_kv(voice)
+        self.get_vocoder_voice(voice)
+        return voice
+
+    def get_prefix_kv(self, voice: VoiceConditioning):
+        """
+        GPT KV cache of the speaker conditioning prefix of ``voice``, computed once and kept on the voice.
+        Return None if ``prefix_kv_cache`` is disabled.
+        """
+        if not self.prefix_kv_cache:
+            return None
+        if voice.gpt_prefix_kv is None:
+            with torch.no_grad():
+                with torch.amp.autocast(voice.gpt_cond_latent.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    voice.gpt_prefix_kv = self.gpt.get_prefix_kv(voice.gpt_cond_latent)
+        return voice.gpt_prefix_kv
+
+    def get_vocoder_voice(self, voice: VoiceConditioning):
+        """
+        Speaker conditioning biases of BigVGAN for ``voice``, computed once and kept on the voice.
+        """
+        if voice.vocoder_voice is None:
+            with torch.no_grad():
+                with torch.amp.autocast(voice.speaker_embedding.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    voice.vocoder_voice = self.bigvgan.prepare_voice(speaker_embedding=voice.speaker_embedding)
+        return voice.vocoder_voice
+
+    def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30, latents=None):
         """
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
+        latents: [B, T, D] latents aligned with codes (``inference_speech(return_latent=True)``),
+            the same positions are kept and they are returned as third value
+
+        Every row is cut at its first stop_mel_token. In rows with more than ``max_consecutive`` silent tokens,
+        only the first 10 tokens of every run of silent tokens are kept. The whole batch is processed
+        with tensor ops, the kept codes are compacted to the left and padded with stop_mel_token.
         """
-        code_lens = []
-        codes_list = []
+        batch_size, length = codes.shape
         device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
+        positions = torch.arange(length, device=device).unsqueeze(0)
+        is_stop = codes == self.stop_mel_token
+        # index of the first stop_mel_token, or the full length
+        code_end = torch.where(is_stop.any(dim=1), is_stop.int().argmax(dim=1), length)
+        keep = positions < code_end.unsqueeze(1)
+
+        is_silent = codes == silent_token
+        fix_rows = is_silent.sum(dim=1) > max_consecutive
+        # offset of every silent token in its run: distance to the last non-silent token before it
+        last_sound = torch.where(is_silent, -1, positions.expand(batch_size, -1)).cummax(dim=1).values
+        run_offset = positions - last_sound - 1
+        keep &= ~(fix_rows.unsqueeze(1) & is_silent & (run_offset >= 10))
+
+        code_lens = keep.sum(dim=1)
+        max_len = int(code_lens.max().item()) if batch_size > 0 else 0
+        rows, columns = keep.nonzero(as_tuple=True)
+        # target column of every kept token after compaction
+        target = (keep.cumsum(dim=1) - 1)[rows, columns]
+        if bool(fix_rows.any().item()):
+            fixed = torch.full((batch_size, max_len), self.stop_mel_token, dtype=codes.dtype, device=device)
+            fixed[rows, target] = codes[rows, columns]
+            codes = fixed
+        elif max_len < length:
+            # unchanged, clip codes to max length
             codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
+        if latents is not None:
+            fixed_latents = latents.new_zeros((batch_size, max_len, latents.shape[-1]))
+            fixed_latents[rows, target] = latents[rows, columns]
+            return codes, code_lens, fixed_latents
         return codes, code_lens
 
-    def bucket_sentences(self, sentences, bucket_max_size=4) -> List[List[Dict]]:
+    def bucket_sentences(self, sentences, bucket_max_size=4, bucket_max_tokens=None) -> List[List[Dict]]:
         """
         Sentence data bucketing.
         if ``bucket_max_size=1``, return all sentences in one bucket.
+        if ``bucket_max_tokens`` is set, every bucket costs at most ``bucket_max_tokens`` padded tokens
+        (sentences x longest text and expected mel length) and holds at most ``bucket_max_size`` sentences,
+        see ``bucket_by_token_budget()``.
         """
         outputs: List[Dict] = []
         for idx, sent in enumerate(sentences):
             outputs.append({"idx": idx, "sent": sent, "len": len(sent)})
-       
+
+        if bucket_max_tokens is not None:
+            return bucket_by_token_budget(outputs, bucket_max_tokens, max_batch_size=bucket_max_size)
         if len(outputs) > bucket_max_size:
             # split sentences into buckets by sentence length
             buckets: List[List[Dict]] = []
@@ -275,15 +391,28 @@ class IndexTTS:
             self.gr_progress(value, desc=desc)
 
     # 快速推理：对于“多句长文本”，可实现至少 2~10 倍以上的速度提升~ （First modified by sunnyboxs 2025-04-16）
-    def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_sentence=100, sentences_bucket_max_size=4, **generation_kwargs):
+    def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_sentence=100, sentences_bucket_max_size=4,
+                   sentences_bucket_max_tokens=None, bigvgan_max_samples=24000 * 30, pipeline=False, **generation_kwargs):
         """
         Args:
+            ``output_path``: 保存的音频路径，``None`` 时返回 ``(sampling_rate, wav)``，
+                也可以传入 ``AudioSink``（见 ``indextts.utils.sinks``），音频写入 sink 后返回该 sink
             ``max_text_tokens_per_sentence``: 分句的最大token数，默认``100``，可以根据GPU硬件情况调整
                 - 越小，batch 越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越大，batch 越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
             ``sentences_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
                 - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``sentences_bucket_max_tokens``: 按填充后的 token 数（句子数 x 最长句的文本和预计 mel 长度）分桶，默认 ``None`` 使用固定容量分桶
+                - 短句可以组成更大的 batch，长句的 batch 更小，``sentences_bucket_max_size`` 仍限制每个桶的句子数
+            ``bigvgan_max_samples``: BigVGAN 批量解码时每个 batch 填充后的最大采样点数（句子数 x 最长句的采样点数），默认 30 秒
+                - 各句的 latent 填充到同一长度后一次解码，再按真实长度截取音频，越大 batch 越多，占用内存更多
+                - 仅在 CUDA 上批量解码，CPU 上批量解码没有加速，逐句解码
+            ``pipeline``: GPT 与 BigVGAN 流水线并行，默认 ``False``
+                - BigVGAN 在独立线程（CUDA 上为独立 stream）解码上一个分桶的句子，同时 GPT 生成下一个分桶
+                - BigVGAN 的 batch 只在同一分桶内组成，结束时打印两个阶段的利用率
+            ``reuse_generation_latents``: 在 ``generation_kwargs`` 中传入 ``True`` 时，直接使用生成过程中收集的 hidden states 作为 latent，
+                跳过第二次 GPT 前向，见 ``UnifiedVoice.inference_speech(return_latent=True)``
         """
         print(">> start fast inference...")
         
@@ -292,27 +421,13 @@ class IndexTTS:
             print(f"origin text:{text}")
         start_time = time.perf_counter()
 
-        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
-        if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
-            cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
-            cond_mel_frame = cond_mel.shape[-1]
-            if verbose:
-                print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
-
-            self.cache_audio_prompt = audio_prompt
-            self.cache_cond_mel = cond_mel
-        else:
-            cond_mel = self.cache_cond_mel
-            cond_mel_frame = cond_mel.shape[-1]
-            pass
+        # 参考音频的条件特征按内容哈希缓存，命中时跳过加载、重采样和特征提取
+        voice = self.get_voice_conditioning(audio_prompt, verbose=verbose)
+        cond_mel = voice.cond_mel
+        cond_mel_frame = voice.cond_mel_frame
 
         auto_conditioning = cond_mel
-        cond_mel_lengths = torch.tensor([cond_mel_frame], device=self.device)
+        cond_mel_lengths = voice.cond_mel_lengths
 
         # text_tokens
         text_tokens_list = self.tokenizer.tokenize(text)
@@ -332,6 +447,7 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        reuse_generation_latents = generation_kwargs.pop("reuse_generation_latents", False)
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
@@ -344,12 +460,15 @@ class IndexTTS:
         all_text_tokens: List[List[torch.Tensor]] = []
         self._set_gr_progress(0.1, "text processing...")
         bucket_max_size = sentences_bucket_max_size if self.device != "cpu" else 1
-        all_sentences = self.bucket_sentences(sentences, bucket_max_size=bucket_max_size)
+        bucket_max_tokens = sentences_bucket_max_tokens if self.device != "cpu" else None
+        all_sentences = self.bucket_sentences(sentences, bucket_max_size=bucket_max_size, bucket_max_tokens=bucket_max_tokens)
         bucket_count = len(all_sentences)
+        bucket_padding_waste = padding_waste(all_sentences)
         if verbose:
             print(">> sentences bucket_count:", bucket_count,
                   "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in all_sentences],
-                  "bucket_max_size:", bucket_max_size)
+                  "bucket_max_size:", bucket_max_size, "bucket_max_tokens:", bucket_max_tokens,
+                  f"padding waste: {bucket_padding_waste:.1%}")
         for sentences in all_sentences:
             temp_tokens: List[torch.Tensor] = []
             all_text_tokens.append(temp_tokens)
@@ -368,9 +487,13 @@ class IndexTTS:
             
         # Sequential processing of bucketing data
         all_batch_num = sum(len(s) for s in all_sentences)
-        all_batch_codes = []
         processed_num = 0
-        for item_tokens in all_text_tokens:
+        has_warned = False
+        hop_length = self.bigvgan.hop_length
+
+        def generate(item_tokens):
+            """GPT generation of one bucket, return the codes and, with ``reuse_generation_latents``, the latents."""
+            nonlocal gpt_gen_time, processed_num
             batch_num = len(item_tokens)
             if batch_num > 1:
                 batch_text_tokens = self.pad_tokens_cat(item_tokens)
@@ -382,8 +505,10 @@ class IndexTTS:
             m_start_time = time.perf_counter()
             with torch.no_grad():
                 with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    temp_codes = self.gpt.inference_speech(auto_conditioning, batch_text_tokens,
+                    output = self.gpt.inference_speech(auto_conditioning, batch_text_tokens,
                                         cond_mel_lengths=cond_mel_lengths,
+                                        conds_latent=voice.gpt_cond_latent,
+                                        prefix_kv=self.get_prefix_kv(voice),
                                         # text_lengths=text_len,
                                         do_sample=do_sample,
                                         top_p=top_p,
@@ -394,77 +519,124 @@ class IndexTTS:
                                         num_beams=num_beams,
                                         repetition_penalty=repetition_penalty,
                                         max_generate_length=max_mel_tokens,
+                                        return_latent=reuse_generation_latents,
                                         **generation_kwargs)
-                    all_batch_codes.append(temp_codes)
             gpt_gen_time += time.perf_counter() - m_start_time
+            return output if reuse_generation_latents else (output, None)
 
-        # gpt latent
-        self._set_gr_progress(0.5, "gpt inference latents...")
-        all_idxs = []
-        all_latents = []
-        has_warned = False
-        for batch_codes, batch_tokens, batch_sentences in zip(all_batch_codes, all_text_tokens, all_sentences):
-            for i in range(batch_codes.shape[0]):
-                codes = batch_codes[i]  # [x]
-                if not has_warned and codes[-1] != self.stop_mel_token:
-                    warnings.warn(
-                        f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
-                        f"Consider reducing `max_text_tokens_per_sentence`({max_text_tokens_per_sentence}) or increasing `max_mel_tokens`.",
-                        category=RuntimeWarning
-                    )
-                    has_warned = True
-                codes = codes.unsqueeze(0)  # [x] -> [1, x]
-                if verbose:
-                    print("codes:", codes.shape)
-                    print(codes)
-                codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
-                if verbose:
-                    print("fix codes:", codes.shape)
-                    print(codes)
-                    print("code_lens:", code_lens)
-                text_tokens = batch_tokens[i]
-                all_idxs.append(batch_sentences[i]["idx"])
-                m_start_time = time.perf_counter()
-                with torch.no_grad():
-                    with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                        latent = \
-                            self.gpt(auto_conditioning, text_tokens,
-                                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device), codes,
-                                        code_lens*self.gpt.mel_length_compression,
-                                        cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]], device=text_tokens.device),
-                                        return_latent=True, clip_inputs=False)
-                        gpt_forward_time += time.perf_counter() - m_start_time
-                        all_latents.append(latent)
-        del all_batch_codes, all_text_tokens, all_sentences
-        # bigvgan chunk
-        chunk_size = 2
-        all_latents = [all_latents[all_idxs.index(i)] for i in range(len(all_latents))]
-        if verbose:
-            print(">> all_latents:", len(all_latents))
-            print("  latents length:", [l.shape[1] for l in all_latents])
-        chunk_latents = [all_latents[i : i + chunk_size] for i in range(0, len(all_latents), chunk_size)]
-        chunk_length = len(chunk_latents)
-        latent_length = len(all_latents)
-
-        # bigvgan chunk decode
-        self._set_gr_progress(0.7, "bigvgan decode...")
-        tqdm_progress = tqdm(total=latent_length, desc="bigvgan")
-        for items in chunk_latents:
-            tqdm_progress.update(len(items))
-            latent = torch.cat(items, dim=1)
+        def get_latents(batch_codes, batch_latents, batch_tokens, batch_sentences):
+            """Latents of the generated codes of one bucket, a list of ``(sentence idx, latent)``."""
+            nonlocal gpt_forward_time, has_warned
+            idxs = [item["idx"] for item in batch_sentences]
+            if not has_warned and bool((batch_codes[:, -1] != self.stop_mel_token).any()):
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                    f"Consider reducing `max_text_tokens_per_sentence`({max_text_tokens_per_sentence}) or increasing `max_mel_tokens`.",
+                    category=RuntimeWarning
+                )
+                has_warned = True
+            if verbose:
+                print("codes:", batch_codes.shape)
+                print(batch_codes)
+            # one call for the whole bucket, the rows are cut and shrunk independently
+            if batch_latents is not None:
+                codes, code_lens, fixed_latents = self.remove_long_silence(batch_codes, silent_token=52, max_consecutive=30,
+                                                                           latents=batch_latents)
+            else:
+                codes, code_lens = self.remove_long_silence(batch_codes, silent_token=52, max_consecutive=30)
+            if verbose:
+                print("fix codes:", codes.shape)
+                print(codes)
+                print("code_lens:", code_lens)
+            if batch_latents is not None:
+                # the hidden states of generation are the latents, no second GPT pass
+                return [(idx, fixed_latents[i:i + 1, :code_len])
+                        for i, (idx, code_len) in enumerate(zip(idxs, code_lens.tolist()))]
+            # one latent pass for the whole bucket, the conditioning prefix comes from the voice
+            text_lens = torch.tensor([t.shape[-1] for t in batch_tokens], device=self.device)
+            batch_text_tokens = pad_sequence([t.squeeze(0) for t in batch_tokens], batch_first=True,
+                                             padding_value=self.cfg.gpt.stop_text_token)
+            m_start_time = time.perf_counter()
             with torch.no_grad():
-                with torch.amp.autocast(latent.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    m_start_time = time.perf_counter()
-                    wav, _ = self.bigvgan(latent, auto_conditioning.transpose(1, 2))
-                    bigvgan_time += time.perf_counter() - m_start_time
-                    wav = wav.squeeze(1)
-                    pass
-            wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
-            wavs.append(wav.cpu()) # to cpu before saving
+                with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    latents = self.gpt.get_latents(voice.gpt_cond_latent, batch_text_tokens, text_lens,
+                                                   codes, code_lens, prefix_kv=self.get_prefix_kv(voice))
+                    gpt_forward_time += time.perf_counter() - m_start_time
+            return [(idx, latents[i:i + 1, :code_len]) for i, (idx, code_len) in enumerate(zip(idxs, code_lens.tolist()))]
+
+        def latent_batches(latents):
+            """bigvgan batches, padded to the longest latent of each batch"""
+            if torch.device(self.device).type != "cuda":
+                # padded batches are no faster than single sentences off CUDA
+                return [[i] for i in range(len(latents))]
+            return bucket_lengths_by_budget([l.shape[1] for l in latents], bigvgan_max_samples // hop_length)
+
+        # by sentence idx, empty sentences are skipped by the bucketing and have no wav
+        sentence_wavs: Dict[int, torch.Tensor] = {}
+        tqdm_progress = tqdm(total=all_batch_num, desc="bigvgan")
+
+        def vocode(indexed_latents):
+            """BigVGAN batch decode of ``(sentence idx, latent)``, return the number of batches."""
+            nonlocal bigvgan_time
+            idxs = [idx for idx, _ in indexed_latents]
+            latents = [latent for _, latent in indexed_latents]
+            batches = latent_batches(latents)
+            for batch in batches:
+                tqdm_progress.update(len(batch))
+                with torch.no_grad():
+                    with torch.amp.autocast(latents[0].device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        m_start_time = time.perf_counter()
+                        batch_wavs = self.bigvgan.decode_batch([latents[i] for i in batch], auto_conditioning.transpose(1, 2),
+                                                               prepared_voice=self.get_vocoder_voice(voice))
+                        bigvgan_time += time.perf_counter() - m_start_time
+                for i, wav in zip(batch, batch_wavs):
+                    sentence_wavs[idxs[i]] = torch.clamp(32767 * wav.float(), -32767.0, 32767.0).cpu()  # to cpu before saving
+            return len(batches)
+
+        if pipeline:
+            # BigVGAN decodes the sentences of bucket N on its own thread while the GPT generates bucket N+1
+            pipeline_start_time = time.perf_counter()
+            vocoder_stage = PipelineStage(vocode, name="bigvgan", device=self.device)
+            try:
+                for item_tokens, batch_sentences in zip(all_text_tokens, all_sentences):
+                    batch_codes, batch_latents = generate(item_tokens)
+                    vocoder_stage.put(get_latents(batch_codes, batch_latents, item_tokens, batch_sentences))
+                self._set_gr_progress(0.7, "bigvgan decode...")
+                chunk_length = sum(vocoder_stage.close())
+            finally:
+                # stops the bigvgan thread when the gpt raises, the batches it did not start are dropped
+                vocoder_stage.close(cancel=True)
+            pipeline_time = time.perf_counter() - pipeline_start_time
+            del all_text_tokens, all_sentences
+        else:
+            all_batch_codes = []
+            all_batch_latents = []
+            for item_tokens in all_text_tokens:
+                temp_codes, temp_latents = generate(item_tokens)
+                all_batch_codes.append(temp_codes)
+                all_batch_latents.append(temp_latents)
+
+            # gpt latent
+            self._set_gr_progress(0.5, "gpt inference latents...")
+            all_indexed_latents = []
+            for batch_codes, batch_latents, batch_tokens, batch_sentences in zip(all_batch_codes, all_batch_latents,
+                                                                                 all_text_tokens, all_sentences):
+                all_indexed_latents.extend(get_latents(batch_codes, batch_latents, batch_tokens, batch_sentences))
+            del all_batch_codes, all_batch_latents, all_text_tokens, all_sentences
+            all_indexed_latents.sort(key=lambda item: item[0])
+            if verbose:
+                print(">> all_latents:", len(all_indexed_latents))
+                print("  latents length:", [l.shape[1] for _, l in all_indexed_latents])
+
+            # bigvgan batch decode
+            self._set_gr_progress(0.7, "bigvgan decode...")
+            chunk_length = vocode(all_indexed_latents)
+            del all_indexed_latents
+        wavs.extend(sentence_wavs[idx] for idx in sorted(sentence_wavs))
 
         # clear cache
         tqdm_progress.close()  # 确保进度条被关闭
-        del all_latents, chunk_latents
+        del sentence_wavs
         end_time = time.perf_counter()
         self.torch_empty_cache()
 
@@ -478,12 +650,22 @@ class IndexTTS:
         print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
         print(f">> Total fast inference time: {end_time - start_time:.2f} seconds")
         print(f">> Generated audio length: {wav_length:.2f} seconds")
-        print(f">> [fast] bigvgan chunk_length: {chunk_length}")
+        print(f">> [fast] bigvgan batch_num: {chunk_length} max_samples: {bigvgan_max_samples}")
+        if pipeline:
+            # share of the pipelined section each stage was busy, the overlap is what the pipeline gains
+            print(f">> [fast] pipeline utilization: gpt {(gpt_gen_time + gpt_forward_time) / pipeline_time:.1%}, "
+                  f"bigvgan {vocoder_stage.stats(pipeline_time)['utilization']:.1%}")
         print(f">> [fast] batch_num: {all_batch_num} bucket_max_size: {bucket_max_size}", f"bucket_count: {bucket_count}" if bucket_max_size > 1 else "")
+        if bucket_max_size > 1:
+            print(f">> [fast] expected padding waste: {bucket_padding_waste:.1%}", f"bucket_max_tokens: {bucket_max_tokens}" if bucket_max_tokens else "")
         print(f">> [fast] RTF: {(end_time - start_time) / wav_length:.4f}")
 
         # save audio
         wav = wav.cpu()  # to cpu
+        if isinstance(output_path, AudioSink):
+            # 写入输出 sink（内存 / 文件 / 后台线程写入），由调用方关闭
+            output_path.write(wav.type(torch.int16))
+            return output_path
         if output_path:
             # 直接保存音频到指定路径中
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -504,27 +686,11 @@ class IndexTTS:
             print(f"origin text:{text}")
         start_time = time.perf_counter()
 
-        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
-        if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
-            cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
-            cond_mel_frame = cond_mel.shape[-1]
-            if verbose:
-                print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
-
-            self.cache_audio_prompt = audio_prompt
-            self.cache_cond_mel = cond_mel
-        else:
-            cond_mel = self.cache_cond_mel
-            cond_mel_frame = cond_mel.shape[-1]
-            pass
+        # 参考音频的条件特征按内容哈希缓存，命中时跳过加载、重采样和特征提取
+        voice = self.get_voice_conditioning(audio_prompt, verbose=verbose)
+        cond_mel_frame = voice.cond_mel_frame
 
         self._set_gr_progress(0.1, "text processing...")
-        auto_conditioning = cond_mel
         text_tokens_list = self.tokenizer.tokenize(text)
         sentences = self.tokenizer.split_sentences(text_tokens_list, max_text_tokens_per_sentence)
         if verbose:
@@ -532,6 +698,59 @@ class IndexTTS:
             print("sentences count:", len(sentences))
             print("max_text_tokens_per_sentence:", max_text_tokens_per_sentence)
             print(*sentences, sep="\n")
+        sampling_rate = 24000
+        stats = {"gpt_gen_time": 0, "gpt_forward_time": 0, "bigvgan_time": 0}
+        wavs = []
+        for wav in self._infer_sentences(voice, sentences, stats, verbose=verbose,
+                                         max_text_tokens_per_sentence=max_text_tokens_per_sentence,
+                                         **generation_kwargs):
+            wavs.append(wav)
+        end_time = time.perf_counter()
+        self._set_gr_progress(0.9, "save audio...")
+        wav = torch.cat(wavs, dim=1)
+        wav_length = wav.shape[-1] / sampling_rate
+        print(f">> Reference audio length: {cond_mel_frame * 256 / sampling_rate:.2f} seconds")
+        print(f">> gpt_gen_time: {stats['gpt_gen_time']:.2f} seconds")
+        print(f">> gpt_forward_time: {stats['gpt_forward_time']:.2f} seconds")
+        print(f">> bigvgan_time: {stats['bigvgan_time']:.2f} seconds")
+        print(f">> Total inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Generated audio length: {wav_length:.2f} seconds")
+        print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+
+        # save audio
+        wav = wav.cpu()  # to cpu
+        if isinstance(output_path, AudioSink):
+            # 写入输出 sink（内存 / 文件 / 后台线程写入），由调用方关闭
+            output_path.write(wav.type(torch.int16))
+            return output_path
+        if output_path:
+            # 直接保存音频到指定路径中
+            if os.path.isfile(output_path):
+                os.remove(output_path)
+                print(">> remove old wav file:", output_path)
+            if os.path.dirname(output_path) != "":
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
+            print(">> wav file saved to:", output_path)
+            return output_path
+        else:
+            # 返回以符合Gradio的格式要求
+            wav_data = wav.type(torch.int16)
+            wav_data = wav_data.numpy().T
+            return (sampling_rate, wav_data)
+
+    def _infer_sentences(self, voice: VoiceConditioning, sentences: List[List[str]], stats: Dict[str, float],
+                         verbose=False, max_text_tokens_per_sentence=120,
+                         should_stop: Optional[Callable[[], bool]] = None, **generation_kwargs):
+        """
+        Synthesize ``sentences`` one by one, yield the waveform of each sentence in order
+        as a float tensor (1, T) in int16 range on cpu. Stage timings are accumulated into ``stats``.
+        ``should_stop`` is checked after every generated token, once it returns ``True`` the sentence being generated
+        is dropped and no more sentences are synthesized.
+
+        ``reuse_generation_latents=True`` in ``generation_kwargs`` uses the hidden states collected during generation
+        as latents instead of a second GPT pass, see ``UnifiedVoice.inference_speech(return_latent=True)``.
+        """
         do_sample = generation_kwargs.pop("do_sample", True)
         top_p = generation_kwargs.pop("top_p", 0.8)
         top_k = generation_kwargs.pop("top_k", 30)
@@ -541,16 +760,15 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
-        sampling_rate = 24000
-        # lang = "EN"
-        # lang = "ZH"
-        wavs = []
-        gpt_gen_time = 0
-        gpt_forward_time = 0
-        bigvgan_time = 0
+        reuse_generation_latents = generation_kwargs.pop("reuse_generation_latents", False)
+        if should_stop is not None:
+            generation_kwargs["stopping_criteria"] = StoppingCriteriaList(
+                [lambda input_ids, scores, **kwargs: should_stop()])
         progress = 0
         has_warned = False
         for sent in sentences:
+            if should_stop is not None and should_stop():
+                return
             text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
             text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
             # text_tokens = F.pad(text_tokens, (0, 1))  # This may not be necessary.
@@ -570,9 +788,11 @@ class IndexTTS:
             m_start_time = time.perf_counter()
             with torch.no_grad():
                 with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    codes = self.gpt.inference_speech(auto_conditioning, text_tokens,
-                                                        cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]],
+                    output = self.gpt.inference_speech(voice.cond_mel, text_tokens,
+                                                        cond_mel_lengths=torch.tensor([voice.cond_mel.shape[-1]],
                                                                                       device=text_tokens.device),
+                                                        conds_latent=voice.gpt_cond_latent,
+                                                        prefix_kv=self.get_prefix_kv(voice),
                                                         # text_lengths=text_len,
                                                         do_sample=do_sample,
                                                         top_p=top_p,
@@ -583,8 +803,13 @@ class IndexTTS:
                                                         num_beams=num_beams,
                                                         repetition_penalty=repetition_penalty,
                                                         max_generate_length=max_mel_tokens,
+                                                        return_latent=reuse_generation_latents,
                                                         **generation_kwargs)
-                gpt_gen_time += time.perf_counter() - m_start_time
+                codes, gen_latents = output if reuse_generation_latents else (output, None)
+                stats["gpt_gen_time"] += time.perf_counter() - m_start_time
+                if should_stop is not None and should_stop():
+                    # the generation was stopped part way, the codes are not a whole sentence
+                    return
                 if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
                     warnings.warn(
                         f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
@@ -602,7 +827,11 @@ class IndexTTS:
 
                 # remove ultra-long silence if exits
                 # temporarily fix the long silence bug.
-                codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
+                if gen_latents is not None:
+                    codes, code_lens, gen_latents = self.remove_long_silence(codes, silent_token=52, max_consecutive=30,
+                                                                             latents=gen_latents)
+                else:
+                    codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
                 if verbose:
                     print(codes, type(codes))
                     print(f"fix codes shape: {codes.shape}, codes type: {codes.dtype}")
@@ -611,53 +840,227 @@ class IndexTTS:
                 m_start_time = time.perf_counter()
                 # latent, text_lens_out, code_lens_out = \
                 with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                    latent = \
-                        self.gpt(auto_conditioning, text_tokens,
-                                    torch.tensor([text_tokens.shape[-1]], device=text_tokens.device), codes,
-                                    code_lens*self.gpt.mel_length_compression,
-                                    cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]], device=text_tokens.device),
-                                    return_latent=True, clip_inputs=False)
-                    gpt_forward_time += time.perf_counter() - m_start_time
+                    if gen_latents is not None:
+                        latent = gen_latents
+                    else:
+                        latent = \
+                            self.gpt(voice.cond_mel, text_tokens,
+                                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device), codes,
+                                        code_lens*self.gpt.mel_length_compression,
+                                        cond_mel_lengths=torch.tensor([voice.cond_mel.shape[-1]], device=text_tokens.device),
+                                        return_latent=True, clip_inputs=False, conds_latent=voice.gpt_cond_latent)
+                    stats["gpt_forward_time"] += time.perf_counter() - m_start_time
 
                     m_start_time = time.perf_counter()
-                    wav, _ = self.bigvgan(latent, auto_conditioning.transpose(1, 2))
-                    bigvgan_time += time.perf_counter() - m_start_time
+                    wav, _ = self.bigvgan(latent, voice.cond_mel.transpose(1, 2), prepared_voice=self.get_vocoder_voice(voice))
+                    stats["bigvgan_time"] += time.perf_counter() - m_start_time
                     wav = wav.squeeze(1)
 
                 wav = torch.clamp(32767 * wav, -32767.0, 32767.0)
                 if verbose:
                     print(f"wav shape: {wav.shape}", "min:", wav.min(), "max:", wav.max())
                 # wavs.append(wav[:, :-512])
-                wavs.append(wav.cpu())  # to cpu before saving
-        end_time = time.perf_counter()
-        self._set_gr_progress(0.9, "save audio...")
-        wav = torch.cat(wavs, dim=1)
-        wav_length = wav.shape[-1] / sampling_rate
-        print(f">> Reference audio length: {cond_mel_frame * 256 / sampling_rate:.2f} seconds")
-        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
-        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
-        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
-        print(f">> Total inference time: {end_time - start_time:.2f} seconds")
-        print(f">> Generated audio length: {wav_length:.2f} seconds")
-        print(f">> RTF: {(end_time - start_time) / wav_length:.4f}")
+                yield wav.cpu()  # to cpu before saving
 
-        # save audio
-        wav = wav.cpu()  # to cpu
-        if output_path:
-            # 直接保存音频到指定路径中
-            if os.path.isfile(output_path):
-                os.remove(output_path)
-                print(">> remove old wav file:", output_path)
-            if os.path.dirname(output_path) != "":
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
-            print(">> wav file saved to:", output_path)
-            return output_path
+    def _infer_sentence_windowed(self, voice: VoiceConditioning, sent: List[str], stats: Dict[str, float],
+                                 window=32, left_context=16, lookahead=8, crossfade=1024,
+                                 should_stop: Optional[Callable[[], bool]] = None, **generation_kwargs):
+        """
+        Synthesize one sentence while it is being generated: the GPT runs in a background thread,
+        every ``window`` new mel codes the latents of the new codes are computed by ``IncrementalLatents``,
+        which keeps the KV cache of the codes before them, and the new frames are vocoded by ``LatentWindowVocoder``.
+        Yield float waveform chunks (1, T) in int16 range on cpu. Closing the generator stops the generation,
+        so does ``should_stop`` returning ``True``, which is checked after every generated token.
+
+        Long silences are shrunk on the fly: once more than 30 silent codes were generated, runs of silent
+        codes are capped to 10. This is only a causal approximation of ``remove_long_silence()``, which caps every
+        run of a sentence with more than 30 silent codes: runs already vocoded before the count passed 30 are kept.
+        """
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        generation_kwargs.setdefault("do_sample", True)
+        generation_kwargs.setdefault("top_p", 0.8)
+        generation_kwargs.setdefault("top_k", 30)
+        generation_kwargs.setdefault("temperature", 1.0)
+        generation_kwargs.setdefault("length_penalty", 0.0)
+        generation_kwargs.setdefault("repetition_penalty", 10.0)
+        generation_kwargs["num_beams"] = 1
+        silent_token, max_consecutive = 52, 30
+        text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
+        text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+
+        if should_stop is not None and should_stop():
+            return
+        streamer = CodeStreamer()
+        if should_stop is not None:
+            streamer.stopping.append(lambda input_ids, scores, **kwargs: should_stop())
+        errors = []
+
+        def generate():
+            try:
+                with torch.no_grad():
+                    with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        self.gpt.inference_speech(voice.cond_mel, text_tokens,
+                                                  cond_mel_lengths=voice.cond_mel_lengths,
+                                                  conds_latent=voice.gpt_cond_latent,
+                                                  prefix_kv=self.get_prefix_kv(voice),
+                                                  num_return_sequences=1,
+                                                  max_generate_length=max_mel_tokens,
+                                                  streamer=streamer,
+                                                  stopping_criteria=streamer.stopping,
+                                                  **generation_kwargs)
+            except BaseException as e:
+                errors.append(e)
+                streamer.end()
+
+        with torch.no_grad():
+            with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                latents = self.gpt.incremental_latents(voice.gpt_cond_latent, text_tokens,
+                                                       prefix_kv=self.get_prefix_kv(voice))
+
+        def get_latent(codes: List[int]) -> torch.Tensor:
+            m_start_time = time.perf_counter()
+            codes = torch.tensor([codes], dtype=torch.long, device=text_tokens.device)
+            with torch.no_grad():
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    latent = latents(codes)
+            stats["gpt_forward_time"] += time.perf_counter() - m_start_time
+            return latent
+
+        def vocode(latent: torch.Tensor) -> torch.Tensor:
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(latent.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    wav, _ = self.bigvgan(latent, voice.cond_mel.transpose(1, 2), prepared_voice=self.get_vocoder_voice(voice))
+            stats["bigvgan_time"] += time.perf_counter() - m_start_time
+            wav = torch.clamp(32767 * wav.squeeze(1).float(), -32767.0, 32767.0)
+            return wav.cpu()
+
+        vocoder = LatentWindowVocoder(vocode, hop_length=self.gpt.mel_length_compression, window=window,
+                                      left_context=left_context, lookahead=lookahead, crossfade=crossfade)
+        m_start_time = time.perf_counter()
+        other_time = stats["gpt_forward_time"] + stats["bigvgan_time"]
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        codes: List[int] = []
+        silent_count = 0
+        silent_run = 0
+        stopped = False
+        try:
+            for new_codes in streamer:
+                if stopped:
+                    continue
+                for code in new_codes:
+                    if code == self.stop_mel_token:
+                        stopped = True
+                        break
+                    if code == silent_token:
+                        silent_count += 1
+                        silent_run += 1
+                        if silent_count > max_consecutive and silent_run > 10:
+                            continue
+                    else:
+                        silent_run = 0
+                    codes.append(code)
+                if len(codes) - vocoder.emitted_frames >= window + lookahead:
+                    latent = get_latent(codes)
+                    yield from vocoder.push(latent)
+        finally:
+            # the consumer stopped early (closed generator, error): do not leave the GPT generating
+            streamer.cancel()
+            thread.join()
+        # generation overlaps with the latent and vocoder calls, count the wall time not spent in them
+        other_time = stats["gpt_forward_time"] + stats["bigvgan_time"] - other_time
+        stats["gpt_gen_time"] += time.perf_counter() - m_start_time - other_time
+        if errors:
+            raise errors[0]
+        if should_stop is not None and should_stop():
+            return
+        if not stopped:
+            warnings.warn(
+                f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                f"Input text tokens: {text_tokens.shape[1]}.",
+                category=RuntimeWarning
+            )
+        if len(codes) == 0:
+            return
+        yield from vocoder.flush(get_latent(codes))
+
+    def infer_stream(self, audio_prompt, text, verbose=False, max_text_tokens_per_sentence=120, crossfade_ms=0,
+                     stream_window=0, stream_left_context=16, stream_lookahead=8, stream_crossfade=1024,
+                     should_stop: Optional[Callable[[], bool]] = None, **generation_kwargs) -> Iterator[torch.Tensor]:
+        """
+        Streaming inference, yield int16 PCM chunks (1, T) at 24kHz as soon as each sentence is vocoded.
+        Chunks are yielded in sentence order, ``chunk.numpy().tobytes()`` is the raw little-endian PCM.
+
+        Args:
+            ``crossfade_ms``: crossfade length at sentence boundaries in milliseconds, ``0`` to disable.
+                The boundaries overlap by the crossfade length, so the total audio gets slightly shorter.
+            ``stream_window``: vocode every ``stream_window`` mel codes while the sentence is still being generated,
+                ``0`` to vocode whole sentences. Requires ``num_beams=1``.
+            ``stream_left_context``: mel codes of already emitted audio vocoded again as context for each window.
+            ``stream_lookahead``: mel codes after each window that are generated before the window is vocoded.
+            ``stream_crossfade``: crossfade between windows in samples.
+            ``should_stop``: called after every generated token, once it returns ``True`` the stream ends without
+                the rest of the text, e.g. for a client that disconnected or a deadline. The sentence or window
+                being generated is dropped.
+        """
+        sampling_rate = 24000
+        start_time = time.perf_counter()
+        voice = self.get_voice_conditioning(audio_prompt, verbose=verbose)
+        text_tokens_list = self.tokenizer.tokenize(text)
+        sentences = self.tokenizer.split_sentences(text_tokens_list, max_text_tokens_per_sentence)
+        if verbose:
+            print("text token count:", len(text_tokens_list))
+            print("sentences count:", len(sentences))
+            print(*sentences, sep="\n")
+        stats = {"gpt_gen_time": 0, "gpt_forward_time": 0, "bigvgan_time": 0}
+        crossfader = Crossfader(int(crossfade_ms * sampling_rate / 1000))
+        if stream_window > 0 and generation_kwargs.get("num_beams", 3) > 1:
+            warnings.warn("WARN: windowed streaming requires `num_beams=1`, falling back to sentence streaming.",
+                          category=RuntimeWarning)
+            stream_window = 0
+        if stream_window > 0:
+            sentence_chunks = (
+                self._infer_sentence_windowed(voice, sent, stats, window=stream_window,
+                                              left_context=stream_left_context, lookahead=stream_lookahead,
+                                              crossfade=stream_crossfade, should_stop=should_stop,
+                                              **generation_kwargs)
+                for sent in sentences
+            )
         else:
-            # 返回以符合Gradio的格式要求
-            wav_data = wav.type(torch.int16)
-            wav_data = wav_data.numpy().T
-            return (sampling_rate, wav_data)
+            sentence_chunks = (
+                [wav] for wav in self._infer_sentences(voice, sentences, stats, verbose=verbose,
+                                                       max_text_tokens_per_sentence=max_text_tokens_per_sentence,
+                                                       should_stop=should_stop, **generation_kwargs)
+            )
+        wav_length = 0
+        first_chunk_time = None
+        for chunks in sentence_chunks:
+            try:
+                for i, wav in enumerate(chunks):
+                    # only crossfade at sentence boundaries, windows of one sentence are already joined
+                    chunk = crossfader.push(wav, crossfade=i == 0)
+                    if chunk.shape[-1] == 0:
+                        continue
+                    if first_chunk_time is None:
+                        first_chunk_time = time.perf_counter() - start_time
+                    wav_length += chunk.shape[-1]
+                    yield chunk.type(torch.int16)
+            finally:
+                if hasattr(chunks, "close"):
+                    # a closed stream stops the generation of the windowed sentence right away
+                    chunks.close()
+        chunk = crossfader.flush()
+        if chunk.shape[-1] > 0:
+            wav_length += chunk.shape[-1]
+            yield chunk.type(torch.int16)
+        end_time = time.perf_counter()
+        if first_chunk_time is not None:
+            print(f">> [stream] time to first audio: {first_chunk_time:.2f} seconds")
+        print(f">> [stream] gpt_gen_time: {stats['gpt_gen_time']:.2f} seconds, "
+              f"gpt_forward_time: {stats['gpt_forward_time']:.2f} seconds, bigvgan_time: {stats['bigvgan_time']:.2f} seconds")
+        if wav_length > 0:
+            print(f">> [stream] RTF: {(end_time - start_time) / (wav_length / sampling_rate):.4f}")
 
 
 if __name__ == "__main__":
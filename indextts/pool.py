@@ -0,0 +1,278 @@
+"""
+Serve ``IndexTTS`` from several forked CPU worker processes that share one copy of the model weights.
+"""
+
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+from typing import Deque, Dict, List, Optional, Set
+
+import torch
+import torchaudio
+
+
+def _worker_main(tts, worker_id: int, num_threads: int, conn):
+    torch.set_num_threads(num_threads)
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        job_id, audio_prompt, text, infer_mode, kwargs = job
+        start = time.perf_counter()
+        try:
+            infer = tts.infer_fast if infer_mode == "fast" else tts.infer
+            result = infer(audio_prompt, text, None, **kwargs)
+        except Exception as e:
+            # the exception type may not be picklable, only its text is sent back
+            result = RuntimeError(f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+        conn.send((job_id, result, time.perf_counter() - start))
+
+
+class WorkerPool:
+    """
+    Process pool of ``IndexTTS`` workers for CPU serving.
+
+    A single instance decodes one sentence batch at a time and uses only part of the cores of a large machine.
+    The pool moves the already loaded GPT and BigVGAN weights of ``tts`` to shared memory and forks ``num_workers``
+    processes from it, so the weights are in memory once whatever the number of workers. Each worker runs with its own
+    ``torch.set_num_threads`` budget, a job is one ``infer_fast`` / ``infer`` call. Jobs wait in a queue of this
+    process and are sent over a pipe to the next idle worker, one at a time, so the pool knows which job each worker
+    runs: if a worker dies its job fails instead of blocking, the other workers keep serving the queue, and once all
+    workers are dead the queued jobs fail too. Voice conditioning caches are per worker.
+
+    Args:
+        tts: the ``IndexTTS`` instance on CPU, it should not be used for inference in this process before ``start()``,
+            OpenMP thread pools do not survive a fork
+        num_workers: number of worker processes
+        threads_per_worker: intra-op threads of each worker, default splits the threads of this process evenly
+        infer_mode: ``"fast"`` for ``infer_fast``, ``"normal"`` for ``infer``
+    """
+
+    def __init__(self, tts, num_workers=2, threads_per_worker=None, infer_mode="fast"):
+        if torch.device(tts.device).type != "cpu":
+            raise ValueError(f"WorkerPool only supports CPU models, got device {tts.device}")
+        if infer_mode not in ("fast", "normal"):
+            raise ValueError(f"unknown infer_mode: {infer_mode}")
+        self.tts = tts
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, torch.get_num_threads() // num_workers)
+        self.infer_mode = infer_mode
+        self._ctx = mp.get_context("fork")
+        self._workers: List[mp.Process] = []
+        self._conns = []
+        self._collector: Optional[threading.Thread] = None
+        self._futures: Dict[int, Future] = {}
+        self._queue: Deque[tuple] = deque()
+        self._idle: List[int] = []
+        self._alive: Set[int] = set()
+        # worker id -> id of the job it runs
+        self._running: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stopping = False
+        self._next_id = 0
+        self.poll_interval = 0.5
+        self._stats = {"requests": 0, "completed": 0, "failed": 0, "dead_workers": 0, "busy_time": 0.0}
+        self._worker_jobs = [0] * num_workers
+        self._start_time = 0.0
+
+    def share_memory(self):
+        """Move the model weights to shared memory, forked workers then map the same pages."""
+        for model in (self.tts.gpt, self.tts.bigvgan):
+            model.share_memory()
+        return self
+
+    def start(self):
+        if self._workers:
+            return self
+        self.share_memory()
+        self._start_time = time.perf_counter()
+        self._stopping = False
+        for worker_id in range(self.num_workers):
+            conn, child_conn = self._ctx.Pipe()
+            process = self._ctx.Process(target=_worker_main, name=f"tts-worker-{worker_id}", daemon=True,
+                                        args=(self.tts, worker_id, self.threads_per_worker, child_conn))
+            process.start()
+            child_conn.close()
+            self._workers.append(process)
+            self._conns.append(conn)
+        self._idle = list(range(self.num_workers))
+        self._alive = set(self._idle)
+        self._collector = threading.Thread(target=self._collect, name="tts-pool-collector", daemon=True)
+        self._collector.start()
+        return self
+
+    def stop(self):
+        """Finish the queued jobs and stop the workers."""
+        if not self._workers:
+            return
+        with self._lock:
+            self._stopping = True
+            while (self._queue or self._running) and self._alive:
+                self._changed.wait()
+            for worker_id in self._alive:
+                try:
+                    self._conns[worker_id].send(None)
+                except OSError:
+                    pass
+        for process in self._workers:
+            process.join()
+        self._collector.join()
+        for conn in self._conns:
+            conn.close()
+        self._workers, self._conns, self._collector = [], [], None
+        with self._lock:
+            futures, self._futures = self._futures, {}
+            self._queue.clear()
+            self._idle, self._alive, self._running = [], set(), {}
+        for future in futures.values():
+            future.set_exception(RuntimeError("WorkerPool stopped"))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def pids(self) -> List[int]:
+        return [process.pid for process in self._workers]
+
+    def submit(self, audio_prompt, text: str, **kwargs) -> Future:
+        """
+        Queue one synthesis, ``audio_prompt`` is a reference audio or ``.voice`` profile path.
+        The future resolves to ``(sampling_rate, wav)`` with ``wav`` int16 numpy (T, 1).
+        """
+        if not self._workers or self._stopping:
+            raise RuntimeError("WorkerPool is not running, call start() first")
+        future = Future()
+        with self._lock:
+            if not self._alive:
+                raise RuntimeError("all WorkerPool workers died")
+            job_id = self._next_id
+            self._next_id += 1
+            self._futures[job_id] = future
+            self._stats["requests"] += 1
+            self._queue.append((job_id, audio_prompt, text, self.infer_mode, kwargs))
+            self._dispatch()
+        return future
+
+    def synthesize(self, audio_prompt, text: str, output_path=None, timeout=None, **kwargs):
+        """
+        Blocking ``submit()``, save the audio to ``output_path`` if given and return the path,
+        otherwise return ``(sampling_rate, wav)``.
+        """
+        sampling_rate, wav = self.submit(audio_prompt, text, **kwargs).result(timeout=timeout)
+        if output_path:
+            torchaudio.save(output_path, torch.from_numpy(wav.T), sampling_rate)
+            return output_path
+        return sampling_rate, wav
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        stats["workers"] = self.num_workers
+        stats["alive_workers"] = len(self._alive)
+        stats["threads_per_worker"] = self.threads_per_worker
+        stats["jobs_per_worker"] = list(self._worker_jobs)
+        if self._workers:
+            # share of the wall time the workers spent in jobs
+            stats["utilization"] = stats["busy_time"] / ((time.perf_counter() - self._start_time) * self.num_workers)
+        return stats
+
+    def _dispatch(self):
+        """Send the queued jobs to the idle workers, with ``_lock`` held."""
+        while self._queue and self._idle:
+            worker_id = self._idle.pop()
+            job = self._queue.popleft()
+            try:
+                self._conns[worker_id].send(job)
+            except OSError:
+                # the worker died, the collector removes it
+                self._queue.appendleft(job)
+                continue
+            self._running[worker_id] = job[0]
+
+    def _collect(self):
+        while True:
+            with self._lock:
+                conns = {self._conns[worker_id]: worker_id for worker_id in self._alive}
+                sentinels = {self._workers[worker_id].sentinel: worker_id for worker_id in self._alive}
+            if not conns:
+                return
+            # the sentinel of a process is ready once it exited, the timeout only bounds the wait
+            ready = wait(list(conns) + list(sentinels), timeout=self.poll_interval)
+            for obj in ready:
+                if obj in conns:
+                    self._receive(conns[obj])
+            for worker_id in sentinels.values():
+                if self._workers[worker_id].exitcode is not None:
+                    self._worker_exited(worker_id)
+
+    def _receive(self, worker_id: int) -> bool:
+        try:
+            job_id, result, elapsed = self._conns[worker_id].recv()
+        except (EOFError, OSError):
+            return False
+        with self._lock:
+            future = self._futures.pop(job_id, None)
+            self._stats["busy_time"] += elapsed
+            self._worker_jobs[worker_id] += 1
+            self._stats["failed" if isinstance(result, Exception) else "completed"] += 1
+            if self._running.get(worker_id) == job_id:
+                del self._running[worker_id]
+                if worker_id in self._alive:
+                    self._idle.append(worker_id)
+                    self._dispatch()
+            self._changed.notify_all()
+        if future is not None:
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+        return True
+
+    def _worker_exited(self, worker_id: int):
+        """Fail the job of a worker that exited without sending its result, and the queue if no worker is left."""
+        process = self._workers[worker_id]
+        with self._lock:
+            self._alive.discard(worker_id)
+            if worker_id in self._idle:
+                self._idle.remove(worker_id)
+        # a result sent just before the exit is still in the pipe
+        conn = self._conns[worker_id]
+        while conn.poll() and self._receive(worker_id):
+            pass
+        failed = []
+        with self._lock:
+            if not self._stopping or process.exitcode != 0:
+                self._stats["dead_workers"] += 1
+            job_id = self._running.pop(worker_id, None)
+            if job_id in self._futures:
+                failed.append(self._futures.pop(job_id))
+            if not self._alive:
+                failed.extend(self._futures.pop(job[0]) for job in self._queue if job[0] in self._futures)
+                self._queue.clear()
+            self._stats["failed"] += len(failed)
+            self._changed.notify_all()
+        for future in failed:
+            future.set_exception(RuntimeError(
+                f"WorkerPool worker {worker_id} (pid {process.pid}) died with exit code {process.exitcode}"))
+
+
+def memory_usage(pid: Optional[int] = None) -> Dict[str, int]:
+    """
+    Resident and proportional set size of a process (``/proc/<pid>/smaps_rollup``, Linux only), the PSS counts
+    pages shared by ``n`` processes as ``1/n``, so summed over the pool it is the real memory use.
+    """
+    values = {}
+    with open(f"/proc/{pid or os.getpid()}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                values[name.lower()] = int(rest.split()[0]) * 1024
+    return values
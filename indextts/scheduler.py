@@ -0,0 +1,386 @@
+"""
+Batch sentences of synthesis requests from independent callers into shared GPT batches.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torchaudio
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.gpt.continuous_batching import ContinuousBatchDecoder
+from indextts.gpt.kv_cache import cat_prefix_kv
+from indextts.utils.voice_cache import VoiceConditioning
+
+GENERATION_DEFAULTS = {
+    "do_sample": True,
+    "top_p": 0.8,
+    "top_k": 30,
+    "temperature": 1.0,
+    "length_penalty": 0.0,
+    "num_beams": 3,
+    "repetition_penalty": 10.0,
+    "max_mel_tokens": 600,
+}
+
+
+class SynthesisRequest:
+    """
+    One ``BatchScheduler.submit()`` call: the sentences of one text synthesized with one voice.
+    """
+
+    def __init__(self, audio_prompt, sentences: List[List[int]], generation_kwargs: Dict, future: Future,
+                 max_batch_size: Optional[int] = None, progress: Optional[Callable[[int, int], None]] = None):
+        self.audio_prompt = audio_prompt
+        self.sentences = sentences
+        self.generation_kwargs = generation_kwargs
+        self.max_batch_size = max_batch_size
+        self.progress = progress
+        # sentences can only share a batch if they are generated with the same parameters and batch size limit
+        self.group_key = (tuple(sorted(generation_kwargs.items())), max_batch_size)
+        self.future = future
+        self.voice: Optional[VoiceConditioning] = None
+        self.wavs: List[Optional[torch.Tensor]] = [None] * len(sentences)
+        self.remaining = len(sentences)
+        self.submit_time = time.perf_counter()
+
+
+class SentenceJob:
+    def __init__(self, request: SynthesisRequest, idx: int):
+        self.request = request
+        self.idx = idx
+        self.text_tokens = request.sentences[idx]
+
+    def __len__(self):
+        return len(self.text_tokens)
+
+
+class BatchScheduler:
+    """
+    Continuous batching scheduler for ``IndexTTS``.
+
+    Callers on any thread ``submit()`` a voice and a text and get a ``Future``. A single worker thread
+    owns the models: it collects the pending sentences of all callers, groups sentences with the same
+    generation parameters and similar lengths into one padded batch, and generates them with
+    ``UnifiedVoice.inference_speech`` using per-row conditioning latents, so different voices share a batch.
+    Finished sentences are vocoded with the voice of their request and a request's future is resolved
+    once all of its sentences are done.
+
+    Args:
+        tts: the ``IndexTTS`` instance, it must not be used by other threads outside of ``exclusive()``
+        max_batch_size: maximum number of sentences per GPT batch
+        max_wait_ms: time to wait for more requests after the first pending sentence before running a partial batch
+        max_text_tokens_per_sentence: sentence split length for submitted texts
+        iteration_level: schedule at every decode step with ``ContinuousBatchDecoder`` instead of running
+            whole batches with ``inference_speech``, finished sentences leave the batch and pending sentences join it
+            immediately. Beam search is not supported in this mode, ``num_beams`` and ``length_penalty`` are ignored.
+    """
+
+    def __init__(self, tts, max_batch_size=8, max_wait_ms=20, max_text_tokens_per_sentence=100, iteration_level=False):
+        self.tts = tts
+        self.iteration_level = iteration_level
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_text_tokens_per_sentence = max_text_tokens_per_sentence
+        self.sampling_rate = 24000
+        self._pending: List[SentenceJob] = []
+        self._cond = threading.Condition()
+        self._model_lock = threading.RLock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._stats = {"requests": 0, "sentences": 0, "batches": 0, "decode_steps": 0, "generated_tokens": 0,
+                       "gpt_gen_time": 0.0, "gpt_forward_time": 0.0, "bigvgan_time": 0.0}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stopped = False
+        target = self._run_iterations if self.iteration_level else self._run
+        self._thread = threading.Thread(target=target, name="tts-batch-scheduler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the worker, requests that are still pending fail with ``RuntimeError``, also the requests
+        with sentences in the decoder of the iteration-level mode.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._cond:
+            pending, self._pending = self._pending, []
+        for job in pending:
+            if not job.request.future.done():
+                job.request.future.set_exception(RuntimeError("BatchScheduler stopped"))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def exclusive(self):
+        """Hold the models while using ``tts`` directly, e.g. ``with scheduler.exclusive(): tts.infer(...)``."""
+        with self._model_lock:
+            yield self.tts
+
+    def submit(self, audio_prompt, text: str, max_text_tokens_per_sentence=None, sentences_bucket_max_size=None,
+               progress: Optional[Callable[[int, int], None]] = None, **generation_kwargs) -> Future:
+        """
+        Queue ``text`` for synthesis with the voice of ``audio_prompt`` (reference audio, ``.voice`` profile
+        or ``VoiceConditioning``). The future resolves to ``(sampling_rate, wav)`` with ``wav`` int16 numpy (T, 1),
+        the same format as ``IndexTTS.infer(output_path=None)``.
+
+        ``sentences_bucket_max_size`` caps the size of the batches the sentences of this request are part of,
+        like the argument of ``IndexTTS.infer_fast``. ``progress(done, total)`` is called on the worker thread
+        every time a sentence of the request is done, it must not block.
+        """
+        future = Future()
+        max_tokens = max_text_tokens_per_sentence or self.max_text_tokens_per_sentence
+        text_tokens_list = self.tts.tokenizer.tokenize(text)
+        sentences = self.tts.tokenizer.split_sentences(text_tokens_list, max_tokens)
+        sentences = [self.tts.tokenizer.convert_tokens_to_ids(sent) for sent in sentences]
+        sentences = [sent for sent in sentences if len(sent) > 0]
+        if len(sentences) == 0:
+            future.set_exception(ValueError("text is empty"))
+            return future
+        generation_kwargs = {**GENERATION_DEFAULTS, **generation_kwargs}
+        request = SynthesisRequest(audio_prompt, sentences, generation_kwargs, future,
+                                   max_batch_size=sentences_bucket_max_size, progress=progress)
+        with self._cond:
+            if self._stopped or self._thread is None:
+                raise RuntimeError("BatchScheduler is not running, call start() first")
+            self._pending.extend(SentenceJob(request, i) for i in range(len(sentences)))
+            self._stats["requests"] += 1
+            self._cond.notify_all()
+        return future
+
+    def synthesize(self, audio_prompt, text: str, output_path=None, timeout=None, **kwargs):
+        """
+        Blocking ``submit()``, save the audio to ``output_path`` if given and return the path,
+        otherwise return ``(sampling_rate, wav)``.
+        """
+        sampling_rate, wav = self.submit(audio_prompt, text, **kwargs).result(timeout=timeout)
+        if output_path:
+            torchaudio.save(output_path, torch.from_numpy(wav.T), sampling_rate)
+            return output_path
+        return sampling_rate, wav
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        stats["pending"] = len(self._pending)
+        if self.iteration_level:
+            # average number of running rows per decode step
+            stats["avg_batch_size"] = stats["generated_tokens"] / stats["decode_steps"] if stats["decode_steps"] else 0.0
+        else:
+            stats["avg_batch_size"] = stats["sentences"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                # give other callers a moment to join the batch
+                deadline = self._pending[0].request.submit_time + self.max_wait_ms / 1000
+                while len(self._pending) < self.max_batch_size and not self._stopped:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._stopped:
+                    return
+                batch = self._next_batch()
+            self._run_batch(batch)
+
+    def _next_batch(self) -> List[SentenceJob]:
+        """
+        The oldest pending sentence and up to ``max_batch_size - 1`` compatible sentences closest to it in length.
+        """
+        oldest = self._pending[0]
+        candidates = [job for job in self._pending if job.request.group_key == oldest.request.group_key]
+        candidates.sort(key=lambda job: abs(len(job) - len(oldest)))
+        batch = candidates[:self._batch_size(oldest.request)]
+        selected = set(id(job) for job in batch)
+        self._pending = [job for job in self._pending if id(job) not in selected]
+        return batch
+
+    def _run_batch(self, batch: List[SentenceJob]):
+        with self._model_lock:
+            batch = self._prepare_voices(batch)
+            if not batch:
+                return
+            try:
+                wavs = self._synthesize_batch(batch)
+            except Exception as e:
+                for job in batch:
+                    self._fail(job.request, e)
+                return
+        for job, wav in zip(batch, wavs):
+            self._complete(job, wav)
+
+    def _run_iterations(self):
+        """
+        Worker loop of the iteration-level mode: a ``ContinuousBatchDecoder`` runs one decode step at a time,
+        compatible pending sentences are admitted between steps and finished rows are vocoded right away.
+        """
+        decoder: Optional[ContinuousBatchDecoder] = None
+        group_key = None
+        while True:
+            with self._cond:
+                while not self._pending and (decoder is None or len(decoder) == 0) and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    break
+                if (decoder is None or len(decoder) == 0) and self._pending:
+                    group_key = self._pending[0].request.group_key
+                    decoder = self._new_decoder(self._pending[0].request)
+                free = decoder.max_batch_size - len(decoder)
+                admitted = [job for job in self._pending if job.request.group_key == group_key][:max(0, free)]
+                if admitted:
+                    selected = set(id(job) for job in admitted)
+                    self._pending = [job for job in self._pending if id(job) not in selected]
+            with self._model_lock:
+                # the other sentences of a failed request are not decoded further
+                decoder.remove([row for row in decoder.pending() if row.payload.request.future.done()])
+                for job in self._prepare_voices(admitted):
+                    text_tokens = torch.tensor(job.text_tokens, dtype=torch.int32, device=self.tts.device)
+                    decoder.add(text_tokens, job.request.voice.gpt_cond_latent, payload=job,
+                                prefix_kv=self.tts.get_prefix_kv(job.request.voice))
+                    self._stats["sentences"] += 1
+                autocast = dict(device_type=torch.device(self.tts.device).type,
+                                enabled=self.tts.dtype is not None, dtype=self.tts.dtype)
+                m_start_time = time.perf_counter()
+                generated_tokens = decoder.generated_tokens
+                try:
+                    with torch.amp.autocast(**autocast):
+                        finished = decoder.step()
+                except Exception as e:
+                    for row in decoder.pending():
+                        self._fail(row.payload.request, e)
+                    decoder = None
+                    continue
+                self._stats["gpt_gen_time"] += time.perf_counter() - m_start_time
+                self._stats["decode_steps"] += 1
+                self._stats["generated_tokens"] += decoder.generated_tokens - generated_tokens
+                results = []
+                for row in finished:
+                    job = row.payload
+                    if job.request.future.done():
+                        continue
+                    try:
+                        codes = row.output().to(self.tts.device)
+                        text_tokens = row.text_tokens.unsqueeze(0)
+                        results.append((job, self._vocode(job.request.voice, text_tokens, codes)))
+                    except Exception as e:
+                        self._fail(job.request, e)
+            for job, wav in results:
+                self._complete(job, wav)
+        # `stop()` only fails the sentences that were not admitted
+        error = RuntimeError("BatchScheduler stopped")
+        for row in decoder.pending() if decoder is not None else []:
+            self._fail(row.payload.request, error)
+
+    def _batch_size(self, request: SynthesisRequest) -> int:
+        """max batch size of the group of ``request``"""
+        return min(self.max_batch_size, request.max_batch_size or self.max_batch_size)
+
+    def _new_decoder(self, request: SynthesisRequest) -> ContinuousBatchDecoder:
+        generation_kwargs = request.generation_kwargs
+        return ContinuousBatchDecoder(self.tts.gpt, max_batch_size=self._batch_size(request),
+                                      max_generate_length=generation_kwargs["max_mel_tokens"],
+                                      do_sample=generation_kwargs["do_sample"],
+                                      top_p=generation_kwargs["top_p"],
+                                      top_k=generation_kwargs["top_k"],
+                                      temperature=generation_kwargs["temperature"],
+                                      repetition_penalty=generation_kwargs["repetition_penalty"])
+
+    def _complete(self, job: SentenceJob, wav: torch.Tensor):
+        request = job.request
+        if request.future.done():
+            return
+        request.wavs[job.idx] = wav
+        request.remaining -= 1
+        if request.progress is not None:
+            request.progress(len(request.sentences) - request.remaining, len(request.sentences))
+        if request.remaining == 0:
+            wav = torch.cat(request.wavs, dim=1)
+            request.wavs = []
+            request.future.set_result((self.sampling_rate, wav.type(torch.int16).numpy().T))
+
+    def _prepare_voices(self, batch: List[SentenceJob]) -> List[SentenceJob]:
+        for job in batch:
+            request = job.request
+            if request.voice is None and not request.future.done():
+                try:
+                    request.voice = self.tts.get_voice_conditioning(request.audio_prompt)
+                except Exception as e:
+                    self._fail(request, e)
+        return [job for job in batch if not job.request.future.done()]
+
+    def _fail(self, request: SynthesisRequest, error: Exception):
+        if not request.future.done():
+            request.future.set_exception(error)
+        with self._cond:
+            self._pending = [job for job in self._pending if job.request is not request]
+
+    def _synthesize_batch(self, batch: List[SentenceJob]) -> List[torch.Tensor]:
+        tts = self.tts
+        device = tts.device
+        generation_kwargs = dict(batch[0].request.generation_kwargs)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens")
+        text_tokens = [torch.tensor(job.text_tokens, dtype=torch.int32, device=device).unsqueeze(0) for job in batch]
+        # right padding with stop_text_token, `prepare_gpt_inputs()` moves the padding before the text
+        batch_text_tokens = pad_sequence([t.squeeze(0) for t in text_tokens], batch_first=True,
+                                         padding_value=tts.cfg.gpt.stop_text_token)
+        voices = [job.request.voice for job in batch]
+        # (b, 32, dim), one row of conditioning latents per sentence
+        conds_latent = torch.cat([voice.gpt_cond_latent for voice in voices], dim=0)
+        prefixes = [tts.get_prefix_kv(voice) for voice in voices]
+        prefix_kv = cat_prefix_kv(prefixes) if all(p is not None for p in prefixes) else None
+        autocast = dict(device_type=batch_text_tokens.device.type, enabled=tts.dtype is not None, dtype=tts.dtype)
+
+        m_start_time = time.perf_counter()
+        with torch.no_grad(), torch.amp.autocast(**autocast):
+            batch_codes = tts.gpt.inference_speech(voices[0].cond_mel, batch_text_tokens,
+                                                   conds_latent=conds_latent,
+                                                   prefix_kv=prefix_kv,
+                                                   num_return_sequences=1,
+                                                   max_generate_length=max_mel_tokens,
+                                                   **generation_kwargs)
+        self._stats["gpt_gen_time"] += time.perf_counter() - m_start_time
+        self._stats["batches"] += 1
+        self._stats["sentences"] += len(batch)
+        self._stats["generated_tokens"] += batch_codes.numel()
+        return [self._vocode(voice, tokens, batch_codes[i:i + 1])
+                for i, (tokens, voice) in enumerate(zip(text_tokens, voices))]
+
+    def _vocode(self, voice: VoiceConditioning, text_tokens: torch.Tensor, codes: torch.Tensor) -> torch.Tensor:
+        """codes (1, n) of one sentence -> waveform (1, T) in int16 range on cpu"""
+        tts = self.tts
+        device = text_tokens.device
+        codes, code_lens = tts.remove_long_silence(codes, silent_token=52, max_consecutive=30)
+        autocast = dict(device_type=device.type, enabled=tts.dtype is not None, dtype=tts.dtype)
+        with torch.no_grad(), torch.amp.autocast(**autocast):
+            m_start_time = time.perf_counter()
+            latent = tts.gpt(voice.cond_mel, text_tokens, torch.tensor([text_tokens.shape[-1]], device=device), codes,
+                             code_lens * tts.gpt.mel_length_compression,
+                             cond_mel_lengths=voice.cond_mel_lengths,
+                             return_latent=True, clip_inputs=False, conds_latent=voice.gpt_cond_latent)
+            self._stats["gpt_forward_time"] += time.perf_counter() - m_start_time
+            m_start_time = time.perf_counter()
+            wav, _ = tts.bigvgan(latent, voice.cond_mel.transpose(1, 2), prepared_voice=tts.get_vocoder_voice(voice))
+            self._stats["bigvgan_time"] += time.perf_counter() - m_start_time
+        wav = torch.clamp(32767 * wav.squeeze(1).float(), -32767.0, 32767.0)
+        return wav.cpu()
@@ -0,0 +1,397 @@
+"""
+HTTP API for ``IndexTTS`` on asyncio, without dependencies beyond the standard library.
+
+```
+python -m indextts.server --model-dir checkpoints --voices-dir voices --port 8000
+curl -X POST localhost:8000/synthesize -d '{"text": "你好", "voice": "speaker"}' -o out.wav
+curl -N -X POST localhost:8000/stream -d '{"text": "你好", "voice": "speaker", "format": "pcm"}' | aplay -f S16_LE -r 24000
+```
+
+Endpoints:
+    ``GET /health``: status, queued and running jobs.
+    ``GET /voices``: the voices of ``--voices-dir``, reference audios and ``.voice`` profiles by file stem.
+    ``POST /synthesize``: JSON ``{"text", "voice", "format": "wav" | "pcm", "timeout", <generation kwargs>}``,
+        the whole audio once synthesized.
+    ``POST /stream``: same body, a chunked response that sends the audio of every sentence as soon as it is vocoded,
+        a WAV stream starts with a header of unknown length.
+
+A single worker thread owns the model and runs one job at a time from a bounded queue, requests that find the
+queue full are rejected with 429. Every job has a deadline (``timeout`` seconds after it was received): a job whose
+deadline passes while queued is dropped with 504, a running job stops generating after the current token, a stream is
+then cut short. The job of a client that disconnects is cancelled the same way: the connection is watched while a job
+is queued or running and a reset cancels it, as does a failed write of the response. An EOF alone is not a disconnect,
+a client may half-close its side once the request is sent.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from typing import Dict, Optional
+
+from indextts.scheduler import GENERATION_DEFAULTS
+from indextts.utils.voice_cache import VOICE_PROFILE_EXT
+
+AUDIO_EXTS = (".wav", ".mp3", ".flac", VOICE_PROFILE_EXT)
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error",
+               503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+def parse_bool(value) -> bool:
+    """JSON booleans and the strings "true"/"false", "1"/"0", ``bool("false")`` would be True."""
+    if value in (True, "true", "1"):
+        return True
+    if value in (False, "false", "0"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+# generation parameters a request may set, with the function that converts them
+GENERATION_KWARGS = {key: parse_bool if isinstance(value, bool) else type(value)
+                     for key, value in GENERATION_DEFAULTS.items()}
+GENERATION_KWARGS["max_text_tokens_per_sentence"] = int
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def wav_header(sampling_rate: int, num_samples: Optional[int] = None, channels=1, sample_width=2) -> bytes:
+    """
+    RIFF/WAVE header of 16-bit PCM. Without ``num_samples`` the sizes are set to the maximum,
+    players read such a stream until its end.
+    """
+    data_size = 0xFFFFFFFF - 36 if num_samples is None else num_samples * channels * sample_width
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", data_size + 36, b"WAVE", b"fmt ", 16, 1, channels,
+                       sampling_rate, sampling_rate * channels * sample_width, channels * sample_width,
+                       sample_width * 8, b"data", data_size)
+
+
+class SynthesisJob:
+    """One request, the worker pushes the PCM bytes of every chunk, then ``None``, or the exception it failed with."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, voice: str, text: str, generation_kwargs: Dict,
+                 deadline: float):
+        self.loop = loop
+        self.voice = voice
+        self.text = text
+        self.generation_kwargs = generation_kwargs
+        self.deadline = deadline
+        self.chunks: asyncio.Queue = asyncio.Queue()
+        self.cancelled = False
+        self.stopped = False
+
+    def expired(self) -> bool:
+        return time.monotonic() > self.deadline
+
+    def should_stop(self) -> bool:
+        """Called by the generation after every token, true once the job is cancelled or past its deadline."""
+        if self.cancelled or self.expired():
+            self.stopped = True
+        return self.stopped
+
+    def push(self, item):
+        self.loop.call_soon_threadsafe(self.chunks.put_nowait, item)
+
+
+class TTSServer:
+    """
+    Args:
+        tts: the ``IndexTTS`` instance, only used by the worker thread
+        voices_dir: directory of the reference audios and ``.voice`` profiles requests can use by name
+        max_queue: number of jobs that may wait for the worker, more are rejected with 429
+        timeout: default deadline of a job in seconds, requests can lower it
+        max_body_bytes: largest accepted request body
+    """
+
+    def __init__(self, tts, voices_dir: str, max_queue=8, timeout=120.0, max_body_bytes=1 << 20):
+        self.tts = tts
+        self.voices_dir = voices_dir
+        self.timeout = timeout
+        self.max_body_bytes = max_body_bytes
+        self.sampling_rate = 24000
+        self._jobs: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._running: Optional[SynthesisJob] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"requests": 0, "rejected": 0, "expired": 0, "cancelled": 0, "failed": 0, "completed": 0}
+
+    def voices(self) -> Dict[str, str]:
+        voices = {}
+        for name in sorted(os.listdir(self.voices_dir)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in AUDIO_EXTS:
+                # a profile is preferred over the audio it was exported from
+                if stem not in voices or ext == VOICE_PROFILE_EXT:
+                    voices[stem] = os.path.join(self.voices_dir, name)
+        return voices
+
+    def health(self) -> Dict:
+        return dict(status="ok", queued=self._jobs.qsize(), max_queue=self._jobs.maxsize,
+                    running=self._running is not None, **self._stats)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._work, name="tts-server-worker", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._jobs.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            if job.cancelled:
+                self._stats["cancelled"] += 1
+                job.push(ConnectionError("client disconnected while queued"))
+                continue
+            if job.expired():
+                self._stats["expired"] += 1
+                job.push(HTTPError(504, "deadline exceeded while queued"))
+                continue
+            self._running = job
+            try:
+                chunks = self.tts.infer_stream(job.voice, job.text, should_stop=job.should_stop,
+                                               **job.generation_kwargs)
+                try:
+                    for chunk in chunks:
+                        if job.should_stop():
+                            break
+                        job.push(chunk.numpy().tobytes())
+                finally:
+                    chunks.close()
+                # a stopped stream ends early without an error, the job tells why
+                if not job.stopped:
+                    self._stats["completed"] += 1
+                    job.push(None)
+                elif job.cancelled:
+                    self._stats["cancelled"] += 1
+                    job.push(ConnectionError("client disconnected"))
+                else:
+                    self._stats["expired"] += 1
+                    job.push(HTTPError(504, "deadline exceeded"))
+            except Exception as e:
+                self._stats["failed"] += 1
+                job.push(e)
+            finally:
+                self._running = None
+
+    def submit(self, body: Dict) -> SynthesisJob:
+        """Validate a request body and queue its job, raise ``HTTPError`` 400/404/429."""
+        text = body.get("text")
+        if not isinstance(text, str) or not text.strip():
+            raise HTTPError(400, "`text` must be a non-empty string")
+        voices = self.voices()
+        if body.get("voice") not in voices:
+            raise HTTPError(404, f"unknown voice: {body.get('voice')!r}")
+        generation_kwargs = {}
+        for key, value in body.items():
+            if key in GENERATION_KWARGS:
+                try:
+                    generation_kwargs[key] = GENERATION_KWARGS[key](value)
+                except (TypeError, ValueError):
+                    raise HTTPError(400, f"invalid `{key}`: {value!r}")
+        try:
+            timeout = min(float(body.get("timeout", self.timeout)), self.timeout)
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"invalid `timeout`: {body.get('timeout')!r}")
+        job = SynthesisJob(asyncio.get_running_loop(), voices[body["voice"]], text.strip(), generation_kwargs,
+                           deadline=time.monotonic() + timeout)
+        self._stats["requests"] += 1
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            self._stats["rejected"] += 1
+            raise HTTPError(429, "too many queued requests", {"Retry-After": "1"})
+        return job
+
+    async def _next_chunk(self, job: SynthesisJob):
+        """The next PCM bytes of ``job``, ``None`` at its end, raise what the worker failed with."""
+        item = await job.chunks.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        job = watcher = None
+        try:
+            method, path, headers, body = await self._read_request(reader)
+            route = path.split("?", 1)[0].rstrip("/")
+            if route == "/health":
+                await self._send_json(writer, 200, self.health())
+            elif route == "/voices":
+                await self._send_json(writer, 200, {"voices": list(self.voices())})
+            elif route in ("/synthesize", "/stream"):
+                if method != "POST":
+                    raise HTTPError(405, f"{method} {route}")
+                try:
+                    request = json.loads(body or b"{}")
+                except ValueError:
+                    raise HTTPError(400, "the body must be a JSON object")
+                if not isinstance(request, dict):
+                    raise HTTPError(400, "the body must be a JSON object")
+                fmt = request.get("format", "wav")
+                if fmt not in ("wav", "pcm"):
+                    raise HTTPError(400, f"unknown format: {fmt!r}")
+                job = self.submit(request)
+                watcher = asyncio.ensure_future(self._watch_disconnect(reader, job))
+                if route == "/stream":
+                    await self._send_stream(writer, job, fmt)
+                else:
+                    await self._send_audio(writer, job, fmt)
+            else:
+                raise HTTPError(404, f"no such endpoint: {route}")
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {"error": str(e)}, e.headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            await self._send_json(writer, 500, {"error": f"{type(e).__name__}: {e}"})
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if job is not None:
+                job.cancelled = True
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def _watch_disconnect(reader: asyncio.StreamReader, job: SynthesisJob):
+        """
+        Cancel ``job`` if the connection is reset, the request was read already. An EOF is a half-close of the client
+        and ends the watch only, a client that closed the connection entirely is noticed by the write of the response.
+        """
+        try:
+            while await reader.read(1 << 16):
+                pass
+        except ConnectionError:
+            job.cancelled = True
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise HTTPError(400, "malformed request line")
+        method, path, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "invalid Content-Length")
+        if length > self.max_body_bytes:
+            raise HTTPError(413, f"the body is larger than {self.max_body_bytes} bytes")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method.upper(), path, headers, body
+
+    @staticmethod
+    def _head(status: int, headers: Dict[str, str]) -> bytes:
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", "Connection: close"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, data, headers: Optional[Dict] = None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        writer.write(self._head(status, {"Content-Type": "application/json", "Content-Length": str(len(body)),
+                                         **(headers or {})}) + body)
+        await writer.drain()
+
+    def _audio_headers(self, fmt: str) -> Dict[str, str]:
+        if fmt == "wav":
+            return {"Content-Type": "audio/wav"}
+        return {"Content-Type": f"audio/L16;rate={self.sampling_rate};channels=1",
+                "X-Sample-Rate": str(self.sampling_rate), "X-Sample-Format": "s16le"}
+
+    async def _send_audio(self, writer: asyncio.StreamWriter, job: SynthesisJob, fmt: str):
+        pcm = []
+        while True:
+            chunk = await self._next_chunk(job)
+            if chunk is None:
+                break
+            pcm.append(chunk)
+        data = b"".join(pcm)
+        if fmt == "wav":
+            data = wav_header(self.sampling_rate, len(data) // 2) + data
+        writer.write(self._head(200, {**self._audio_headers(fmt), "Content-Length": str(len(data))}) + data)
+        await writer.drain()
+
+    async def _send_stream(self, writer: asyncio.StreamWriter, job: SynthesisJob, fmt: str):
+        # the status is only sent with the first chunk, errors before it are still reported as such
+        chunk = await self._next_chunk(job)
+        writer.write(self._head(200, {**self._audio_headers(fmt), "Transfer-Encoding": "chunked"}))
+        if fmt == "wav":
+            chunk = wav_header(self.sampling_rate) + (chunk or b"")
+        try:
+            while chunk is not None:
+                if chunk:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    await writer.drain()
+                chunk = await self._next_chunk(job)
+        except ConnectionError:
+            # the write failed, the client is gone: the worker stops at its next token
+            job.cancelled = True
+            raise
+        except Exception as e:
+            # too late to change the status, the client sees a shorter stream
+            print(f">> stream cut short: {e}")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        self.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f">> IndexTTS server listening on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IndexTTS HTTP server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model-dir", type=str, default="checkpoints")
+    parser.add_argument("--config", type=str, default=None, help="Default is <model-dir>/config.yaml")
+    parser.add_argument("--voices-dir", type=str, default="voices",
+                        help="Reference audios and .voice profiles, requests name them by file stem")
+    parser.add_argument("--max-queue", type=int, default=8, help="Queued requests before 429 is returned")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Default and maximum deadline of a request")
+    parser.add_argument("-d", "--device", type=str, default=None, help="Device to run the model on (cpu, cuda, mps).")
+    parser.add_argument("--fp16", action="store_true", default=False, help="Use FP16 for inference if available")
+    parser.add_argument("--quantize", type=str, default=None, choices=["int8"], help="Quantize the GPT weights, CPU only")
+    args = parser.parse_args()
+
+    from indextts.infer import IndexTTS
+    tts = IndexTTS(cfg_path=args.config or os.path.join(args.model_dir, "config.yaml"), model_dir=args.model_dir,
+                   is_fp16=args.fp16, device=args.device, quantize=args.quantize)
+    server = TTSServer(tts, args.voices_dir, max_queue=args.max_queue, timeout=args.timeout)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
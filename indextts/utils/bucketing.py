@@ -0,0 +1,80 @@
+"""
+Sentence bucketing by a budget of padded tokens, and batching of vocoder latents by a budget of padded samples.
+"""
+
+from typing import Callable, Dict, List, Optional
+
+# mel codes per text token, 1 mel code is 1024 samples (~43ms) at 24kHz and a BPE token is roughly
+# one Chinese character or a short English subword
+MEL_TOKENS_PER_TEXT_TOKEN = 5.0
+
+
+def expected_sequence_length(text_len: int, mel_ratio: float = MEL_TOKENS_PER_TEXT_TOKEN) -> int:
+    """Tokens one sentence occupies in a GPT batch: [start][text][stop] and the expected mel codes."""
+    return text_len + 2 + int(round(text_len * mel_ratio))
+
+
+def bucket_by_token_budget(items: List[Dict], max_tokens: int, max_batch_size: Optional[int] = None,
+                           mel_ratio: float = MEL_TOKENS_PER_TEXT_TOKEN) -> List[List[Dict]]:
+    """
+    Group sentences so that every bucket costs at most ``max_tokens`` padded tokens,
+    ``len(bucket) * expected_sequence_length(longest)``, short sentences share a bucket with many others
+    while long sentences get small buckets.
+
+    Args:
+        items: dicts with the text token count in ``"len"``, e.g. from ``IndexTTS.bucket_sentences()``
+        max_tokens: budget of padded tokens per bucket, a sentence longer than the budget gets a bucket of its own
+        max_batch_size: optional limit of sentences per bucket
+        mel_ratio: expected mel codes per text token
+    Returns:
+        buckets of ``items``, sorted from the longest to the shortest sentences
+    """
+    buckets: List[List[Dict]] = []
+    bucket_len = 0
+    for item in sorted(items, key=lambda x: x["len"], reverse=True):
+        if item["len"] == 0:
+            print(">> skip empty sentence")
+            continue
+        if buckets:
+            # sorted by length, the first sentence of a bucket is its longest one
+            size = len(buckets[-1]) + 1
+            if size * bucket_len <= max_tokens and (max_batch_size is None or size <= max_batch_size):
+                buckets[-1].append(item)
+                continue
+        buckets.append([item])
+        bucket_len = expected_sequence_length(item["len"], mel_ratio)
+    return buckets
+
+
+def padding_waste(buckets: List[List[Dict]], length_fn: Optional[Callable[[Dict], int]] = None) -> float:
+    """
+    Share of padded slots in the batches of ``buckets``: ``1 - useful tokens / (batch size * longest)`` over all buckets.
+    ``length_fn`` gives the length of an item, ``expected_sequence_length(item["len"])`` by default.
+    """
+    if length_fn is None:
+        length_fn = lambda item: expected_sequence_length(item["len"])
+    useful = 0
+    padded = 0
+    for bucket in buckets:
+        lengths = [length_fn(item) for item in bucket]
+        if not lengths:
+            continue
+        useful += sum(lengths)
+        padded += len(lengths) * max(lengths)
+    return 1.0 - useful / padded if padded > 0 else 0.0
+
+
+def bucket_lengths_by_budget(lengths: List[int], max_padded: int) -> List[List[int]]:
+    """
+    Group indices of ``lengths`` so that every group costs at most ``max_padded``, ``len(group) * longest``,
+    an item longer than the budget gets a group of its own. Groups are sorted from the longest to the shortest items.
+    """
+    groups: List[List[int]] = []
+    longest = 0
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        if groups and (len(groups[-1]) + 1) * longest <= max_padded:
+            groups[-1].append(i)
+            continue
+        groups.append([i])
+        longest = lengths[i]
+    return groups
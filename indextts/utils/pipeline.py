@@ -0,0 +1,98 @@
+"""
+Run the stages of inference concurrently: a producer (e.g. the GPT on the caller thread) hands its outputs to a
+consumer stage (e.g. BigVGAN) running on its own thread, so the consumer works on item N while item N+1 is produced.
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import torch
+
+
+class PipelineStage:
+    """
+    A consumer thread applying ``fn`` to every item ``put()`` into it, in order.
+
+    The queue is bounded by ``max_pending`` so the producer can not run arbitrarily far ahead (every queued item holds
+    its tensors). ``close()`` waits for the queued items and returns the results, an exception raised by ``fn`` stops
+    the stage and is re-raised by the next ``put()`` or by ``close()``. A producer that fails itself calls
+    ``close(cancel=True)``, usually from a ``finally``, so the thread does not outlive it. With ``device`` on CUDA the stage runs on its
+    own CUDA stream, items carry an event of the producer stream that the stage waits for before using them.
+
+    Args:
+        fn: called with each item on the stage thread, autocast and ``no_grad`` are thread local and must be set by it
+        name: the name of the stage in ``stats()``
+        max_pending: max number of items waiting for the stage
+        device: the device of the tensors of the items
+    """
+
+    def __init__(self, fn: Callable[[Any], Any], name="stage", max_pending=2, device=None):
+        self.fn = fn
+        self.name = name
+        self.busy_time = 0.0
+        self.items = 0
+        self.results: List[Any] = []
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._cancelled = False
+        self._stream = None
+        if device is not None and torch.device(device).type == "cuda":
+            self._stream = torch.cuda.Stream(device=device)
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name=f"pipeline-{name}", daemon=True)
+        self._thread.start()
+
+    def put(self, item):
+        if self._error is not None:
+            raise self._error
+        event = None
+        if self._stream is not None:
+            event = torch.cuda.Event()
+            event.record()
+        self._queue.put((item, event))
+
+    def close(self, cancel=False) -> List[Any]:
+        """
+        Wait for the queued items and return the results. With ``cancel`` the items that did not start are dropped
+        and the exception of ``fn`` is not raised. Closing a closed stage only returns the results.
+        """
+        if cancel:
+            self._cancelled = True
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None and not cancel:
+            raise self._error
+        return self.results
+
+    def stats(self, wall_time: Optional[float] = None) -> Dict[str, float]:
+        """Busy time and utilization, the share of ``wall_time`` (default: since the stage started) spent in ``fn``."""
+        wall_time = wall_time or time.perf_counter() - self._start_time
+        return {"items": self.items, "busy_time": self.busy_time,
+                "utilization": self.busy_time / wall_time if wall_time > 0 else 0.0}
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            if self._error is not None or self._cancelled:
+                # drain the queue so that the producer is not blocked
+                continue
+            item, event = entry
+            start = time.perf_counter()
+            try:
+                if self._stream is not None:
+                    with torch.cuda.stream(self._stream):
+                        self._stream.wait_event(event)
+                        result = self.fn(item)
+                    self._stream.synchronize()
+                else:
+                    result = self.fn(item)
+                self.results.append(result)
+            except BaseException as e:
+                self._error = e
+            self.busy_time += time.perf_counter() - start
+            self.items += 1
@@ -0,0 +1,128 @@
+"""
+Dynamic int8 quantization of the mel GPT for CPU inference.
+
+The weights of the GPT2 blocks and of ``mel_head`` are stored as int8 with a per-tensor scale, activations stay fp32
+and are quantized on the fly by ``torch.ao.quantization.quantize_dynamic``. The quantized state dict is saved next to
+the fp32 checkpoint (``gpt.pth`` -> ``gpt.int8.pth``), later loads skip the fp32 weights and the quantization.
+The file only holds plain tensors, strings and numbers, so it is read with ``torch.load(weights_only=True)``: the int8
+weights are stored as their integer values, scale and zero point, and rebuilt into quantized tensors on load.
+"""
+
+import os
+import pickle
+import re
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+from transformers.pytorch_utils import Conv1D
+
+QUANTIZE_MODES = ("int8",)
+
+
+def conv1d_to_linear(module: nn.Module) -> nn.Module:
+    """
+    Replace the HuggingFace ``Conv1D`` layers of ``module`` in place by equivalent ``nn.Linear`` layers,
+    ``quantize_dynamic`` only knows the latter. ``Conv1D`` computes ``x @ weight + bias`` with a (in, out) weight.
+    """
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            linear = nn.Linear(child.weight.shape[0], child.weight.shape[1], device=child.weight.device,
+                               dtype=child.weight.dtype)
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                linear.bias.copy_(child.bias)
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+    return module
+
+
+def quantize_gpt(gpt, mode: str = "int8"):
+    """
+    Quantize the GPT2 blocks and ``mel_head`` of an fp32 ``UnifiedVoice`` in place, before
+    ``post_init_gpt2_config()`` builds the inference model around them.
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"unsupported quantize mode: {mode}, expected one of {QUANTIZE_MODES}")
+    conv1d_to_linear(gpt.gpt.h)
+    gpt.gpt.h = torch.ao.quantization.quantize_dynamic(gpt.gpt.h, {nn.Linear}, dtype=torch.qint8)
+    gpt.mel_head = torch.ao.quantization.quantize_dynamic(nn.Sequential(gpt.mel_head), {nn.Linear},
+                                                          dtype=torch.qint8)[0]
+    return gpt
+
+
+def quantized_checkpoint_path(gpt_path: str, mode: str = "int8") -> str:
+    return re.sub(r"(\.pth)?$", f".{mode}.pth", gpt_path, count=1)
+
+
+def _source_info(gpt_path: str):
+    stat = os.stat(gpt_path)
+    return {"size": stat.st_size, "mtime": int(stat.st_mtime), "torch": str(torch.__version__)}
+
+
+def _to_plain_state_dict(state_dict) -> Dict[str, torch.Tensor]:
+    """
+    The state dict of a quantized model without the objects ``weights_only`` can not load: the packed
+    ``(weight, bias)`` of every dynamic quantized ``Linear`` is split into plain tensors and its dtype is dropped,
+    ``quantize_gpt`` sets it again.
+    """
+    plain = {}
+    for key, value in state_dict.items():
+        if isinstance(value, torch.dtype):
+            continue
+        if isinstance(value, tuple):
+            weight, bias = value
+            plain[f"{key}.int_repr"] = weight.int_repr()
+            plain[f"{key}.scale"] = torch.tensor(weight.q_scale(), dtype=torch.float64)
+            plain[f"{key}.zero_point"] = torch.tensor(weight.q_zero_point())
+            if bias is not None:
+                plain[f"{key}.bias"] = bias.detach()
+        else:
+            plain[key] = value
+    return plain
+
+
+def _from_plain_state_dict(plain: Dict[str, torch.Tensor], template) -> Dict:
+    """Inverse of ``_to_plain_state_dict()``, ``template`` is the state dict of the quantized model to load into."""
+    state_dict = OrderedDict()
+    # the module versions, the quantized modules read the legacy layout without them
+    state_dict._metadata = template._metadata
+    for key, value in template.items():
+        if isinstance(value, torch.dtype):
+            state_dict[key] = value
+        elif isinstance(value, tuple):
+            weight = torch._make_per_tensor_quantized_tensor(plain[f"{key}.int_repr"], plain[f"{key}.scale"].item(),
+                                                             int(plain[f"{key}.zero_point"]))
+            state_dict[key] = (weight, plain.get(f"{key}.bias"))
+        else:
+            state_dict[key] = plain[key]
+    return state_dict
+
+
+def save_quantized_gpt(gpt, gpt_path: str, mode: str = "int8", path: Optional[str] = None) -> str:
+    """Save the state dict of a quantized ``UnifiedVoice``, tagged with the fp32 checkpoint it was made from."""
+    path = path or quantized_checkpoint_path(gpt_path, mode)
+    torch.save({"model": _to_plain_state_dict(gpt.state_dict()), "source": _source_info(gpt_path), "mode": mode}, path)
+    return path
+
+
+def load_quantized_gpt(gpt, gpt_path: str, mode: str = "int8", path: Optional[str] = None) -> bool:
+    """
+    Quantize the freshly constructed ``UnifiedVoice`` and load the quantized weights saved from ``gpt_path``.
+    Return False, leaving ``gpt`` untouched, if there is no such file, it was made from another checkpoint
+    or torch version, or it is not a plain tensor file (saved before the format, or not by ``save_quantized_gpt``).
+    """
+    path = path or quantized_checkpoint_path(gpt_path, mode)
+    if not os.path.exists(path):
+        return False
+    try:
+        checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+    except pickle.UnpicklingError:
+        return False
+    if checkpoint.get("mode") != mode or checkpoint.get("source") != _source_info(gpt_path):
+        return False
+    quantize_gpt(gpt, mode)
+    gpt.load_state_dict(_from_plain_state_dict(checkpoint["model"], gpt.state_dict()), strict=True)
+    return True
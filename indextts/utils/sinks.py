@@ -0,0 +1,188 @@
+"""
+Audio output sinks: where synthesized int16 PCM goes, chunk by chunk.
+
+``MemorySink`` keeps the audio as a numpy buffer, ``WavSink`` / ``PCMSink`` / ``EncodedSink`` (FLAC, Opus) write
+a file incrementally, ``BackgroundSink`` moves the writes of any sink to a background thread so the caller goes on
+synthesizing while the previous audio is encoded and written.
+"""
+
+import os
+import wave
+from typing import Any, List, Optional, Union
+
+import numpy as np
+import torch
+
+from indextts.utils.pipeline import PipelineStage
+
+
+def to_pcm16(chunk: Union[np.ndarray, torch.Tensor]) -> np.ndarray:
+    """
+    A mono chunk as 1-D int16 numpy. Accepts the outputs of ``IndexTTS``: int16 or float tensors already scaled
+    to the int16 range, (1, T) from ``infer_stream`` or (T, 1) numpy from ``infer(output_path=None)``.
+    """
+    if isinstance(chunk, torch.Tensor):
+        chunk = chunk.detach().cpu().numpy()
+    chunk = np.asarray(chunk).reshape(-1)
+    return chunk if chunk.dtype == np.int16 else chunk.astype(np.int16)
+
+
+class AudioSink:
+    """Base class, ``write()`` mono chunks then ``close()``, which returns what the sink produced."""
+
+    def __init__(self, sampling_rate: int = 24000):
+        self.sampling_rate = sampling_rate
+        self.samples = 0
+        self.closed = False
+
+    def write(self, chunk: Union[np.ndarray, torch.Tensor]):
+        pcm = to_pcm16(chunk)
+        self._write(pcm)
+        self.samples += pcm.shape[0]
+
+    def _write(self, pcm: np.ndarray):
+        raise NotImplementedError
+
+    def close(self) -> Any:
+        self.closed = True
+
+    @property
+    def seconds(self) -> float:
+        return self.samples / self.sampling_rate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if not self.closed:
+            self.close()
+
+
+class MemorySink(AudioSink):
+    """Keep the chunks in memory, ``close()`` and ``numpy()`` return the whole audio as int16 (T,)."""
+
+    def __init__(self, sampling_rate: int = 24000):
+        super().__init__(sampling_rate)
+        self._chunks: List[np.ndarray] = []
+
+    def _write(self, pcm: np.ndarray):
+        self._chunks.append(pcm)
+
+    def numpy(self) -> np.ndarray:
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0] if self._chunks else np.zeros(0, dtype=np.int16)
+
+    def close(self) -> np.ndarray:
+        super().close()
+        return self.numpy()
+
+
+class _FileSink(AudioSink):
+    def __init__(self, path: str, sampling_rate: int = 24000):
+        super().__init__(sampling_rate)
+        self.path = str(path)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+
+class WavSink(_FileSink):
+    """16-bit mono WAV file, written as the chunks arrive, the header sizes are set by ``close()``."""
+
+    def __init__(self, path: str, sampling_rate: int = 24000):
+        super().__init__(path, sampling_rate)
+        self._file = wave.open(self.path, "wb")
+        self._file.setnchannels(1)
+        self._file.setsampwidth(2)
+        self._file.setframerate(sampling_rate)
+
+    def _write(self, pcm: np.ndarray):
+        self._file.writeframesraw(pcm.astype("<i2", copy=False).tobytes())
+
+    def close(self) -> str:
+        super().close()
+        self._file.close()
+        return self.path
+
+
+class PCMSink(_FileSink):
+    """Headerless little-endian int16 PCM."""
+
+    def __init__(self, path: str, sampling_rate: int = 24000):
+        super().__init__(path, sampling_rate)
+        self._file = open(self.path, "wb")
+
+    def _write(self, pcm: np.ndarray):
+        self._file.write(pcm.astype("<i2", copy=False).tobytes())
+
+    def close(self) -> str:
+        super().close()
+        self._file.close()
+        return self.path
+
+
+class EncodedSink(_FileSink):
+    """
+    Compressed audio through ``soundfile`` (libsndfile): ``"flac"`` or ``"opus"`` (Ogg Opus), by default from the
+    file extension (``.flac``, ``.opus`` / ``.ogg``). The chunks are encoded as they arrive.
+    """
+
+    FORMATS = {"flac": ("FLAC", "PCM_16"), "opus": ("OGG", "OPUS"), "ogg": ("OGG", "OPUS")}
+
+    def __init__(self, path: str, sampling_rate: int = 24000, format: Optional[str] = None):
+        super().__init__(path, sampling_rate)
+        import soundfile
+
+        format = (format or os.path.splitext(self.path)[1].lstrip(".")).lower()
+        if format not in self.FORMATS:
+            raise ValueError(f"unsupported format: {format}, expected one of {list(self.FORMATS)}")
+        container, subtype = self.FORMATS[format]
+        self._file = soundfile.SoundFile(self.path, "w", samplerate=sampling_rate, channels=1, format=container,
+                                         subtype=subtype)
+
+    def _write(self, pcm: np.ndarray):
+        self._file.write(pcm)
+
+    def close(self) -> str:
+        super().close()
+        self._file.close()
+        return self.path
+
+
+class BackgroundSink(AudioSink):
+    """
+    Write to ``sink`` on a background thread, ``write()`` only queues the chunk (at most ``max_pending`` of them)
+    and ``close()`` waits for the queued chunks, closes ``sink`` and returns its result.
+    Errors of the inner sink are raised by the next ``write()`` or by ``close()``.
+    """
+
+    def __init__(self, sink: AudioSink, max_pending: int = 16):
+        super().__init__(sink.sampling_rate)
+        self.sink = sink
+        self._stage = PipelineStage(self._write_chunk, name=f"{type(sink).__name__}-writer", max_pending=max_pending)
+
+    def _write_chunk(self, pcm: np.ndarray):
+        self.sink.write(pcm)
+
+    def _write(self, pcm: np.ndarray):
+        self._stage.put(pcm)
+
+    def close(self) -> Any:
+        super().close()
+        try:
+            self._stage.close()
+        finally:
+            result = self.sink.close()
+        return result
+
+
+def open_sink(path: str, sampling_rate: int = 24000, background=False) -> AudioSink:
+    """A file sink for ``path`` by its extension: ``.wav``, ``.pcm`` / ``.raw``, ``.flac``, ``.opus`` / ``.ogg``."""
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext == ".wav":
+        sink = WavSink(path, sampling_rate)
+    elif ext in (".pcm", ".raw"):
+        sink = PCMSink(path, sampling_rate)
+    else:
+        sink = EncodedSink(path, sampling_rate)
+    return BackgroundSink(sink) if background else sink
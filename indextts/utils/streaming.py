@@ -0,0 +1,150 @@
+"""
+Helpers for streaming synthesis.
+"""
+
+import queue
+
+import torch
+from transformers import StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+
+class Crossfader:
+    """
+    Join consecutive waveform chunks (..., T) with a linear crossfade of ``overlap`` samples.
+
+    The tail of every pushed chunk is held back until the next chunk arrives, so consecutive
+    chunks overlap by ``overlap`` samples. Call ``flush()`` after the last chunk to get the held tail.
+    Chunks pushed with ``crossfade=False`` are appended to the held tail without overlapping.
+    """
+
+    def __init__(self, overlap: int = 0):
+        self.overlap = max(0, int(overlap))
+        self._tail = None
+
+    def push(self, wav: torch.Tensor, crossfade=True) -> torch.Tensor:
+        if self.overlap == 0:
+            return wav
+        if self._tail is not None and not crossfade:
+            wav = torch.cat([self._tail, wav], dim=-1)
+        elif self._tail is not None:
+            n = min(self._tail.shape[-1], wav.shape[-1])
+            if n > 0:
+                fade_in = torch.linspace(0.0, 1.0, n + 2, dtype=wav.dtype, device=wav.device)[1:-1]
+                head = self._tail[..., -n:] * (1.0 - fade_in) + wav[..., :n] * fade_in
+                wav = torch.cat([self._tail[..., :-n], head, wav[..., n:]], dim=-1)
+            else:
+                wav = torch.cat([self._tail, wav], dim=-1)
+        keep = min(self.overlap, wav.shape[-1])
+        self._tail = wav[..., wav.shape[-1] - keep:]
+        return wav[..., :wav.shape[-1] - keep]
+
+    def flush(self) -> torch.Tensor:
+        tail = self._tail
+        self._tail = None
+        if tail is None:
+            return torch.zeros(1, 0)
+        return tail
+
+
+class LatentWindowVocoder:
+    """
+    Vocode a growing GPT latent sequence (1, n, dim) in fixed windows of frames.
+
+    Every window is vocoded together with ``left_context`` frames before it and ``lookahead``
+    frames after it, only the samples of the window itself are kept. Consecutive windows
+    overlap by ``crossfade`` samples taken from the left context and are joined by a linear
+    crossfade, so the concatenated output has exactly ``n * hop_length`` samples.
+
+    Args:
+        vocode_fn: callable mapping latents (1, t, dim) to waveform (1, t * hop_length)
+        hop_length: waveform samples per latent frame
+        window: number of new frames emitted per vocoder call
+        left_context: frames of already emitted audio vocoded again as context
+        lookahead: frames after the window that must be available before it is vocoded
+        crossfade: overlap in samples between consecutive windows, at most ``left_context * hop_length``
+    """
+
+    def __init__(self, vocode_fn, hop_length=1024, window=32, left_context=16, lookahead=8, crossfade=1024):
+        if window <= 0:
+            raise ValueError("window must be positive")
+        self.vocode_fn = vocode_fn
+        self.hop_length = hop_length
+        self.window = window
+        self.left_context = left_context
+        self.lookahead = lookahead
+        self.crossfade = min(crossfade, left_context * hop_length)
+        self.emitted_frames = 0
+        self._crossfader = Crossfader(self.crossfade)
+
+    def _vocode(self, latent: torch.Tensor, end: int, stop: int) -> torch.Tensor:
+        """vocode frames [emitted_frames, end) with context up to frame ``stop``"""
+        begin = self.emitted_frames
+        context_begin = max(0, begin - self.left_context)
+        wav = self.vocode_fn(latent[:, context_begin:stop])
+        offset = (begin - context_begin) * self.hop_length
+        if begin > 0:
+            # start earlier so that the held tail of the previous window is crossfaded, not duplicated
+            offset -= self.crossfade
+        wav = wav[..., offset:(end - context_begin) * self.hop_length]
+        self.emitted_frames = end
+        return self._crossfader.push(wav)
+
+    def push(self, latent: torch.Tensor):
+        """
+        Args:
+            latent: all latent frames available so far (1, n, dim), frames already emitted must not change.
+        Yields:
+            waveform chunks that are final
+        """
+        n = latent.shape[1]
+        while n - self.emitted_frames >= self.window + self.lookahead:
+            end = self.emitted_frames + self.window
+            yield self._vocode(latent, end, min(n, end + self.lookahead))
+
+    def flush(self, latent: torch.Tensor):
+        """
+        Vocode all remaining frames of the final latent sequence (1, n, dim).
+        """
+        yield from self.push(latent)
+        n = latent.shape[1]
+        if n > self.emitted_frames:
+            yield self._vocode(latent, n, n)
+        yield self._crossfader.flush()
+
+
+class CodeStreamer(BaseStreamer):
+    """
+    Streamer for ``GPT2InferenceModel.generate(streamer=...)`` that hands generated mel codes
+    to another thread. Iterate over it to get lists of new codes until generation ends.
+    Only batch size 1 without beam search is supported by ``generate()``.
+
+    ``cancel()`` from the consuming thread stops a generation that also got ``stopping_criteria=streamer.stopping``
+    after its current step.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._skip_prompt = True
+        self.cancelled = False
+        self.stopping = StoppingCriteriaList([lambda input_ids, scores, **kwargs: self.cancelled])
+
+    def cancel(self):
+        self.cancelled = True
+
+    def put(self, value: torch.Tensor):
+        if self._skip_prompt:
+            # the first call carries the prompt input_ids
+            self._skip_prompt = False
+            return
+        self._queue.put(value.view(-1).tolist())
+
+    def end(self):
+        self._queue.put(None)
+
+    def __iter__(self):
+        while True:
+            codes = self._queue.get()
+            if codes is None:
+                return
+            yield codes
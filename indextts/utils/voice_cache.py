@@ -0,0 +1,212 @@
+"""
+Speaker conditioning cache keyed by the content of the reference audio.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import torch
+
+VOICE_PROFILE_EXT = ".voice"
+VOICE_PROFILE_VERSION = 1
+
+
+class VoiceConditioning:
+    """
+    Everything derived from one reference audio that the synthesis pipeline needs:
+
+    - ``cond_mel``: (1, n_mels, frames) mel spectrogram of the reference audio
+    - ``gpt_cond_latent``: (1, 32, dim) perceiver latents from ``UnifiedVoice.get_conditioning()``
+    - ``speaker_embedding``: (1, 1, spk_dim) ECAPA-TDNN embedding from ``BigVGAN.get_speaker_embedding()``
+    - ``gpt_prefix_kv``: KV cache of ``gpt_cond_latent`` from ``UnifiedVoice.get_prefix_kv()``,
+      derived from the latents, so it is not saved in voice profiles
+    - ``vocoder_voice``: speaker conditioning biases of the vocoder from ``BigVGAN.prepare_voice()``,
+      derived from ``speaker_embedding``, not saved either
+    """
+
+    def __init__(self, cond_mel: torch.Tensor, gpt_cond_latent: Optional[torch.Tensor] = None,
+                 speaker_embedding: Optional[torch.Tensor] = None, key: Optional[str] = None,
+                 gpt_prefix_kv: Optional[Tuple[Tuple[torch.Tensor, torch.Tensor], ...]] = None,
+                 vocoder_voice=None):
+        self.key = key
+        self.cond_mel = cond_mel
+        self.gpt_cond_latent = gpt_cond_latent
+        self.speaker_embedding = speaker_embedding
+        self.gpt_prefix_kv = gpt_prefix_kv
+        self.vocoder_voice = vocoder_voice
+
+    @property
+    def cond_mel_frame(self) -> int:
+        return self.cond_mel.shape[-1]
+
+    @property
+    def cond_mel_lengths(self) -> torch.Tensor:
+        return torch.tensor([self.cond_mel_frame], device=self.cond_mel.device)
+
+    def tensors(self) -> Dict[str, torch.Tensor]:
+        return {
+            name: value
+            for name, value in (
+                ("cond_mel", self.cond_mel),
+                ("gpt_cond_latent", self.gpt_cond_latent),
+                ("speaker_embedding", self.speaker_embedding),
+            )
+            if value is not None
+        }
+
+    def nbytes(self) -> int:
+        tensors = list(self.tensors().values())
+        if self.gpt_prefix_kv is not None:
+            tensors.extend(t for layer in self.gpt_prefix_kv for t in layer)
+        if self.vocoder_voice is not None:
+            # the speaker embedding is shared with the voice
+            tensors.extend(self.vocoder_voice.tensors()[1:])
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def to(self, device=None, dtype=None) -> "VoiceConditioning":
+        """
+        Move tensors to ``device``, ``dtype`` only applies to the model latents, ``cond_mel`` stays in float32.
+        """
+        def _to(t, cast):
+            if t is None:
+                return None
+            return t.to(device=device, dtype=dtype if cast and dtype is not None else t.dtype)
+
+        gpt_prefix_kv = None
+        if self.gpt_prefix_kv is not None:
+            gpt_prefix_kv = tuple(tuple(_to(t, True) for t in layer) for layer in self.gpt_prefix_kv)
+        return VoiceConditioning(
+            _to(self.cond_mel, False),
+            _to(self.gpt_cond_latent, True),
+            _to(self.speaker_embedding, True),
+            key=self.key,
+            gpt_prefix_kv=gpt_prefix_kv,
+            vocoder_voice=self.vocoder_voice.to(device=device, dtype=dtype) if self.vocoder_voice is not None else None,
+        )
+
+    def save(self, path: str, model_version=None):
+        """
+        Save as a voice profile (``.voice``) that can be loaded without the reference audio.
+        """
+        if self.gpt_cond_latent is None or self.speaker_embedding is None:
+            raise ValueError("Voice conditioning is incomplete, can not save the voice profile.")
+        data = {
+            "version": VOICE_PROFILE_VERSION,
+            "model_version": model_version,
+            "key": self.key,
+        }
+        for name, value in self.tensors().items():
+            data[name] = value.detach().cpu()
+        torch.save(data, path)
+
+    @classmethod
+    def load(cls, path: str, map_location="cpu", model_version=None) -> "VoiceConditioning":
+        # profiles may come from users, only tensors and plain types are unpickled
+        data = torch.load(path, map_location=map_location, weights_only=True)
+        if not isinstance(data, dict) or "gpt_cond_latent" not in data:
+            raise ValueError(f"{path} is not a voice profile")
+        if data.get("version", 0) > VOICE_PROFILE_VERSION:
+            raise ValueError(f"Unsupported voice profile version: {data.get('version')} in {path}")
+        if model_version is not None and data.get("model_version") != model_version:
+            print(f">> WARNING: voice profile {path} was exported by model version {data.get('model_version')}, "
+                  f"current model version is {model_version}.")
+        return cls(data["cond_mel"], data["gpt_cond_latent"], data["speaker_embedding"], key=data.get("key"))
+
+
+def is_profile_of(profile_path: str, audio_prompt: str) -> bool:
+    """
+    Whether the voice profile ``profile_path`` exists and was exported from the current content of ``audio_prompt``.
+    """
+    try:
+        key = VoiceConditioning.load(profile_path).key
+    except Exception:
+        # missing, unreadable or not a profile
+        return False
+    return key is not None and key == VoiceCache.hash_file(audio_prompt)
+
+
+class VoiceCache:
+    """
+    Bounded LRU cache of ``VoiceConditioning`` entries.
+
+    Entries are evicted in least-recently-used order once either ``capacity`` entries
+    or ``max_bytes`` bytes of tensors are exceeded. ``capacity=0`` disables the cache.
+    """
+
+    def __init__(self, capacity: int = 8, max_bytes: Optional[int] = None):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, VoiceConditioning]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        return hashlib.sha1(data).hexdigest()
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key: str) -> Optional[VoiceConditioning]:
+        with self._lock:
+            voice = self._entries.get(key)
+            if voice is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return voice
+
+    def put(self, key: str, voice: VoiceConditioning):
+        if self.capacity <= 0:
+            return
+        nbytes = voice.nbytes()
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            # never cache an entry that can not fit into the budget on its own
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._nbytes -= old.nbytes()
+            self._entries[key] = voice
+            self._nbytes += nbytes
+            while len(self._entries) > self.capacity or (
+                self.max_bytes is not None and self._nbytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= evicted.nbytes()
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,120 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import Future
+
+import numpy as np
+import soundfile
+
+from indextts.batch import load_manifest, parse_shard, run_batch, select_rows
+
+
+def write_manifest(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        f.write("\n")
+
+
+class LengthScheduler:
+    """Stands in for ``BatchScheduler``: the audio of a row has one sample per character of its text."""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, audio_prompt, text, **options):
+        self.submitted.append((os.path.basename(audio_prompt), text, options))
+        future = Future()
+        if text == "fail":
+            future.set_exception(ValueError("synthesis failed"))
+        else:
+            future.set_result((24000, np.full((len(text), 1), 7, dtype=np.int16)))
+        return future
+
+
+def test_parse_shard():
+    assert parse_shard("1/4") == (1, 4)
+    for value in ("4/4", "1", "a/b", "0/0"):
+        try:
+            parse_shard(value)
+            assert False, value
+        except argparse.ArgumentTypeError:
+            pass
+
+
+def test_select_rows():
+    with tempfile.TemporaryDirectory() as work_dir:
+        manifest = os.path.join(work_dir, "manifest.jsonl")
+        write_manifest(manifest, [{"prompt_audio": voice, "text": f"row {i}"}
+                                  for i, voice in enumerate(["b.wav", "a.wav", "b.wav", "a.wav", "c.wav"])])
+        rows = load_manifest(manifest)
+        assert [row["row"] for row in rows] == [0, 1, 2, 3, 4]
+        assert rows[0]["prompt_audio"] == os.path.join(work_dir, "b.wav")
+        out_dir = os.path.join(work_dir, "out")
+        selected, skipped = select_rows(rows, out_dir, "wav")
+        # grouped by voice, in manifest order within a voice
+        assert [row["row"] for row, _ in selected] == [1, 3, 0, 2, 4] and skipped == 0
+        assert selected[0][1] == os.path.join(out_dir, "000001.wav")
+        selected, _ = select_rows(rows, out_dir, "flac", shard=(1, 2))
+        assert [row["row"] for row, _ in selected] == [1, 3] and selected[0][1].endswith("000001.flac")
+        # resume: existing outputs are skipped, unfinished .part files are not outputs
+        os.makedirs(out_dir)
+        open(os.path.join(out_dir, "000003.wav"), "wb").close()
+        open(os.path.join(out_dir, "000001.part.wav"), "wb").close()
+        selected, skipped = select_rows(rows, out_dir, "wav")
+        assert [row["row"] for row, _ in selected] == [1, 0, 2, 4] and skipped == 1
+
+
+def test_manifest_keys():
+    with tempfile.TemporaryDirectory() as work_dir:
+        manifest = os.path.join(work_dir, "manifest.jsonl")
+        write_manifest(manifest, [{"prompt_audio": "a.wav", "text": "row 0", "infer_mode": 0},
+                                  {"prompt_audio": "a.wav", "text": "row 1", "infer_mode": 1}])
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            rows = load_manifest(manifest)
+        # the key of tests/cases.jsonl is reported once, not dropped silently
+        assert len(rows) == 2 and stderr.getvalue().count("`infer_mode` of 2 rows is ignored") == 1
+        write_manifest(manifest, [{"prompt_audio": "a.wav", "text": "row 0"},
+                                  {"prompt_audio": "a.wav", "text": "row 1", "ouput": "x.wav", "num_beams": 1}])
+        try:
+            load_manifest(manifest)
+            assert False, "a row with unknown keys is an error"
+        except ValueError as e:
+            assert "manifest.jsonl:2: unknown keys: num_beams, ouput" in str(e)
+
+
+def test_run_batch():
+    with tempfile.TemporaryDirectory() as work_dir:
+        manifest = os.path.join(work_dir, "manifest.jsonl")
+        write_manifest(manifest, [
+            {"prompt_audio": "a.wav", "text": "Hello", "options": {"num_beams": 1}},
+            {"prompt_audio": "b.wav", "text": "fail"},
+            {"prompt_audio": "a.wav", "text": "Hi", "output": "named/hi.flac"},
+            {"prompt_audio": "a.wav", "text": "Options", "options": {"num_beams": 1, "output_path": "x", "streamer": 1}},
+        ])
+        out_dir = os.path.join(work_dir, "out")
+        selected, _ = select_rows(load_manifest(manifest), out_dir, "wav")
+        scheduler = LengthScheduler()
+        stats = run_batch(scheduler, selected, max_inflight=2, verbose=False)
+        # the row with options that are not generation kwargs is not submitted
+        assert stats["done"] == 2 and stats["failed"] == 2 and stats["seconds"] == 7 / 24000
+        assert scheduler.submitted == [("a.wav", "Hello", {"num_beams": 1}), ("a.wav", "Hi", {}), ("b.wav", "fail", {})]
+        data, sampling_rate = soundfile.read(os.path.join(out_dir, "000000.wav"), dtype="int16")
+        assert sampling_rate == 24000 and data.tolist() == [7] * 5
+        assert soundfile.read(os.path.join(out_dir, "named", "hi.flac"), dtype="int16")[0].tolist() == [7] * 2
+        assert sorted(os.listdir(out_dir)) == ["000000.wav", "named"]
+        # the failed rows are the only ones left
+        selected, skipped = select_rows(load_manifest(manifest), out_dir, "wav")
+        assert [row["row"] for row, _ in selected] == [3, 1] and skipped == 2
+
+
+if __name__ == "__main__":
+    test_parse_shard()
+    test_select_rows()
+    test_manifest_keys()
+    test_run_batch()
+    print("ok")
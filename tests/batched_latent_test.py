@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.gpt.model import UnifiedVoice
+from indextts.infer import IndexTTS
+
+
+def build_gpt():
+    """A randomly initialized, tiny UnifiedVoice, conditioning latents are passed in directly."""
+    torch.manual_seed(0)
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=64,
+                       number_text_tokens=100, checkpointing=False)
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    return gpt.eval()
+
+
+def latent_of_row(gpt, conds_latent, text_tokens, codes):
+    """the per-sentence latent pass of `IndexTTS.infer()`"""
+    return gpt(None, text_tokens, torch.tensor([text_tokens.shape[-1]]), codes,
+               torch.tensor([codes.shape[-1]]) * gpt.mel_length_compression,
+               return_latent=True, clip_inputs=False, conds_latent=conds_latent)
+
+
+def test_batched_latents_match_single_rows():
+    gpt = build_gpt()
+    torch.manual_seed(1)
+    conds_latent = torch.randn(1, 32, gpt.model_dim)
+    text_lengths = [7, 15, 3]
+    code_lengths = [20, 9, 14]
+    text_tokens = [torch.randint(2, 100, (n,), dtype=torch.int32) for n in text_lengths]
+    codes = [torch.randint(0, gpt.stop_mel_token - 1, (n,)) for n in code_lengths]
+    batch_text = pad_sequence(text_tokens, batch_first=True, padding_value=gpt.stop_text_token)
+    batch_codes = pad_sequence(codes, batch_first=True, padding_value=gpt.stop_mel_token)
+    with torch.no_grad():
+        expected = [latent_of_row(gpt, conds_latent, t.unsqueeze(0), c.unsqueeze(0)) for t, c in zip(text_tokens, codes)]
+        for prefix_kv in (None, gpt.get_prefix_kv(conds_latent)):
+            latents = gpt.get_latents(conds_latent, batch_text, torch.tensor(text_lengths), batch_codes,
+                                      torch.tensor(code_lengths), prefix_kv=prefix_kv)
+            assert latents.shape == (3, max(code_lengths), gpt.model_dim)
+            for i, n in enumerate(code_lengths):
+                torch.testing.assert_close(latents[i:i + 1, :n], expected[i], rtol=1e-5, atol=1e-5)
+
+
+def test_incremental_latents_match_forward():
+    gpt = build_gpt()
+    torch.manual_seed(1)
+    conds_latent = torch.randn(1, 32, gpt.model_dim)
+    text_tokens = torch.randint(2, 100, (1, 11), dtype=torch.int32)
+    codes = torch.randint(0, gpt.stop_mel_token - 1, (1, 40))
+    with torch.no_grad():
+        expected = latent_of_row(gpt, conds_latent, text_tokens, codes)
+        for prefix_kv in (None, gpt.get_prefix_kv(conds_latent)):
+            latents = gpt.incremental_latents(conds_latent, text_tokens, prefix_kv=prefix_kv)
+            # growing by uneven steps, a call without new codes changes nothing
+            for n in (1, 8, 8, 25, 40):
+                latent = latents(codes[:, :n])
+                assert latent.shape == (1, n, gpt.model_dim)
+            torch.testing.assert_close(latent, expected, rtol=1e-5, atol=1e-5)
+
+
+def generate(gpt, **kwargs):
+    torch.manual_seed(1)
+    text_tokens = torch.randint(2, 100, (2, 12), dtype=torch.int32)
+    text_tokens[1, 9:] = gpt.stop_text_token
+    conds_latent = torch.randn(1, 32, gpt.model_dim)
+    with torch.no_grad():
+        return gpt.inference_speech(None, text_tokens, conds_latent=conds_latent, max_generate_length=24,
+                                    return_latent=True, **kwargs)
+
+
+def test_generation_latents_predict_codes():
+    gpt = build_gpt()
+    codes, latents = generate(gpt, do_sample=False, num_beams=1, repetition_penalty=1.0)
+    assert latents.shape == (*codes.shape, gpt.model_dim)
+    # row t is the state that predicted code t
+    assert torch.equal(gpt.mel_head(latents).argmax(-1), codes)
+
+
+def test_generation_latents_follow_beams():
+    gpt = build_gpt()
+    codes, latents = generate(gpt, do_sample=False, num_beams=3, length_penalty=0.0, repetition_penalty=10.0)
+    prompt_len = 32 + 12 + 2 + 1
+
+    def force_codes(batch_id, input_ids):
+        t = input_ids.shape[-1] - prompt_len
+        return [codes[batch_id, t].item()] if t < codes.shape[1] else [gpt.stop_mel_token]
+
+    # replay the returned beams one row at a time, the states must be the ones of the winning beams
+    replayed, expected = generate(gpt, do_sample=False, num_beams=1, prefix_allowed_tokens_fn=force_codes)
+    assert torch.equal(replayed, codes)
+    torch.testing.assert_close(latents, expected)
+
+
+def test_remove_long_silence_trims_latents():
+    tts = SimpleNamespace(stop_mel_token=8193)
+    silent, stop = 52, tts.stop_mel_token
+    codes = torch.tensor([[7] + [silent] * 40 + [9, stop, stop],
+                          [5, 6, 7, 8, stop] + [stop] * 39])
+    latents = torch.arange(codes.numel(), dtype=torch.float).view(*codes.shape, 1)
+    fixed, code_lens, fixed_latents = IndexTTS.remove_long_silence(tts, codes, latents=latents)
+    assert code_lens.tolist() == [12, 4]
+    assert fixed_latents.shape == (2, 12, 1)
+    # the latents of the kept codes, padded like the codes
+    assert fixed_latents[0, :, 0].tolist() == [0] + list(range(1, 11)) + [41]
+    assert fixed_latents[1, :4, 0].tolist() == [44, 45, 46, 47]
+    assert torch.equal(fixed, IndexTTS.remove_long_silence(tts, codes)[0])
+
+
+if __name__ == "__main__":
+    test_batched_latents_match_single_rows()
+    test_incremental_latents_match_forward()
+    test_generation_latents_predict_codes()
+    test_generation_latents_follow_beams()
+    test_remove_long_silence_trims_latents()
+    print("ok")
@@ -0,0 +1,75 @@
+"""
+BigVGAN decode of many sentences: ``chunk_size = 2`` concatenation along time vs ``BigVGAN.decode_batch()``
+with batches bounded by a budget of padded samples.
+
+The vocoder has the shape of ``config.yaml``, weights are random unless ``--model-dir`` has the BigVGAN checkpoint.
+```
+python tests/batched_vocoder_benchmark.py --config checkpoints/config.yaml --lengths 40 80 120 160 200 --max-samples 720000
+```
+"""
+import argparse
+import os
+import time
+
+import torch
+from omegaconf import OmegaConf
+
+from indextts.BigVGAN.models import BigVGAN
+from indextts.utils.bucketing import bucket_lengths_by_budget
+
+
+def chunked(model, latents, speaker_embedding, chunk_size=2):
+    wavs = []
+    for i in range(0, len(latents), chunk_size):
+        wav, _ = model(torch.cat(latents[i:i + chunk_size], dim=1), None, speaker_embedding=speaker_embedding)
+        wavs.append(wav.squeeze(1))
+    return wavs
+
+
+def batched(model, latents, speaker_embedding, max_samples):
+    wavs = []
+    for group in bucket_lengths_by_budget([l.shape[1] for l in latents], max_samples // model.hop_length):
+        wavs.extend(model.decode_batch([latents[i] for i in group], speaker_embedding=speaker_embedding))
+    return wavs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="checkpoints/config.yaml")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[40, 80, 120, 160, 200], help="latent frames per sentence")
+    parser.add_argument("--repeat", type=int, default=2, help="repeat the sentences of --lengths")
+    parser.add_argument("--max-samples", type=int, nargs="+", default=[24000 * 10, 24000 * 30, 24000 * 60])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    args = parser.parse_args()
+
+    cfg = OmegaConf.load(args.config)
+    model = BigVGAN(cfg.bigvgan)
+    path = os.path.join(args.model_dir, cfg.bigvgan_checkpoint) if args.model_dir else None
+    if path and os.path.exists(path):
+        model.load_state_dict(torch.load(path, map_location="cpu")["generator"])
+    model.remove_weight_norm()
+    model = model.to(args.device).eval()
+    torch.manual_seed(0)
+    speaker_embedding = torch.randn(1, 1, cfg.bigvgan.speaker_embedding_dim, device=args.device)
+    latents = [torch.randn(1, n, cfg.bigvgan.gpt_dim, device=args.device) for n in args.lengths * args.repeat]
+    audio = sum(l.shape[1] for l in latents) * model.hop_length / 24000
+
+    def measure(fn):
+        with torch.no_grad():
+            fn()  # warm up
+            if args.device.startswith("cuda"):
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            fn()
+            if args.device.startswith("cuda"):
+                torch.cuda.synchronize()
+        return time.perf_counter() - start
+
+    print(f">> {len(latents)} sentences, {audio:.1f}s of audio")
+    elapsed = measure(lambda: chunked(model, latents, speaker_embedding))
+    print(f">> {'chunk_size=2':>18}: {elapsed:.2f}s, RTF {elapsed / audio:.4f}")
+    for max_samples in args.max_samples:
+        groups = bucket_lengths_by_budget([l.shape[1] for l in latents], max_samples // model.hop_length)
+        elapsed = measure(lambda: batched(model, latents, speaker_embedding, max_samples))
+        print(f">> max_samples={max_samples:>7}: {len(groups)} batches, {elapsed:.2f}s, RTF {elapsed / audio:.4f}")
@@ -0,0 +1,96 @@
+import torch
+from omegaconf import OmegaConf
+
+from indextts.BigVGAN.models import BigVGAN
+from indextts.utils.bucketing import bucket_lengths_by_budget
+
+
+def build_vocoder(cfg_path="checkpoints/config.yaml", feat_upsample=False):
+    """A randomly initialized, narrow BigVGAN with the upsampling layout of the real model."""
+    cfg = OmegaConf.load(cfg_path).bigvgan
+    cfg.upsample_initial_channel = 64
+    cfg.gpt_dim = 32
+    cfg.speaker_embedding_dim = 16
+    cfg.feat_upsample = feat_upsample
+    torch.manual_seed(0)
+    model = BigVGAN(cfg).eval()
+    model.remove_weight_norm()
+    return model, torch.randn(1, 1, cfg.speaker_embedding_dim)
+
+
+def test_batched_matches_single_sentences():
+    for kwargs in (dict(), dict(feat_upsample=True)):
+        model, speaker_embedding = build_vocoder(**kwargs)
+        torch.manual_seed(1)
+        latents = [torch.randn(1, n, 32) for n in (30, 17, 5, 1)]
+        with torch.no_grad():
+            expected = [model(latent, None, speaker_embedding=speaker_embedding)[0].squeeze(1) for latent in latents]
+            wavs = model.decode_batch(latents, speaker_embedding=speaker_embedding)
+        for latent, wav, ref in zip(latents, wavs, expected):
+            assert wav.shape == ref.shape == (1, latent.shape[1] * model.hop_length)
+            # including the tail: the padding is zeroed for the convolutions and replaced by the last valid sample
+            # for the anti-aliasing filters and the interpolation, which replicate the edge of a single row
+            assert torch.allclose(wav, ref, atol=1e-5), (kwargs, (wav - ref).abs().max())
+        assert torch.equal(model.decode_batch(latents[1:2], speaker_embedding=speaker_embedding)[0], expected[1])
+
+
+def test_masking_reduces_padding_leak():
+    # without `x_lens` the padding leaks far into the shorter rows
+    model, speaker_embedding = build_vocoder()
+    torch.manual_seed(1)
+    short, long = torch.randn(1, 5, 32), torch.randn(1, 30, 32)
+    x = torch.zeros(2, 30, 32)
+    x[0, :5], x[1] = short[0], long[0]
+    with torch.no_grad():
+        ref = model(short, None, speaker_embedding=speaker_embedding)[0]
+        unmasked = model(x, None, speaker_embedding=speaker_embedding)[0][:1, :, :ref.shape[-1]]
+        masked = model(x, None, speaker_embedding=speaker_embedding, x_lens=torch.tensor([5, 30]))[0][:1, :, :ref.shape[-1]]
+    assert (masked - ref).abs().max() < (unmasked - ref).abs().max()
+
+
+def test_precomputed_speaker_embedding():
+    model, _ = build_vocoder()
+    torch.manual_seed(1)
+    mel_ref = torch.randn(1, 120, model.h.num_mels)
+    latents = [torch.randn(1, n, 32) for n in (6, 3)]
+    with torch.no_grad():
+        speaker_embedding = model.get_speaker_embedding(mel_ref)
+        for latent in latents:
+            expected, _ = model(latent, mel_ref)
+            wav, _ = model(latent, None, speaker_embedding=speaker_embedding)
+            assert torch.equal(wav, expected)
+
+
+def test_prepared_voice():
+    model, speaker_embedding = build_vocoder()
+    torch.manual_seed(1)
+    latents = [torch.randn(1, n, 32) for n in (6, 3)]
+    with torch.no_grad():
+        voice = model.prepare_voice(speaker_embedding=speaker_embedding)
+        for latent in latents:
+            expected, _ = model(latent, None, speaker_embedding=speaker_embedding)
+            wav, _ = model(latent, None, prepared_voice=voice)
+            assert torch.equal(wav, expected)
+        batched = model.decode_batch(latents, prepared_voice=voice)
+        expected = model.decode_batch(latents, speaker_embedding=speaker_embedding)
+    assert all(torch.equal(a, b) for a, b in zip(batched, expected))
+    # one bias per upsampling layer, constant over time
+    assert len(voice.up_biases) == len(model.ups) and voice.cond_bias.shape[-1] == 1
+
+
+def test_sample_budget():
+    lengths = [30, 5, 17, 5, 200, 8]
+    groups = bucket_lengths_by_budget(lengths, max_padded=60)
+    assert sorted(i for group in groups for i in group) == list(range(len(lengths)))
+    for group in groups:
+        assert len(group) * max(lengths[i] for i in group) <= 60 or len(group) == 1
+    assert groups[0] == [4]
+
+
+if __name__ == "__main__":
+    test_batched_matches_single_sentences()
+    test_masking_reduces_padding_leak()
+    test_precomputed_speaker_embedding()
+    test_prepared_voice()
+    test_sample_budget()
+    print("ok")
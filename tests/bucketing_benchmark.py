@@ -0,0 +1,87 @@
+"""
+Sentence bucketing policies of ``infer_fast``: fixed ``bucket_max_size`` vs a padded-token budget (``bucket_max_tokens``).
+
+Texts are the ones of ``tests/cases.jsonl`` (or any jsonl with a ``text`` field), split into sentences like ``infer_fast``.
+Expected padding waste and decode steps use ``expected_sequence_length()``, ``--generate`` also runs the GPT on every
+bucket and reports the measured padding waste of the generated codes and the throughput.
+```
+python tests/bucketing_benchmark.py --model-dir checkpoints --generate
+```
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import transformers
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.infer import IndexTTS
+from indextts.utils.bucketing import expected_sequence_length, padding_waste
+
+
+def load_sentences(tts: IndexTTS, cases, max_text_tokens_per_sentence, repeat):
+    sentences = []
+    with open(cases, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            tokens = tts.tokenizer.tokenize(json.loads(line)["text"])
+            sentences.extend(tts.tokenizer.split_sentences(tokens, max_text_tokens_per_sentence))
+    return sentences * repeat
+
+
+def generate(tts: IndexTTS, buckets, conds_latent, generation_kwargs):
+    """useful codes (up to the first stop token), generated slots and seconds"""
+    useful = slots = 0
+    start = time.perf_counter()
+    for bucket in buckets:
+        text_tokens = [torch.tensor(tts.tokenizer.convert_tokens_to_ids(item["sent"]), dtype=torch.int32,
+                                    device=tts.device) for item in bucket]
+        batch_text_tokens = pad_sequence(text_tokens, batch_first=True, padding_value=tts.cfg.gpt.stop_text_token)
+        with torch.no_grad(), torch.amp.autocast(batch_text_tokens.device.type, enabled=tts.dtype is not None, dtype=tts.dtype):
+            codes = tts.gpt.inference_speech(None, batch_text_tokens, conds_latent=conds_latent, num_beams=1,
+                                             **generation_kwargs)
+        _, code_lens = tts.remove_long_silence(codes)
+        useful += int(code_lens.sum())
+        slots += codes.numel()
+    return useful, slots, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="checkpoints")
+    parser.add_argument("--prompt", default="tests/sample_prompt.wav")
+    parser.add_argument("--cases", default="tests/cases.jsonl")
+    parser.add_argument("--repeat", type=int, default=4, help="repeat the sentences of --cases")
+    parser.add_argument("--max-text-tokens-per-sentence", type=int, default=100)
+    parser.add_argument("--bucket-sizes", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--token-budgets", type=int, nargs="+", default=[1500, 3000, 6000])
+    parser.add_argument("--max-batch-size", type=int, default=16, help="limit of sentences per bucket with a token budget")
+    parser.add_argument("--generate", action="store_true", help="run the GPT on every bucket")
+    parser.add_argument("--max-mel-tokens", type=int, default=600)
+    parser.add_argument("--fp16", action="store_true")
+    args = parser.parse_args()
+
+    tts = IndexTTS(cfg_path=os.path.join(args.model_dir, "config.yaml"), model_dir=args.model_dir, is_fp16=args.fp16)
+    sentences = load_sentences(tts, args.cases, args.max_text_tokens_per_sentence, args.repeat)
+    print(f">> {len(sentences)} sentences, text tokens: {sorted(len(s) for s in sentences)}")
+    policies = [(f"bucket_max_size={n}", dict(bucket_max_size=n)) for n in args.bucket_sizes]
+    policies += [(f"bucket_max_tokens={n}", dict(bucket_max_size=args.max_batch_size, bucket_max_tokens=n))
+                 for n in args.token_budgets]
+    voice = tts.get_voice_conditioning(args.prompt) if args.generate else None
+    generation_kwargs = dict(do_sample=True, top_p=0.8, top_k=30, temperature=1.0, repetition_penalty=10.0,
+                             max_generate_length=args.max_mel_tokens)
+    for name, kwargs in policies:
+        buckets = tts.bucket_sentences(sentences, **kwargs)
+        # the sequential decode steps of a bucket are bounded by its longest sentence
+        steps = sum(max(expected_sequence_length(item["len"]) for item in bucket) for bucket in buckets)
+        line = (f">> {name:>22}: {len(buckets)} buckets, max batch {max(len(b) for b in buckets)}, "
+                f"expected padding waste {padding_waste(buckets):.1%}, expected decode steps {steps}")
+        if args.generate:
+            transformers.set_seed(42)
+            useful, slots, elapsed = generate(tts, buckets, voice.gpt_cond_latent, generation_kwargs)
+            line += (f", measured padding waste {1 - useful / max(slots, 1):.1%}, "
+                     f"{useful} codes in {elapsed:.2f}s, {useful / elapsed:.1f} codes/s")
+        print(line)
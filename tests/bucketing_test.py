@@ -0,0 +1,47 @@
+from indextts.utils.bucketing import bucket_by_token_budget, expected_sequence_length, padding_waste
+
+
+def make_items(lengths):
+    return [{"idx": idx, "sent": ["x"] * n, "len": n} for idx, n in enumerate(lengths)]
+
+
+def test_budget_is_respected():
+    items = make_items([3, 100, 12, 8, 95, 40, 5, 0, 7, 60, 11, 4])
+    buckets = bucket_by_token_budget(items, max_tokens=1200, max_batch_size=6)
+    # every non-empty sentence exactly once
+    assert sorted(item["idx"] for bucket in buckets for item in bucket) == [i for i, item in enumerate(items) if item["len"]]
+    for bucket in buckets:
+        assert len(bucket) <= 6
+        longest = max(expected_sequence_length(item["len"]) for item in bucket)
+        # a sentence over the budget is alone in its bucket
+        assert len(bucket) * longest <= 1200 or len(bucket) == 1
+    # short sentences share large buckets, long sentences get small ones
+    sizes = {item["len"]: len(bucket) for bucket in buckets for item in bucket}
+    assert sizes[100] < sizes[5]
+
+
+def test_padding_waste():
+    assert padding_waste([make_items([10, 10]), make_items([4])]) == 0.0
+    buckets = [make_items([2, 8])]
+    useful = expected_sequence_length(2) + expected_sequence_length(8)
+    assert abs(padding_waste(buckets) - (1 - useful / (2 * expected_sequence_length(8)))) < 1e-9
+
+
+def test_short_sentences_need_fewer_decode_steps():
+    # the same padded-token budget as fixed buckets of 4 long sentences
+    items = make_items([100] * 4 + [10] * 32)
+    budget = 4 * expected_sequence_length(100)
+    fixed = [items[i:i + 4] for i in range(0, len(items), 4)]
+    buckets = bucket_by_token_budget(items, max_tokens=budget)
+    # sequential decode steps of a bucket are bounded by its longest sentence
+    steps = lambda bs: sum(max(expected_sequence_length(item["len"]) for item in b) for b in bs)
+    assert len(buckets) < len(fixed)
+    assert steps(buckets) < steps(fixed)
+    assert padding_waste(buckets) == padding_waste(fixed) == 0.0
+
+
+if __name__ == "__main__":
+    test_budget_is_respected()
+    test_padding_waste()
+    test_short_sentences_need_fewer_decode_steps()
+    print("ok")
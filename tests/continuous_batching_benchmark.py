@@ -0,0 +1,97 @@
+"""
+Mel code generation throughput: bucketed batches (``infer_fast``) vs iteration-level scheduling (``ContinuousBatchDecoder``).
+
+```
+python tests/continuous_batching_benchmark.py --model-dir checkpoints --batch-size 8
+```
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import transformers
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.gpt.continuous_batching import ContinuousBatchDecoder
+from indextts.infer import IndexTTS
+
+
+def load_sentences(tts: IndexTTS, cases="tests/cases.jsonl", max_text_tokens_per_sentence=100, repeat=2):
+    sentences = []
+    with open(cases, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            text = json.loads(line)["text"]
+            tokens = tts.tokenizer.tokenize(text)
+            for sent in tts.tokenizer.split_sentences(tokens, max_text_tokens_per_sentence):
+                sentences.append(sent)
+    return sentences * repeat
+
+
+def useful_tokens(codes: torch.Tensor, stop_mel_token: int) -> int:
+    """codes up to and including the first stop token of every row"""
+    n = 0
+    for row in codes:
+        stop = (row == stop_mel_token).nonzero()
+        n += stop[0].item() + 1 if len(stop) > 0 else row.shape[0]
+    return n
+
+
+def bench_bucketed(tts: IndexTTS, sentences, conds_latent, batch_size, generation_kwargs):
+    buckets = tts.bucket_sentences(sentences, bucket_max_size=batch_size)
+    tokens = 0
+    slots = 0
+    start = time.perf_counter()
+    for bucket in buckets:
+        text_tokens = [torch.tensor(tts.tokenizer.convert_tokens_to_ids(item["sent"]), dtype=torch.int32,
+                                    device=tts.device).unsqueeze(0) for item in bucket]
+        batch_text_tokens = pad_sequence([t.squeeze(0) for t in text_tokens], batch_first=True,
+                                         padding_value=tts.cfg.gpt.stop_text_token)
+        with torch.no_grad(), torch.amp.autocast(batch_text_tokens.device.type, enabled=tts.dtype is not None, dtype=tts.dtype):
+            codes = tts.gpt.inference_speech(None, batch_text_tokens, conds_latent=conds_latent, num_beams=1,
+                                             **generation_kwargs)
+        tokens += useful_tokens(codes, tts.stop_mel_token)
+        slots += codes.numel()
+    elapsed = time.perf_counter() - start
+    return tokens, elapsed, tokens / max(slots, 1)
+
+
+def bench_continuous(tts: IndexTTS, sentences, conds_latent, batch_size, generation_kwargs):
+    kwargs = dict(generation_kwargs)
+    decoder = ContinuousBatchDecoder(tts.gpt, max_batch_size=batch_size,
+                                     max_generate_length=kwargs.pop("max_generate_length"), **kwargs)
+    for sent in sentences:
+        text_tokens = torch.tensor(tts.tokenizer.convert_tokens_to_ids(sent), dtype=torch.int32, device=tts.device)
+        decoder.add(text_tokens, conds_latent)
+    start = time.perf_counter()
+    with torch.amp.autocast(torch.device(tts.device).type, enabled=tts.dtype is not None, dtype=tts.dtype):
+        for _ in decoder.run():
+            pass
+    elapsed = time.perf_counter() - start
+    return decoder.generated_tokens, elapsed, decoder.generated_tokens / max(decoder.steps * batch_size, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="checkpoints")
+    parser.add_argument("--prompt", default="tests/sample_prompt.wav")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-mel-tokens", type=int, default=600)
+    parser.add_argument("--repeat", type=int, default=2, help="repeat the sentences of tests/cases.jsonl")
+    parser.add_argument("--fp16", action="store_true")
+    args = parser.parse_args()
+
+    tts = IndexTTS(cfg_path=os.path.join(args.model_dir, "config.yaml"), model_dir=args.model_dir, is_fp16=args.fp16)
+    voice = tts.get_voice_conditioning(args.prompt)
+    sentences = load_sentences(tts, repeat=args.repeat)
+    generation_kwargs = dict(do_sample=True, top_p=0.8, top_k=30, temperature=1.0, repetition_penalty=10.0,
+                             max_generate_length=args.max_mel_tokens)
+    print(f">> {len(sentences)} sentences, text tokens: {sorted(len(s) for s in sentences)}")
+    for name, bench in (("bucketed", bench_bucketed), ("continuous", bench_continuous)):
+        transformers.set_seed(42)
+        tokens, elapsed, utilization = bench(tts, sentences, voice.gpt_cond_latent, args.batch_size, generation_kwargs)
+        print(f">> {name:>10}: {tokens} tokens in {elapsed:.2f}s, {tokens / elapsed:.1f} tokens/s, "
+              f"slot utilization {utilization:.1%}")
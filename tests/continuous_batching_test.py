@@ -0,0 +1,96 @@
+import torch
+
+from indextts.gpt.continuous_batching import ContinuousBatchDecoder
+from indextts.gpt.model import UnifiedVoice
+
+
+def build_gpt():
+    """A randomly initialized, tiny UnifiedVoice, conditioning latents are passed in directly."""
+    torch.manual_seed(0)
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=64,
+                       number_text_tokens=100, checkpointing=False)
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    return gpt.eval()
+
+
+def make_rows(gpt, lengths):
+    text_tokens = [torch.randint(2, 100, (1, n), dtype=torch.int32) for n in lengths]
+    conds_latents = [torch.randn(1, 32, gpt.model_dim) for _ in lengths]
+    return text_tokens, conds_latents
+
+
+def test_greedy_matches_generate():
+    gpt = build_gpt()
+    text_tokens, conds_latents = make_rows(gpt, [5, 17, 9, 3, 12])
+    max_lengths = [6, 20, 11, 15, 9]
+    decoder = ContinuousBatchDecoder(gpt, max_batch_size=2, do_sample=False, repetition_penalty=10.0)
+    rows = [decoder.add(tokens, conds, max_generate_length=n)
+            for tokens, conds, n in zip(text_tokens, conds_latents, max_lengths)]
+    finished = [rows.index(row) for row in decoder.run()]
+    # short rows leave the batch early and the queued rows take their slots
+    assert sorted(finished) == list(range(len(rows)))
+    assert finished[0] == 0
+    with torch.no_grad():
+        for row, tokens, conds, n in zip(rows, text_tokens, conds_latents, max_lengths):
+            expected = gpt.inference_speech(None, tokens, conds_latent=conds, do_sample=False, num_beams=1,
+                                            repetition_penalty=10.0, max_generate_length=n)
+            codes = row.output()
+            assert torch.equal(codes, expected[:, :codes.shape[1]]), (codes, expected)
+
+
+def test_prefix_kv_rows():
+    gpt = build_gpt()
+    text_tokens, conds_latents = make_rows(gpt, [5, 17, 9])
+    outputs = []
+    for use_prefix in (False, True):
+        decoder = ContinuousBatchDecoder(gpt, max_batch_size=2, do_sample=False, repetition_penalty=10.0)
+        with torch.no_grad():
+            rows = [decoder.add(tokens, conds, max_generate_length=12,
+                                prefix_kv=gpt.get_prefix_kv(conds) if use_prefix else None)
+                    for tokens, conds in zip(text_tokens, conds_latents)]
+        list(decoder.run())
+        outputs.append([row.output() for row in rows])
+    for expected, codes in zip(*outputs):
+        assert torch.equal(codes, expected)
+
+
+def test_cache_is_trimmed_after_eviction():
+    gpt = build_gpt()
+    text_tokens, conds_latents = make_rows(gpt, [30, 4])
+    decoder = ContinuousBatchDecoder(gpt, max_batch_size=2, do_sample=True)
+    decoder.add(text_tokens[0], conds_latents[0], max_generate_length=2)
+    decoder.add(text_tokens[1], conds_latents[1], max_generate_length=8)
+    for _ in range(3):
+        decoder.step()
+    assert decoder.num_running == 1
+    # only the short row is left, the padding it got from the long prompt is dropped
+    assert decoder._mask.all()
+    assert decoder._past[0][0].shape[2] == decoder._mask.shape[1]
+    assert len(list(decoder.run())) == 1
+
+
+def test_remove_rows():
+    gpt = build_gpt()
+    text_tokens, conds_latents = make_rows(gpt, [30, 4, 9])
+    decoder = ContinuousBatchDecoder(gpt, max_batch_size=2, do_sample=False, repetition_penalty=10.0)
+    rows = [decoder.add(tokens, conds, max_generate_length=10) for tokens, conds in zip(text_tokens, conds_latents)]
+    for _ in range(3):
+        decoder.step()
+    # a running row and a queued row
+    decoder.remove([rows[0], rows[2]])
+    assert decoder.pending() == [rows[1]]
+    # the padding of the long prompt is dropped with its row
+    assert decoder._mask.all() and decoder._past[0][0].shape[2] == decoder._mask.shape[1]
+    assert list(decoder.run()) == [rows[1]]
+    with torch.no_grad():
+        expected = gpt.inference_speech(None, text_tokens[1], conds_latent=conds_latents[1], do_sample=False,
+                                        num_beams=1, repetition_penalty=10.0, max_generate_length=10)
+    assert torch.equal(rows[1].output(), expected[:, :rows[1].output().shape[1]])
+
+
+if __name__ == "__main__":
+    test_greedy_matches_generate()
+    test_prefix_kv_rows()
+    test_cache_is_trimmed_after_eviction()
+    test_remove_rows()
+    print("ok")
@@ -0,0 +1,83 @@
+"""
+Anti-aliased activations of BigVGAN on CPU: ``Activation1d`` vs ``FusedActivation1d``, for the activation shapes
+of every upsampling stage and for the whole vocoder.
+
+The vocoder has the shape of ``config.yaml`` with random weights.
+```
+python tests/fused_activation_benchmark.py --config checkpoints/config.yaml --frames 100 --threads 4
+```
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+from indextts.BigVGAN.activations import SnakeBeta
+from indextts.BigVGAN.alias_free_torch import Activation1d, FusedActivation1d
+from indextts.BigVGAN.models import BigVGAN
+
+
+def unfuse(model):
+    """replace every FusedActivation1d of ``model`` with the plain Activation1d"""
+    for name, module in list(model.named_modules()):
+        if isinstance(module, FusedActivation1d):
+            plain = Activation1d(module.act, module.up_ratio, module.down_ratio,
+                                 module.upsample.kernel_size, module.downsample.kernel_size)
+            plain.load_state_dict(module.state_dict())
+            parent, _, attr = name.rpartition(".")
+            setattr(model.get_submodule(parent) if parent else model, attr, plain)
+    return model
+
+
+def measure(fn, repeat):
+    with torch.no_grad():
+        fn()  # warm up
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="checkpoints/config.yaml")
+    parser.add_argument("--frames", type=int, default=100, help="latent frames, 1 frame is 1024 samples")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    args = parser.parse_args()
+    torch.set_num_threads(args.threads)
+
+    h = OmegaConf.load(args.config).bigvgan
+    length = args.frames
+    for i, rate in enumerate(h.upsample_rates):
+        channels = h.upsample_initial_channel // (2 ** (i + 1))
+        length *= rate
+        torch.manual_seed(0)
+        fused = FusedActivation1d(SnakeBeta(channels, alpha_logscale=h.snake_logscale)).eval()
+        plain = Activation1d(SnakeBeta(channels, alpha_logscale=h.snake_logscale)).eval()
+        x = torch.randn(1, channels, length)
+        t_plain = measure(lambda: plain(x), args.repeat)
+        t_fused = measure(lambda: fused(x), args.repeat)
+        print(f">> stage {i}: [1, {channels:>4}, {length:>7}] Activation1d {t_plain:8.1f} ms, "
+              f"FusedActivation1d {t_fused:8.1f} ms, x{t_plain / t_fused:.2f}")
+
+    torch.manual_seed(0)
+    model = BigVGAN(h)
+    model.remove_weight_norm()
+    model.eval()
+    latent = torch.randn(1, args.frames, h.gpt_dim)
+    speaker_embedding = torch.randn(1, 1, h.speaker_embedding_dim)
+    seconds = args.frames * int(np.prod(h.upsample_rates)) / 24000
+    vocode = lambda: model(latent, None, speaker_embedding=speaker_embedding)
+    t_fused = measure(vocode, args.repeat)
+    with torch.no_grad():
+        expected = vocode()[0]
+    unfuse(model)
+    t_plain = measure(vocode, args.repeat)
+    with torch.no_grad():
+        error = (vocode()[0] - expected).abs().max().item()
+    print(f">> BigVGAN {seconds:.1f}s audio: Activation1d {t_plain:.0f} ms (RTF {t_plain / 1000 / seconds:.3f}), "
+          f"FusedActivation1d {t_fused:.0f} ms (RTF {t_fused / 1000 / seconds:.3f}), x{t_plain / t_fused:.2f}, "
+          f"max abs diff {error:.2e}")
@@ -0,0 +1,43 @@
+import torch
+
+from indextts.BigVGAN.activations import Snake, SnakeBeta
+from indextts.BigVGAN.alias_free_torch import Activation1d, FusedActivation1d
+
+
+def build_pair(activation, channels):
+    torch.manual_seed(0)
+    reference = Activation1d(activation(channels, alpha_logscale=True))
+    with torch.no_grad():
+        for p in reference.act.parameters():
+            p.normal_(0, 0.5)
+    # small blocks so that most inputs are split
+    fused = FusedActivation1d(activation(channels, alpha_logscale=True), max_block_elements=64 * 3)
+    fused.load_state_dict(reference.state_dict())
+    return reference.eval(), fused.eval()
+
+
+def test_fused_matches_reference():
+    for activation in (Snake, SnakeBeta):
+        for batch, channels, length in ((1, 16, 7), (1, 16, 1000), (2, 8, 333), (1, 4, 64)):
+            reference, fused = build_pair(activation, channels)
+            x = torch.randn(batch, channels, length) * 3
+            with torch.no_grad():
+                expected = reference(x)
+                y = fused(x)
+            assert y.shape == expected.shape
+            assert torch.allclose(y, expected, atol=1e-5), (activation, batch, channels, length, (y - expected).abs().max())
+
+
+def test_fallback_with_gradients():
+    reference, fused = build_pair(SnakeBeta, 8)
+    x = torch.randn(1, 8, 500, requires_grad=True)
+    y = fused(x)
+    y.sum().backward()
+    assert torch.equal(y, reference(x))
+    assert x.grad is not None and fused.act.alpha.grad is not None
+
+
+if __name__ == "__main__":
+    test_fused_matches_reference()
+    test_fallback_with_gradients()
+    print("ok")
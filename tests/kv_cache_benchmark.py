@@ -0,0 +1,80 @@
+"""
+Peak memory and per-token latency of mel code generation on CPU: HuggingFace tuple ``past_key_values`` vs ``StaticKVCache``.
+
+Every mode runs in a fresh process, peak memory is the growth of the max RSS during generation.
+The GPT has the shape of ``config.yaml``, weights are random unless ``--model-dir`` has ``gpt.pth``.
+```
+python tests/kv_cache_benchmark.py --config checkpoints/config.yaml --tokens 200 --num-beams 3
+```
+"""
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omegaconf import OmegaConf
+
+from indextts.gpt.model import UnifiedVoice
+from indextts.utils.checkpoint import load_checkpoint
+
+
+def run(args, static_kv_cache, queue):
+    torch.set_num_threads(args.threads)
+    cfg = OmegaConf.load(args.config)
+    gpt = UnifiedVoice(**cfg.gpt)
+    gpt_path = os.path.join(args.model_dir, cfg.gpt_checkpoint) if args.model_dir else None
+    if gpt_path and os.path.exists(gpt_path):
+        load_checkpoint(gpt, gpt_path)
+    gpt.eval()
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False, static_kv_cache=static_kv_cache)
+    torch.manual_seed(0)
+    text_tokens = torch.randint(2, cfg.gpt.number_text_tokens, (1, args.text_tokens), dtype=torch.int32)
+    conds_latent = torch.randn(1, 32, gpt.model_dim)
+
+    def generate(n):
+        with torch.no_grad():
+            return gpt.inference_speech(None, text_tokens, conds_latent=conds_latent, do_sample=False,
+                                        num_beams=args.num_beams, max_generate_length=n, min_new_tokens=n,
+                                        length_penalty=0.0, repetition_penalty=10.0)
+
+    # the static cache is allocated by every call, count it in the peak
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    generate(2)  # warm up
+    start = time.perf_counter()
+    first = generate(1)
+    prefill = time.perf_counter() - start
+    start = time.perf_counter()
+    codes = generate(args.tokens)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    queue.put({
+        "tokens": codes.shape[1],
+        "ms_per_token": (elapsed - prefill) / max(codes.shape[1] - first.shape[1], 1) * 1000,
+        "peak_mb": peak / 1024,  # ru_maxrss is in KB on linux
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default="checkpoints/config.yaml")
+    parser.add_argument("--model-dir", default=None)
+    parser.add_argument("--text-tokens", type=int, default=60)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--num-beams", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    for name, static_kv_cache in (("tuple past_key_values", False), ("StaticKVCache", True)):
+        queue = ctx.Queue()
+        process = ctx.Process(target=run, args=(args, static_kv_cache, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        print(f">> {name:>22}: {result['tokens']} tokens x {args.num_beams} beams, "
+              f"{result['ms_per_token']:.2f} ms/token, peak memory +{result['peak_mb']:.1f}MB")
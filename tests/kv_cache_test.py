@@ -0,0 +1,137 @@
+import torch
+
+from indextts.gpt.kv_cache import StaticKVCache, cat_prefix_kv
+from indextts.gpt.model import UnifiedVoice
+
+
+def build_gpt(static_kv_cache):
+    """A randomly initialized, tiny UnifiedVoice, conditioning latents are passed in directly."""
+    torch.manual_seed(0)
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=64,
+                       number_text_tokens=100, checkpointing=False)
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False, static_kv_cache=static_kv_cache)
+    return gpt.eval()
+
+
+def generate(gpt, **kwargs):
+    torch.manual_seed(1)
+    text_tokens = torch.randint(2, 100, (2, 12), dtype=torch.int32)
+    text_tokens[1, 9:] = gpt.stop_text_token
+    conds_latent = torch.randn(2, 32, gpt.model_dim)
+    torch.manual_seed(2)
+    with torch.no_grad():
+        return gpt.inference_speech(None, text_tokens, conds_latent=conds_latent, max_generate_length=24,
+                                    repetition_penalty=10.0, **kwargs)
+
+
+def test_static_cache_matches_dynamic_cache():
+    dynamic, static = build_gpt(False), build_gpt(True)
+    for kwargs in (dict(do_sample=False, num_beams=1),
+                   dict(do_sample=True, top_k=30, top_p=0.8, num_beams=1),
+                   dict(do_sample=False, num_beams=3, length_penalty=0.0)):
+        expected = generate(dynamic, **kwargs)
+        codes = generate(static, **kwargs)
+        assert torch.equal(codes, expected), kwargs
+    # the cache is sized for the prompt and `max_generate_length` of the call, and released after it
+    get_static_cache = static.inference_model.get_static_cache
+    caches = []
+    static.inference_model.get_static_cache = lambda *args: caches.append(get_static_cache(*args)) or caches[-1]
+    generate(static, do_sample=False, num_beams=3)
+    assert [(cache.max_length, cache.num_beams, cache.batch_size) for cache in caches] == [(32 + 12 + 3 + 24 - 1, 3, 6)]
+    assert static.inference_model._static_cache is None
+
+
+def test_prefix_kv_matches_full_prompt():
+    for static_kv_cache in (False, True):
+        gpt = build_gpt(static_kv_cache)
+        torch.manual_seed(1)
+        text_tokens = torch.randint(2, 100, (2, 12), dtype=torch.int32)
+        text_tokens[1, 9:] = gpt.stop_text_token
+        voices = [torch.randn(1, 32, gpt.model_dim), torch.randn(1, 32, gpt.model_dim)]
+        with torch.no_grad():
+            prefixes = [gpt.get_prefix_kv(conds) for conds in voices]
+        # one voice broadcast to the batch, and one voice per row
+        for conds_latent, prefix_kv in ((voices[0], prefixes[0]),
+                                        (torch.cat(voices), cat_prefix_kv(prefixes))):
+            for kwargs in (dict(do_sample=False, num_beams=1),
+                           dict(do_sample=True, top_k=30, top_p=0.8, num_beams=1),
+                           dict(do_sample=False, num_beams=3, length_penalty=0.0)):
+                outputs = []
+                for prefix in (None, prefix_kv):
+                    torch.manual_seed(2)
+                    with torch.no_grad():
+                        outputs.append(gpt.inference_speech(None, text_tokens, conds_latent=conds_latent,
+                                                            prefix_kv=prefix, max_generate_length=24,
+                                                            repetition_penalty=10.0, **kwargs))
+                assert torch.equal(outputs[0], outputs[1]), (static_kv_cache, kwargs)
+        assert gpt.inference_model.cached_prefix_kv is None
+
+
+def test_padding_after_prefix():
+    gpt = build_gpt(False)
+    torch.manual_seed(1)
+    conds_latent = torch.randn(1, 32, gpt.model_dim)
+    text_tokens = torch.randint(2, 100, (2, 12), dtype=torch.int32)
+    text_tokens[1, 7:] = gpt.stop_text_token
+    _, inputs_embeds, attention_mask = gpt.prepare_gpt_inputs(conds_latent, text_tokens)
+    # [cond][pad][text][start_mel]: the prefix is at the same positions in every row
+    assert torch.equal(inputs_embeds[0, :32], inputs_embeds[1, :32])
+    assert attention_mask[1].tolist() == [1] * 32 + [0] * 5 + [1] * 10
+    with torch.no_grad():
+        kwargs = dict(conds_latent=conds_latent, do_sample=False, num_beams=1, max_generate_length=16,
+                      repetition_penalty=10.0)
+        batched = gpt.inference_speech(None, text_tokens, **kwargs)
+        alone = gpt.inference_speech(None, text_tokens[1:, :7], **kwargs)
+    assert torch.equal(batched[1:, :alone.shape[1]], alone)
+
+
+def test_reorder_through_row_map():
+    cache = StaticKVCache(num_layers=1, batch_size=4, num_heads=2, head_dim=3, max_length=8, num_beams=2)
+    torch.manual_seed(0)
+    for step in range(4):
+        states = torch.randn(4, 2, 1, 3)
+        cache.update(states, states * 2, 0)
+        cache.advance(1)
+        if step == 1:
+            # beam 1 continues beam 0, the second sentence swaps its beams
+            cache.reorder_cache(torch.tensor([0, 0, 3, 2]))
+        elif step == 2:
+            cache.reorder_cache(torch.tensor([1, 0, 2, 2]))
+    # the buffer rows are never moved, only the map of the positions of every beam
+    assert cache.row_map[:, :4].tolist() == [[0, 0, 1, 0], [0, 0, 0, 1], [3, 3, 2, 2], [3, 3, 2, 3]]
+    keys, values = cache.update(torch.randn(4, 2, 1, 3), torch.randn(4, 2, 1, 3), 0)
+    assert keys.data_ptr() == cache.key_cache.data_ptr()
+    rows, positions = cache.row_map[:, :5], torch.arange(5)
+    # the keys and values of every beam as a reordering copy would have them: (batch, heads, positions, head_dim)
+    beam_keys = keys[rows, :, positions].transpose(1, 2)
+    beam_values = values[rows, :, positions].transpose(1, 2)
+    query, weights = torch.randn(4, 2, 1, 3), torch.rand(4, 2, 1, 5)
+    assert torch.allclose(cache.attention_scores(query, keys), torch.matmul(query, beam_keys.transpose(-1, -2)))
+    assert torch.allclose(cache.attention_output(weights, values), torch.matmul(weights, beam_values))
+    try:
+        cache.reorder_cache(torch.tensor([2, 0, 2, 2]))
+        assert False, "the rows of another sentence are rejected"
+    except ValueError:
+        pass
+
+
+def test_static_cache_fits_longest_sequence():
+    gpt = build_gpt(True)
+    torch.manual_seed(1)
+    # the longest text and conditioning, generating until `max_mel_tokens` without stopping: longer than
+    # `n_positions`, which does not count the conditioning latents
+    text_tokens = torch.randint(2, 100, (1, gpt.max_text_tokens), dtype=torch.int32)
+    conds_latent = torch.randn(1, gpt.cond_num, gpt.model_dim)
+    with torch.no_grad():
+        codes = gpt.inference_speech(None, text_tokens, conds_latent=conds_latent, do_sample=False, num_beams=2,
+                                     suppress_tokens=[gpt.stop_mel_token], repetition_penalty=10.0)
+    assert codes.shape[1] == gpt.max_mel_tokens - 1
+
+
+if __name__ == "__main__":
+    test_static_cache_matches_dynamic_cache()
+    test_prefix_kv_matches_full_prompt()
+    test_padding_after_prefix()
+    test_reorder_through_row_map()
+    test_static_cache_fits_longest_sequence()
+    print("ok")
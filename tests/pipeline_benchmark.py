@@ -0,0 +1,63 @@
+"""
+RTF of ``infer_fast`` with the GPT and BigVGAN stages run one after the other vs pipelined (``pipeline=True``).
+
+Every mode runs in a fresh process, the first synthesis is not timed, then ``--runs`` syntheses of the same text.
+``infer_fast`` prints the utilization of both stages in pipelined mode.
+```
+python tests/pipeline_benchmark.py --model-dir checkpoints --prompt tests/sample_prompt.wav --runs 3
+```
+"""
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import torch
+import transformers
+
+from indextts.infer import IndexTTS
+
+TEXT = ("大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！AI技术已经发展到这样匪夷所思的地步了！"
+        "比如说，现在正在说话的其实是B站为我现场复刻的数字分身，简直就是平行宇宙的另一个我了。"
+        "如果大家也想体验更多深入的AIGC功能，可以访问 bilibili studio，相信我，你们也会吃惊的。")
+
+
+def run(args, pipeline, queue):
+    torch.set_num_threads(args.threads)
+    tts = IndexTTS(cfg_path=os.path.join(args.model_dir, "config.yaml"), model_dir=args.model_dir, device=args.device)
+    kwargs = dict(do_sample=False, num_beams=args.num_beams, max_mel_tokens=args.max_mel_tokens,
+                  max_text_tokens_per_sentence=args.max_text_tokens_per_sentence, pipeline=pipeline)
+    tts.infer_fast(args.prompt, args.text, None, **kwargs)  # voice conditioning and first call overheads
+    elapsed = samples = 0
+    for _ in range(args.runs):
+        transformers.set_seed(42)
+        start = time.perf_counter()
+        sampling_rate, wav = tts.infer_fast(args.prompt, args.text, None, **kwargs)
+        elapsed += time.perf_counter() - start
+        samples += wav.shape[0]
+    queue.put({"rtf": elapsed / (samples / sampling_rate), "seconds": samples / sampling_rate})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="checkpoints")
+    parser.add_argument("--prompt", default="tests/sample_prompt.wav")
+    parser.add_argument("--text", default=TEXT)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--num-beams", type=int, default=3)
+    parser.add_argument("--max-mel-tokens", type=int, default=600)
+    parser.add_argument("--max-text-tokens-per-sentence", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    for name, pipeline in (("sequential", False), ("pipelined", True)):
+        queue = ctx.Queue()
+        process = ctx.Process(target=run, args=(args, pipeline, queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+        print(f">> {name:>10}: {results[name]['seconds']:.2f}s of audio, RTF {results[name]['rtf']:.4f}")
+    print(f">> RTF gain of the pipeline: {results['sequential']['rtf'] / results['pipelined']['rtf']:.2f}x")
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from indextts.utils.pipeline import PipelineStage
+
+
+def test_results_in_order():
+    stage = PipelineStage(lambda x: (x, threading.current_thread().name), name="square")
+    for i in range(5):
+        stage.put(i)
+    results = stage.close()
+    assert [x for x, _ in results] == list(range(5))
+    assert all(name == "pipeline-square" for _, name in results)
+    stats = stage.stats()
+    assert stats["items"] == 5 and 0 <= stats["utilization"] <= 1
+
+
+def test_overlaps_with_producer():
+    stage = PipelineStage(lambda x: time.sleep(0.1), max_pending=1)
+    start = time.perf_counter()
+    for _ in range(4):
+        time.sleep(0.1)  # the producer works while the stage consumes the previous item
+        stage.put(None)
+    stage.close()
+    assert time.perf_counter() - start < 0.7
+    assert stage.stats(time.perf_counter() - start)["utilization"] > 0.5
+
+
+def test_error_is_raised():
+    def fail(x):
+        if x == 1:
+            raise ValueError("stage failed")
+        return x
+
+    stage = PipelineStage(fail)
+    stage.put(0)
+    stage.put(1)
+    try:
+        for i in range(2, 10):
+            time.sleep(0.01)
+            stage.put(i)
+        stage.close()
+        assert False, "the stage exception is raised"
+    except ValueError as e:
+        assert str(e) == "stage failed"
+    assert stage.results == [0]
+
+
+def test_cancel_when_the_producer_fails():
+    started = threading.Event()
+
+    def slow(x):
+        started.set()
+        time.sleep(0.2)
+        return x
+
+    stage = PipelineStage(slow, max_pending=2)
+    try:
+        try:
+            stage.put(0)
+            stage.put(1)
+            started.wait(5)
+            raise RuntimeError("producer failed")
+        finally:
+            stage.close(cancel=True)
+    except RuntimeError as e:
+        assert str(e) == "producer failed"
+    # the running item finishes, the queued one is dropped and the thread is gone
+    assert stage.results == [0]
+    assert not stage._thread.is_alive()
+    assert stage.close() == [0]
+
+
+if __name__ == "__main__":
+    test_results_in_order()
+    test_overlaps_with_producer()
+    test_error_is_raised()
+    test_cancel_when_the_producer_fails()
+    print("ok")
@@ -0,0 +1,71 @@
+"""
+Throughput of ``WorkerPool`` on CPU across numbers of workers, over the texts of ``tests/cases.jsonl``.
+
+Every pool size runs in a fresh process: the models are loaded once, the pool forks its workers, all texts are
+submitted at once (``--repeat`` times) and the throughput is the synthesized audio per second of wall time.
+The memory is the summed PSS of the loading process and its workers, shared weights are counted once.
+```
+python tests/pool_benchmark.py --model-dir checkpoints --workers 1 2 4 8
+```
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+import torch
+
+from indextts.infer import IndexTTS
+from indextts.pool import WorkerPool, memory_usage
+
+
+def run(args, num_workers, queue):
+    torch.set_num_threads(args.threads)
+    tts = IndexTTS(cfg_path=os.path.join(args.model_dir, "config.yaml"), model_dir=args.model_dir, device="cpu",
+                   quantize=args.quantize)
+    with open(args.cases, "r", encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    prompt_dir = os.path.dirname(args.cases)
+    kwargs = dict(do_sample=False, num_beams=args.num_beams, max_mel_tokens=args.max_mel_tokens)
+    threads_per_worker = args.threads_per_worker or max(1, args.threads // num_workers)
+    with WorkerPool(tts, num_workers=num_workers, threads_per_worker=threads_per_worker) as pool:
+        # one synthesis per worker first, for the voice conditioning and first call overheads
+        for future in [pool.submit(os.path.join(prompt_dir, cases[0]["prompt_audio"]), cases[0]["text"], **kwargs)
+                       for _ in range(num_workers)]:
+            future.result()
+        start = time.perf_counter()
+        futures = [pool.submit(os.path.join(prompt_dir, case["prompt_audio"]), case["text"], **kwargs)
+                   for _ in range(args.repeat) for case in cases]
+        seconds = sum(wav.shape[0] / sampling_rate for sampling_rate, wav in (f.result() for f in futures))
+        elapsed = time.perf_counter() - start
+        pss = sum(memory_usage(pid)["pss"] for pid in [os.getpid()] + pool.pids)
+    queue.put({"elapsed": elapsed, "seconds": seconds, "threads_per_worker": threads_per_worker, "pss": pss})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="checkpoints")
+    parser.add_argument("--cases", default="tests/cases.jsonl")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Total intra-op threads")
+    parser.add_argument("--threads-per-worker", type=int, default=None, help="Default is threads / workers")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--num-beams", type=int, default=1)
+    parser.add_argument("--max-mel-tokens", type=int, default=600)
+    parser.add_argument("--quantize", default=None, choices=["int8"])
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    baseline = None
+    for num_workers in args.workers:
+        queue = ctx.Queue()
+        process = ctx.Process(target=run, args=(args, num_workers, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        throughput = result["seconds"] / result["elapsed"]
+        baseline = baseline or throughput
+        print(f">> {num_workers} workers x {result['threads_per_worker']} threads: "
+              f"{result['seconds']:.1f}s of audio in {result['elapsed']:.1f}s, {throughput:.2f}s of audio/s "
+              f"({throughput / baseline:.2f}x), PSS {result['pss'] / 2 ** 20:.0f} MiB")
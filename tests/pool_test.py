@@ -0,0 +1,97 @@
+import os
+import signal
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from indextts.pool import WorkerPool, memory_usage
+
+
+class PidTTS:
+    """Stands in for ``IndexTTS``: the "audio" is the pid and the thread count of the worker."""
+
+    def __init__(self):
+        self.device = "cpu"
+        self.gpt = nn.Linear(256, 256)
+        self.bigvgan = nn.Conv1d(4, 4, 3)
+
+    def infer_fast(self, audio_prompt, text, output_path, delay=0.0):
+        if text == "fail":
+            raise ValueError("synthesis failed")
+        time.sleep(delay)
+        return 24000, np.array([os.getpid(), torch.get_num_threads()], dtype=np.int64)[:, None]
+
+
+def test_pool():
+    tts = PidTTS()
+    with WorkerPool(tts, num_workers=2, threads_per_worker=1) as pool:
+        # the weights were moved to shared memory before the fork
+        assert tts.gpt.weight.is_shared() and tts.bigvgan.weight.is_shared()
+        futures = [pool.submit("voice.wav", str(i), delay=0.2) for i in range(6)]
+        results = [future.result(timeout=30) for future in futures]
+        assert all(sampling_rate == 24000 for sampling_rate, _ in results)
+        pids = {int(wav[0, 0]) for _, wav in results}
+        assert pids == set(pool.pids) and os.getpid() not in pids
+        assert all(int(wav[1, 0]) == 1 for _, wav in results)
+        try:
+            pool.synthesize("voice.wav", "fail", timeout=30)
+            assert False, "the worker exception is raised"
+        except RuntimeError as e:
+            assert "ValueError: synthesis failed" in str(e)
+        stats = pool.stats()
+        assert stats["completed"] == 6 and stats["failed"] == 1 and sum(stats["jobs_per_worker"]) == 7
+        assert 0 < stats["utilization"] <= 1
+        assert memory_usage(pool.pids[0])["pss"] > 0
+    assert pool.pids == []
+
+
+def wait_running(pool, count):
+    deadline = time.time() + 30
+    while len(pool._running) < count:
+        assert time.time() < deadline, "the jobs did not start"
+        time.sleep(0.01)
+    return dict(pool._running)
+
+
+def test_dead_worker():
+    with WorkerPool(PidTTS(), num_workers=2, threads_per_worker=1) as pool:
+        pool.poll_interval = 0.05
+        slow = pool.submit("voice.wav", "slow", delay=60)
+        worker_id = next(iter(wait_running(pool, 1)))
+        os.kill(pool.pids[worker_id], signal.SIGKILL)
+        try:
+            slow.result(timeout=30)
+            assert False, "the job of the dead worker fails"
+        except RuntimeError as e:
+            assert f"worker {worker_id}" in str(e) and "exit code -9" in str(e)
+        # the other worker serves the queue
+        results = [pool.submit("voice.wav", str(i)).result(timeout=30) for i in range(3)]
+        assert {int(wav[0, 0]) for _, wav in results} == {pool.pids[1 - worker_id]}
+        # once the last worker dies the queued jobs fail too
+        running = pool.submit("voice.wav", "slow", delay=60)
+        queued = pool.submit("voice.wav", "queued")
+        wait_running(pool, 1)
+        os.kill(pool.pids[1 - worker_id], signal.SIGKILL)
+        for future in (running, queued):
+            try:
+                future.result(timeout=30)
+                assert False, "the jobs fail once all workers are dead"
+            except RuntimeError as e:
+                assert "died" in str(e)
+        try:
+            pool.submit("voice.wav", "late")
+            assert False, "a pool without workers takes no jobs"
+        except RuntimeError:
+            pass
+        stats = pool.stats()
+        assert stats["dead_workers"] == 2 and stats["alive_workers"] == 0
+        assert stats["completed"] == 3 and stats["failed"] == 3
+    assert pool.pids == []
+
+
+if __name__ == "__main__":
+    test_pool()
+    test_dead_worker()
+    print("ok")
@@ -0,0 +1,72 @@
+import torch
+import torch.nn.functional as F
+
+from indextts.gpt.model import UnifiedVoice
+
+
+def build_gpt():
+    """A randomly initialized, tiny UnifiedVoice, conditioning latents are passed in directly."""
+    torch.manual_seed(0)
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=64,
+                       number_text_tokens=100, checkpointing=False)
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    return gpt.eval()
+
+
+def prepare_gpt_inputs_reference(gpt, conditional_latents, text_inputs):
+    """the per-row loop `UnifiedVoice.prepare_gpt_inputs` was before it was vectorized"""
+    b, L = text_inputs.shape[:2]
+    device = text_inputs.device
+    single_cond = conditional_latents.ndim == 3 and conditional_latents.shape[0] == 1
+    batched_mel_emb = []
+    attention_masks = []
+    target_len = conditional_latents.shape[1] + L + 2
+    for i in range(b):
+        valid_mask = (text_inputs[i] != gpt.stop_text_token) & (text_inputs[i] != gpt.start_text_token)
+        text_input = text_inputs[i][valid_mask]
+        text_input = F.pad(text_input, (1, 0), value=gpt.start_text_token)
+        text_input = F.pad(text_input, (0, 1), value=gpt.stop_text_token)
+        text_input_pos = torch.arange(0, text_input.size(-1), device=device)
+        text_emb = gpt.text_embedding(text_input) + gpt.text_pos_embedding.emb(text_input_pos)
+        conds_text_emb = [
+            conditional_latents.squeeze(0) if single_cond else conditional_latents[i],
+            text_emb,
+        ]
+        attention_mask = torch.ones(target_len + 1, dtype=torch.long, device=device)
+        padding: int = L + 2 - text_input.size(-1)
+        if padding > 0:
+            cond_len = conds_text_emb[0].shape[0]
+            pad = torch.zeros((padding, conditional_latents.size(-1)), dtype=text_emb.dtype, device=device)
+            conds_text_emb.insert(1, pad)
+            attention_mask[cond_len:cond_len + padding] = 0
+        batched_mel_emb.append(torch.cat(conds_text_emb))
+        attention_masks.append(attention_mask)
+    batched_mel_emb = torch.stack(batched_mel_emb, dim=0)
+    attention_mask = torch.stack(attention_masks, dim=0)
+    fake_inputs = torch.ones((b, batched_mel_emb.shape[1] + 1), dtype=torch.long, device=device)
+    fake_inputs[:, -1] = gpt.start_mel_token
+    return fake_inputs, batched_mel_emb, attention_mask
+
+
+def test_matches_reference():
+    gpt = build_gpt()
+    torch.manual_seed(1)
+    text_inputs = torch.randint(2, 100, (5, 20), dtype=torch.int32)
+    # right padding, explicit start/stop tokens and an empty row
+    text_inputs[1, 12:] = gpt.stop_text_token
+    text_inputs[2, 0] = gpt.start_text_token
+    text_inputs[2, 15:] = gpt.stop_text_token
+    text_inputs[3, 5] = gpt.stop_text_token
+    text_inputs[4, :] = gpt.stop_text_token
+    with torch.no_grad():
+        for conds_latent in (torch.randn(1, 32, gpt.model_dim), torch.randn(5, 32, gpt.model_dim)):
+            expected = prepare_gpt_inputs_reference(gpt, conds_latent, text_inputs)
+            outputs = gpt.prepare_gpt_inputs(conds_latent, text_inputs)
+            for output, reference in zip(outputs, expected):
+                assert output.shape == reference.shape and output.dtype == reference.dtype
+                assert torch.equal(output, reference)
+
+
+if __name__ == "__main__":
+    test_matches_reference()
+    print("ok")
@@ -0,0 +1,106 @@
+"""
+Quality and speed of ``IndexTTS(quantize="int8")`` against fp32 on CPU, over the prompts of ``tests/cases.jsonl``.
+
+Every mode runs in a fresh process and synthesizes every case greedily (``infer`` or ``infer_fast`` following its
+``infer_mode``), the mel codes generated by the GPT are recorded. Quality is reported as the share of sentences whose
+codes are identical to fp32 and the mean length of the common prefix (greedy decoding diverges for good after the
+first different code), speed as the RTF. The first case of each mode is synthesized twice, the first run is not timed.
+```
+python tests/quantization_benchmark.py --model-dir checkpoints --cases tests/cases.jsonl
+```
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+
+import torch
+import transformers
+
+from indextts.infer import IndexTTS
+
+
+def load_cases(path):
+    with open(path, encoding="utf-8") as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+    for case in cases:
+        case["prompt_audio"] = os.path.join(os.path.dirname(path), case["prompt_audio"])
+    return cases
+
+
+def run(args, quantize, queue):
+    torch.set_num_threads(args.threads)
+    start = time.perf_counter()
+    tts = IndexTTS(cfg_path=os.path.join(args.model_dir, "config.yaml"), model_dir=args.model_dir, device="cpu",
+                   quantize=quantize)
+    load_time = time.perf_counter() - start
+    codes = [[]]  # the codes of the untimed first run are dropped
+    inference_speech = tts.gpt.inference_speech
+
+    def record(*inputs, **kwargs):
+        output = inference_speech(*inputs, **kwargs)
+        for row in (output[0] if isinstance(output, tuple) else output).tolist():
+            codes[-1].append(row[:row.index(tts.stop_mel_token)] if tts.stop_mel_token in row else row)
+        return output
+
+    tts.gpt.inference_speech = record
+    kwargs = dict(do_sample=False, num_beams=args.num_beams, max_mel_tokens=args.max_mel_tokens)
+    cases = load_cases(args.cases)
+    elapsed = seconds = 0
+    for i, case in enumerate(cases):
+        infer = tts.infer_fast if case.get("infer_mode", 0) == 1 else tts.infer
+        if i == 0:
+            infer(case["prompt_audio"], case["text"], None, **kwargs)  # voice conditioning and first call overheads
+        codes.append([])
+        transformers.set_seed(42)
+        start = time.perf_counter()
+        sampling_rate, wav = infer(case["prompt_audio"], case["text"], None, **kwargs)
+        elapsed += time.perf_counter() - start
+        seconds += wav.shape[0] / sampling_rate
+    queue.put({"load_time": load_time, "rtf": elapsed / seconds, "seconds": seconds, "codes": codes[1:]})
+
+
+def common_prefix(a, b):
+    n = 0
+    while n < min(len(a), len(b)) and a[n] == b[n]:
+        n += 1
+    return n
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-dir", default="checkpoints")
+    parser.add_argument("--cases", default="tests/cases.jsonl")
+    parser.add_argument("--num-beams", type=int, default=1)
+    parser.add_argument("--max-mel-tokens", type=int, default=600)
+    parser.add_argument("--threads", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    # the first int8 load quantizes and saves gpt.int8.pth, the second one only loads it
+    for name, quantize in (("fp32", None), ("int8", "int8"), ("int8 (saved)", "int8")):
+        queue = ctx.Queue()
+        process = ctx.Process(target=run, args=(args, quantize, queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+        result = results[name]
+        print(f">> {name:>12}: load {result['load_time']:.1f}s, {result['seconds']:.2f}s of audio, "
+              f"RTF {result['rtf']:.4f}")
+
+    reference = results["fp32"]["codes"]
+    for name in ("int8", "int8 (saved)"):
+        identical = prefix = total = 0
+        for i, (expected, actual) in enumerate(zip(reference, results[name]["codes"])):
+            same = sum(a == b for a, b in zip(expected, actual))
+            ratio = sum(common_prefix(a, b) / max(len(a), 1) for a, b in zip(expected, actual)) / max(len(expected), 1)
+            print(f">> {name} case {i}: {same}/{len(expected)} sentences with identical codes, "
+                  f"common prefix {ratio:.1%} of fp32 codes, {sum(map(len, actual))} vs {sum(map(len, expected))} codes")
+            identical += same
+            prefix += sum(common_prefix(a, b) for a, b in zip(expected, actual))
+            total += sum(map(len, expected))
+        print(f">> {name}: {identical}/{sum(map(len, reference))} sentences identical, "
+              f"common prefix {prefix / max(total, 1):.1%} of all fp32 codes, "
+              f"RTF gain {results['fp32']['rtf'] / results[name]['rtf']:.2f}x")
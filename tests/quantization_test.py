@@ -0,0 +1,80 @@
+import os
+import tempfile
+
+import torch
+import torch.nn as nn
+from transformers.pytorch_utils import Conv1D
+
+from indextts.gpt.model import UnifiedVoice
+from indextts.utils.quantization import (conv1d_to_linear, load_quantized_gpt, quantize_gpt,
+                                         quantized_checkpoint_path, save_quantized_gpt)
+
+
+def build_gpt():
+    """A randomly initialized, tiny UnifiedVoice, ``post_init_gpt2_config()`` is left to the caller."""
+    torch.manual_seed(0)
+    return UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=64,
+                        number_text_tokens=100, checkpointing=False).eval()
+
+
+def generate(gpt):
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+    torch.manual_seed(1)
+    text_tokens = torch.randint(2, 100, (1, 12), dtype=torch.int32)
+    conds_latent = torch.randn(1, 32, gpt.model_dim)
+    with torch.no_grad():
+        return gpt.inference_speech(None, text_tokens, conds_latent=conds_latent, do_sample=False, num_beams=1,
+                                    max_generate_length=24, min_new_tokens=24, repetition_penalty=10.0)
+
+
+def test_conv1d_to_linear():
+    torch.manual_seed(0)
+    module = nn.Sequential(Conv1D(24, 16), nn.GELU(), Conv1D(8, 24))
+    x = torch.randn(2, 5, 16)
+    expected = module(x)
+    conv1d_to_linear(module)
+    assert isinstance(module[0], nn.Linear) and isinstance(module[2], nn.Linear)
+    assert torch.allclose(module(x), expected, atol=1e-6)
+
+
+def test_quantized_gpt():
+    gpt = quantize_gpt(build_gpt())
+    assert isinstance(gpt.mel_head, torch.ao.nn.quantized.dynamic.Linear)
+    assert isinstance(gpt.gpt.h[0].attn.c_attn, torch.ao.nn.quantized.dynamic.Linear)
+    codes = generate(gpt)
+    assert codes.shape == (1, 24)
+
+
+def test_save_and_load():
+    with tempfile.TemporaryDirectory() as model_dir:
+        gpt_path = os.path.join(model_dir, "gpt.pth")
+        torch.save(build_gpt().state_dict(), gpt_path)
+        gpt = build_gpt()
+        assert not load_quantized_gpt(gpt, gpt_path)
+        assert isinstance(gpt.mel_head, nn.Linear)  # left untouched
+        quantize_gpt(gpt)
+        path = save_quantized_gpt(gpt, gpt_path)
+        assert path == quantized_checkpoint_path(gpt_path) == os.path.join(model_dir, "gpt.int8.pth")
+        expected = generate(gpt)
+        # another model, its fp32 weights are replaced by the saved ones
+        torch.manual_seed(2)
+        loaded = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=64,
+                              number_text_tokens=100, checkpointing=False).eval()
+        assert load_quantized_gpt(loaded, gpt_path)
+        assert torch.equal(generate(loaded), expected)
+        # plain tensors only, a file pickled with the quantized tensors is stale
+        checkpoint = torch.load(path, weights_only=True)
+        checkpoint["model"] = gpt.state_dict()
+        torch.save(checkpoint, path)
+        assert not load_quantized_gpt(build_gpt(), gpt_path)
+        # a changed fp32 checkpoint makes the quantized one stale
+        torch.save(build_gpt().state_dict(), gpt_path)
+        os.utime(gpt_path, (0, 0))
+        assert not load_quantized_gpt(build_gpt(), gpt_path)
+
+
+if __name__ == "__main__":
+    test_conv1d_to_linear()
+    test_quantized_gpt()
+    test_save_and_load()
+    print("ok")
@@ -0,0 +1,46 @@
+"""
+``IndexTTS.remove_long_silence``: the vectorized version vs the per-token loop it replaced, on batches of 800-token sequences.
+
+```
+python tests/remove_long_silence_benchmark.py --device cuda --batch-sizes 1 8 32
+```
+"""
+import argparse
+import time
+from types import SimpleNamespace
+
+import torch
+
+from indextts.infer import IndexTTS
+from remove_long_silence_test import STOP_MEL_TOKEN, random_codes, remove_long_silence_reference
+
+
+def timeit(fn, device, repeat):
+    fn()  # warm up
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--length", type=int, default=800)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    tts = SimpleNamespace(stop_mel_token=STOP_MEL_TOKEN)
+    generator = torch.Generator().manual_seed(0)
+    for batch_size in args.batch_sizes:
+        codes = random_codes(batch_size, args.length, silence=0.4, generator=generator).to(device)
+        loop = timeit(lambda: remove_long_silence_reference(codes), device, args.repeat)
+        vectorized = timeit(lambda: IndexTTS.remove_long_silence(tts, codes), device, args.repeat)
+        print(f">> {batch_size:>3} x {args.length} tokens on {device}: loop {loop * 1000:.2f} ms, "
+              f"vectorized {vectorized * 1000:.2f} ms, {loop / vectorized:.1f}x")
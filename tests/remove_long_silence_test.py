@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.infer import IndexTTS
+
+STOP_MEL_TOKEN = 8193
+SILENT_TOKEN = 52
+
+
+def remove_long_silence_reference(codes: torch.Tensor, silent_token=SILENT_TOKEN, max_consecutive=30, latents=None,
+                                  stop_mel_token=STOP_MEL_TOKEN):
+    """the per-token loop `IndexTTS.remove_long_silence` was before it was vectorized"""
+    code_lens = []
+    codes_list = []
+    latents_list = []
+    device = codes.device
+    isfix = False
+    for i in range(0, codes.shape[0]):
+        code = codes[i]
+        if not torch.any(code == stop_mel_token).item():
+            len_ = code.size(0)
+        else:
+            stop_mel_idx = (code == stop_mel_token).nonzero(as_tuple=False)
+            len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
+
+        count = torch.sum(code == silent_token).item()
+        if count > max_consecutive:
+            ncode_idx = []
+            n = 0
+            for k in range(len_):
+                assert code[k] != stop_mel_token, f"stop_mel_token {stop_mel_token} should be shrinked here"
+                if code[k] != silent_token:
+                    ncode_idx.append(k)
+                    n = 0
+                elif code[k] == silent_token and n < 10:
+                    ncode_idx.append(k)
+                    n += 1
+            len_ = len(ncode_idx)
+            codes_list.append(code[ncode_idx])
+            if latents is not None:
+                latents_list.append(latents[i][ncode_idx])
+            isfix = True
+        else:
+            codes_list.append(code[:len_])
+            if latents is not None:
+                latents_list.append(latents[i][:len_])
+        code_lens.append(len_)
+    if isfix:
+        if len(codes_list) > 1:
+            codes = pad_sequence(codes_list, batch_first=True, padding_value=stop_mel_token)
+        else:
+            codes = codes_list[0].unsqueeze(0)
+    max_len = max(code_lens)
+    if max_len < codes.shape[1]:
+        codes = codes[:, :max_len]
+    code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
+    if latents is not None:
+        latents = pad_sequence(latents_list, batch_first=True)[:, :codes.shape[1]]
+        return codes, code_lens, latents
+    return codes, code_lens
+
+
+def random_codes(batch_size, length, silence=0.3, generator=None):
+    """codes with runs of silent tokens and a stop token at a random position in most rows"""
+    codes = torch.randint(0, 100, (batch_size, length), generator=generator)
+    for row in codes:
+        k = 0
+        while k < length:
+            run = int(torch.randint(1, 60, (1,), generator=generator))
+            if torch.rand(1, generator=generator).item() < silence:
+                row[k:k + run] = SILENT_TOKEN
+            k += run
+        if torch.rand(1, generator=generator).item() < 0.8:
+            row[int(torch.randint(0, length, (1,), generator=generator)):] = STOP_MEL_TOKEN
+    return codes
+
+
+def test_matches_reference():
+    tts = SimpleNamespace(stop_mel_token=STOP_MEL_TOKEN)
+    generator = torch.Generator().manual_seed(0)
+    cases = [random_codes(b, n, silence, generator) for b, n, silence in
+             [(1, 50, 0.0), (1, 200, 0.5), (4, 120, 0.1), (6, 300, 0.4), (3, 80, 0.9)]]
+    cases.append(torch.tensor([[SILENT_TOKEN] * 45 + [STOP_MEL_TOKEN] * 5, [1] * 50]))
+    cases.append(torch.tensor([[STOP_MEL_TOKEN] * 10, [SILENT_TOKEN] * 10]))
+    for codes in cases:
+        latents = torch.randn(*codes.shape, 3, generator=generator)
+        expected = remove_long_silence_reference(codes, latents=latents)
+        result = IndexTTS.remove_long_silence(tts, codes, latents=latents)
+        for a, b in zip(result, expected):
+            assert a.shape == b.shape and torch.equal(a, b), (codes, a, b)
+        codes_only = IndexTTS.remove_long_silence(tts, codes)
+        assert len(codes_only) == 2 and torch.equal(codes_only[0], expected[0])
+
+
+if __name__ == "__main__":
+    test_matches_reference()
+    print("ok")
@@ -0,0 +1,222 @@
+import threading
+import time
+from concurrent.futures import wait
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from indextts.gpt.model import UnifiedVoice
+from indextts.infer import IndexTTS
+from indextts.scheduler import BatchScheduler
+from indextts.utils.voice_cache import VoiceConditioning
+
+GENERATION = dict(do_sample=False, num_beams=1, repetition_penalty=10.0, max_mel_tokens=12)
+
+
+class ToyTokenizer:
+    """Texts of numbers, one token per number, sentences end with "."."""
+
+    def tokenize(self, text):
+        return text.split()
+
+    def split_sentences(self, tokens, max_tokens_per_sentence):
+        sentences, sentence = [], []
+        for token in tokens:
+            sentence.append(token)
+            if token == "." or len(sentence) >= max_tokens_per_sentence:
+                sentences.append(sentence)
+                sentence = []
+        return sentences + ([sentence] if sentence else [])
+
+    def convert_tokens_to_ids(self, tokens):
+        return [1 if token == "." else int(token) for token in tokens]
+
+
+class ToyTTS:
+    """Stands in for ``IndexTTS``: a tiny random GPT, the "vocoder" returns the first latent channel of every frame."""
+
+    remove_long_silence = IndexTTS.remove_long_silence
+
+    def __init__(self):
+        torch.manual_seed(0)
+        self.gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=64, max_mel_tokens=64,
+                                number_text_tokens=100, checkpointing=False)
+        self.gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+        self.gpt.eval()
+        self.device = "cpu"
+        self.dtype = None
+        self.stop_mel_token = self.gpt.stop_mel_token
+        self.cfg = SimpleNamespace(gpt=SimpleNamespace(stop_text_token=self.gpt.stop_text_token))
+        self.tokenizer = ToyTokenizer()
+        self.voices = {name: VoiceConditioning(torch.zeros(1, 100, 10), torch.randn(1, 32, 64), key=name)
+                       for name in ("a", "b", "broken vocoder")}
+
+    def get_voice_conditioning(self, audio_prompt):
+        if audio_prompt not in self.voices:
+            raise FileNotFoundError(audio_prompt)
+        return self.voices[audio_prompt]
+
+    def get_prefix_kv(self, voice):
+        return None
+
+    def get_vocoder_voice(self, voice):
+        return voice.key
+
+    def bigvgan(self, latent, mel_refer, prepared_voice=None):
+        if prepared_voice == "broken vocoder":
+            raise RuntimeError("vocoder failed")
+        return latent[..., :1].transpose(1, 2), None
+
+
+TEXTS = [("a", "5 6 7 . 8 9 ."), ("b", "10 11 12 13 14 15 ."), ("a", "20 ."), ("b", "30 31 . 32 33 34 . 35 .")]
+
+
+def expected_outputs(tts):
+    """every request alone, one sentence per batch"""
+    with BatchScheduler(tts, max_batch_size=1) as scheduler:
+        return [scheduler.synthesize(voice, text, **GENERATION)[1] for voice, text in TEXTS]
+
+
+def test_concurrent_submits_in_order():
+    tts = ToyTTS()
+    expected = expected_outputs(tts)
+    for iteration_level in (False, True):
+        with BatchScheduler(tts, max_batch_size=4, max_wait_ms=200, iteration_level=iteration_level) as scheduler:
+            results = [None] * len(TEXTS)
+
+            def client(i):
+                voice, text = TEXTS[i]
+                results[i] = scheduler.submit(voice, text, **GENERATION).result(timeout=60)
+
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(len(TEXTS))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            stats = scheduler.stats()
+        assert stats["requests"] == 4 and stats["sentences"] == 7
+        # sentences of several callers shared a batch
+        assert stats["avg_batch_size"] > 1
+        for (sampling_rate, wav), reference in zip(results, expected):
+            assert sampling_rate == 24000 and wav.dtype == np.int16
+            # sentences are joined in the order of the text, each output is the one of its own request
+            assert wav.shape == reference.shape
+            assert np.abs(wav.astype(np.int32) - reference).max() <= 1
+
+
+def test_bucket_size_and_progress():
+    tts = ToyTTS()
+    updates = []
+    with BatchScheduler(tts, max_batch_size=8, max_wait_ms=100) as scheduler:
+        future = scheduler.submit("b", TEXTS[3][1], sentences_bucket_max_size=2,
+                                  progress=lambda done, total: updates.append((done, total)), **GENERATION)
+        future.result(timeout=60)
+        stats = scheduler.stats()
+    assert stats["batches"] == 2 and stats["sentences"] == 3
+    assert updates == [(1, 3), (2, 3), (3, 3)]
+
+
+def test_failures_resolve_futures():
+    tts = ToyTTS()
+    with BatchScheduler(tts, max_batch_size=4, max_wait_ms=100) as scheduler:
+        ok = scheduler.submit("a", "5 6 7 .", **GENERATION)
+        missing_voice = scheduler.submit("missing", "5 6 7 .", **GENERATION)
+        # not a generation parameter, `generate()` rejects it and the batch fails
+        bad_kwarg = scheduler.submit("a", "5 6 7 .", not_a_parameter=1, **GENERATION)
+        empty = scheduler.submit("a", "  ", **GENERATION)
+        assert ok.result(timeout=60)[1].shape[0] > 0
+        for future, error in ((missing_voice, FileNotFoundError), (bad_kwarg, ValueError), (empty, ValueError)):
+            try:
+                future.result(timeout=60)
+                assert False, "the future raises"
+            except error:
+                pass
+    try:
+        scheduler.submit("a", "5 .")
+        assert False, "a stopped scheduler refuses requests"
+    except RuntimeError:
+        pass
+
+
+def test_exclusive_blocks_batching():
+    tts = ToyTTS()
+    with BatchScheduler(tts, max_batch_size=4, max_wait_ms=0) as scheduler:
+        with scheduler.exclusive() as held:
+            assert held is tts
+            future = scheduler.submit("a", "5 6 .", **GENERATION)
+            time.sleep(0.3)
+            assert not future.done() and scheduler.stats()["batches"] == 0
+        future.result(timeout=60)
+        assert scheduler.stats()["batches"] == 1
+
+
+def test_stop_drains_pending():
+    tts = ToyTTS()
+    scheduler = BatchScheduler(tts, max_batch_size=1, max_wait_ms=0).start()
+    with scheduler.exclusive():
+        running = scheduler.submit("a", "5 6 .", **GENERATION)
+        # the worker took the first sentence and waits for the models
+        while scheduler.stats()["pending"] > 0:
+            time.sleep(0.01)
+        pending = [scheduler.submit("b", "8 9 .", **GENERATION) for _ in range(3)]
+        stopper = threading.Thread(target=scheduler.stop)
+        stopper.start()
+        time.sleep(0.1)
+    stopper.join(timeout=60)
+    assert not stopper.is_alive()
+    # the running batch completes, the pending requests fail instead of hanging
+    assert running.result(timeout=0)[1].shape[0] > 0
+    assert len(wait(pending, timeout=0).done) == 3
+    for future in pending:
+        assert isinstance(future.exception(), RuntimeError)
+    assert scheduler.stats()["pending"] == 0
+
+
+def test_stop_fails_decoder_rows():
+    tts = ToyTTS()
+    scheduler = BatchScheduler(tts, max_batch_size=4, max_wait_ms=0, iteration_level=True).start()
+    futures = [scheduler.submit(voice, text, **dict(GENERATION, max_mel_tokens=60)) for voice, text in TEXTS[:2]]
+    # the sentences are in the decoder, the worker waits for the models before its next step
+    while scheduler.stats()["sentences"] < 3:
+        time.sleep(0.001)
+    with scheduler.exclusive():
+        stopper = threading.Thread(target=scheduler.stop)
+        stopper.start()
+        time.sleep(0.1)
+    stopper.join(timeout=60)
+    assert not stopper.is_alive()
+    assert len(wait(futures, timeout=0).done) == 2
+    for future in futures:
+        assert isinstance(future.exception(), RuntimeError)
+
+
+def test_failed_request_leaves_decoder():
+    tts = ToyTTS()
+    with torch.no_grad():
+        # in this batch the first sentence stops after 26 codes, the others run until `max_mel_tokens`
+        tts.gpt.mel_head.bias[tts.gpt.stop_mel_token] = 1.25
+    with BatchScheduler(tts, max_batch_size=4, max_wait_ms=100, iteration_level=True) as scheduler:
+        decoders = []
+        new_decoder = scheduler._new_decoder
+        scheduler._new_decoder = lambda request: decoders.append(new_decoder(request)) or decoders[-1]
+        kwargs = dict(GENERATION, max_mel_tokens=40)
+        failed = scheduler.submit("broken vocoder", "5 6 7 . 8 9 10 11 12 13 14 15 16 .", **kwargs)
+        ok = scheduler.submit("a", "20 21 22 23 24 25 26 27 28 29 .", **kwargs)
+        assert ok.result(timeout=60)[1].shape[0] > 0
+        assert isinstance(failed.exception(timeout=60), RuntimeError)
+        assert [len(decoder) for decoder in decoders] == [0]
+        # the second sentence of the failed request left the batch when the first one failed to vocode
+        stats = scheduler.stats()
+    assert stats["sentences"] == 3 and stats["generated_tokens"] < 26 + 40 + 40
+
+
+if __name__ == "__main__":
+    test_concurrent_submits_in_order()
+    test_bucket_size_and_progress()
+    test_failures_resolve_futures()
+    test_exclusive_blocks_batching()
+    test_stop_drains_pending()
+    test_stop_fails_decoder_rows()
+    test_failed_request_leaves_decoder()
+    print("ok")
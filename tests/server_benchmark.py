@@ -0,0 +1,76 @@
+"""
+Load test of a running ``indextts.server``: ``--concurrency`` clients send the texts of ``tests/cases.jsonl``
+to ``/stream`` until ``--requests`` requests are done. Reports the throughput, the latency to the first audio chunk
+and to the end of the response, and how many requests were rejected (429) or timed out (504).
+
+```
+python -m indextts.server --model-dir checkpoints --voices-dir tests/voices --max-queue 4 &
+python tests/server_benchmark.py --voice sample_prompt --concurrency 8 --requests 32
+```
+"""
+import argparse
+import asyncio
+import json
+import time
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+async def stream(host, port, body):
+    """Return the status, the time to the first body bytes and to the end of the response."""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(body).encode("utf-8")
+    writer.write(f"POST /stream HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    while (await reader.readline()).strip():
+        pass
+    first_chunk = None
+    while await reader.read(1 << 16):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - start
+    writer.close()
+    return status, first_chunk, time.perf_counter() - start
+
+
+async def main(args):
+    with open(args.cases, "r", encoding="utf-8") as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    results = []
+    next_request = 0
+
+    async def client():
+        nonlocal next_request
+        while next_request < args.requests:
+            text = texts[next_request % len(texts)]
+            next_request += 1
+            body = {"text": text, "voice": args.voice, "format": "pcm", "timeout": args.timeout, **args.generation}
+            results.append(await stream(args.host, args.port, body))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    ok = [r for r in results if r[0] == 200]
+    print(f">> {len(results)} requests in {elapsed:.1f}s, {len(ok) / elapsed:.3f} completed requests/s, "
+          f"rejected (429): {sum(r[0] == 429 for r in results)}, timed out (504): {sum(r[0] == 504 for r in results)}")
+    for name, values in (("first chunk", [r[1] for r in ok if r[1] is not None]), ("total", [r[2] for r in ok])):
+        print(f">> {name:>11} latency: p50 {percentile(values, 0.5):.2f}s, p90 {percentile(values, 0.9):.2f}s, "
+              f"max {max(values, default=float('nan')):.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--voice", required=True)
+    parser.add_argument("--cases", default="tests/cases.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--generation", type=json.loads, default={}, help='e.g. \'{"num_beams": 1}\'')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import torch
+
+from indextts.server import TTSServer, wav_header
+
+
+class SentenceTTS:
+    """
+    Stands in for ``IndexTTS``: one int16 chunk of 100 samples per sentence, sentences are split at ".".
+    Generating a sentence waits for ``release``, a "slow" sentence takes 10 seconds, ``should_stop`` is checked
+    every 10 ms as the real generation checks it after every token.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.stopped = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def generate(self, sentence, should_stop):
+        end = time.monotonic() + (10 if sentence == "slow" else 0)
+        while not self.release.wait(0.01) or time.monotonic() < end:
+            if should_stop():
+                return False
+            time.sleep(0.01)
+        return True
+
+    def infer_stream(self, audio_prompt, text, should_stop=None, **generation_kwargs):
+        self.calls.append((audio_prompt, text, generation_kwargs))
+        for i, sentence in enumerate(s.strip() for s in text.split(".") if s.strip()):
+            if not self.generate(sentence, should_stop):
+                self.stopped.append((text, i))
+                return
+            if sentence == "fail":
+                raise RuntimeError("synthesis failed")
+            yield torch.full((1, 100), i, dtype=torch.int16)
+
+
+async def request(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    lines = head.decode().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    if headers.get("Transfer-Encoding") == "chunked":
+        chunks = []
+        while True:
+            size, _, payload = payload.partition(b"\r\n")
+            size = int(size, 16)
+            if size == 0:
+                break
+            chunks.append(payload[:size])
+            payload = payload[size + 2:]
+        payload = b"".join(chunks)
+    return int(lines[0].split()[1]), headers, payload
+
+
+async def send(port, body):
+    """send a request without reading the response, return the reader and writer of the connection"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode()
+    writer.write(f"POST /synthesize HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    return reader, writer
+
+
+async def reset(writer):
+    """close the connection with a RST, as a client that crashed or went away"""
+    writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    writer.close()
+    await writer.wait_closed()
+
+
+def serve(test, max_queue=2, timeout=30.0):
+    """Run the coroutine ``test(server, port)`` against a ``TTSServer`` on a free port."""
+    with tempfile.TemporaryDirectory() as voices_dir:
+        for name in ("alice.wav", "bob.wav", "bob.voice", "notes.txt"):
+            open(os.path.join(voices_dir, name), "wb").close()
+        server = TTSServer(SentenceTTS(), voices_dir, max_queue=max_queue, timeout=timeout)
+
+        async def main():
+            server.start()
+            listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            try:
+                await test(server, listener.sockets[0].getsockname()[1])
+            finally:
+                server.tts.release.set()
+                listener.close()
+                await listener.wait_closed()
+                server.stop()
+
+        asyncio.run(main())
+        return server
+
+
+def test_wav_header():
+    header = wav_header(24000, 10)
+    assert len(header) == 44 and header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+    assert int.from_bytes(header[40:44], "little") == 20
+    assert int.from_bytes(wav_header(24000)[40:44], "little") == 0xFFFFFFFF - 36
+
+
+def test_endpoints():
+    async def test(server, port):
+        status, _, body = await request(port, "GET", "/health")
+        assert status == 200 and json.loads(body)["status"] == "ok"
+        status, _, body = await request(port, "GET", "/voices")
+        assert json.loads(body) == {"voices": ["alice", "bob"]}
+
+        status, headers, body = await request(port, "POST", "/synthesize",
+                                              {"text": "One. Two.", "voice": "bob", "top_k": "5"})
+        assert status == 200 and headers["Content-Type"] == "audio/wav"
+        assert body[:44] == wav_header(24000, 200) and len(body) == 44 + 400
+        # the profile is used rather than the audio, generation kwargs are converted
+        assert server.tts.calls[-1] == (os.path.join(server.voices_dir, "bob.voice"), "One. Two.", {"top_k": 5})
+        for value, expected in (("false", False), ("0", False), (False, False), ("true", True), (1, True)):
+            status, _, _ = await request(port, "POST", "/synthesize", {"text": "One.", "voice": "bob",
+                                                                       "do_sample": value})
+            assert status == 200 and server.tts.calls[-1][2] == {"do_sample": expected}, value
+        assert (await request(port, "POST", "/synthesize", {"text": "One.", "voice": "bob",
+                                                            "do_sample": "no"}))[0] == 400
+
+        status, headers, body = await request(port, "POST", "/stream",
+                                              {"text": "One. Two. Three.", "voice": "alice", "format": "pcm"})
+        assert status == 200 and headers["X-Sample-Rate"] == "24000"
+        assert torch.equal(torch.frombuffer(bytearray(body), dtype=torch.int16),
+                           torch.arange(3, dtype=torch.int16).repeat_interleave(100))
+        status, _, body = await request(port, "POST", "/stream", {"text": "One.", "voice": "alice"})
+        assert body[:4] == b"RIFF" and len(body) == 44 + 200
+
+        assert (await request(port, "POST", "/synthesize", {"text": "One.", "voice": "carol"}))[0] == 404
+        assert (await request(port, "POST", "/synthesize", {"text": "", "voice": "alice"}))[0] == 400
+        assert (await request(port, "POST", "/synthesize", {"text": "One.", "voice": "alice", "top_p": "x"}))[0] == 400
+        assert (await request(port, "GET", "/synthesize"))[0] == 405
+        assert (await request(port, "GET", "/nothing"))[0] == 404
+        status, _, body = await request(port, "POST", "/synthesize", {"text": "fail.", "voice": "alice"})
+        assert status == 500 and "synthesis failed" in json.loads(body)["error"]
+        # a failure after the first chunk cuts the stream short
+        status, _, body = await request(port, "POST", "/stream", {"text": "One. fail.", "voice": "alice",
+                                                                  "format": "pcm"})
+        assert status == 200 and len(body) == 200
+
+    server = serve(test)
+    assert server._stats["completed"] == 8 and server._stats["failed"] == 2
+
+
+def test_full_queue_and_deadline():
+    async def test(server, port):
+        server.tts.release.clear()
+        # the worker blocks on the first job, two more fill the queue
+        running = asyncio.create_task(request(port, "POST", "/synthesize", {"text": "One.", "voice": "alice"}))
+        await asyncio.sleep(0.2)
+        queued = [asyncio.create_task(request(port, "POST", "/synthesize",
+                                              {"text": "One.", "voice": "alice", "timeout": 0.1}))
+                  for _ in range(2)]
+        await asyncio.sleep(0.2)
+        status, headers, _ = await request(port, "POST", "/synthesize", {"text": "One.", "voice": "alice"})
+        assert status == 429 and headers["Retry-After"] == "1"
+        assert json.loads((await request(port, "GET", "/health"))[2])["queued"] == 2
+        await asyncio.sleep(0.2)
+        server.tts.release.set()
+        assert (await running)[0] == 200
+        # their deadline passed while queued
+        assert [(await task)[0] for task in queued] == [504, 504]
+
+    server = serve(test)
+    assert server._stats["rejected"] == 1 and server._stats["expired"] == 2
+
+
+async def wait_idle(port):
+    while True:
+        health = json.loads((await request(port, "GET", "/health"))[2])
+        if not health["running"] and not health["queued"]:
+            return health
+        await asyncio.sleep(0.05)
+
+
+def test_disconnect_cancels():
+    async def test(server, port):
+        server.tts.release.clear()
+        _, running = await send(port, {"text": "One. Two. Three.", "voice": "alice"})
+        await asyncio.sleep(0.2)
+        _, queued = await send(port, {"text": "One.", "voice": "bob"})
+        await asyncio.sleep(0.2)
+        assert server._running is not None and server._jobs.qsize() == 1
+        # both connections are reset before the first chunk
+        for writer in (running, queued):
+            await reset(writer)
+        await asyncio.sleep(0.2)
+        # the running job stopped while generating its first sentence, the queued one never ran
+        assert server.tts.stopped == [("One. Two. Three.", 0)]
+        server.tts.release.set()
+        health = await wait_idle(port)
+        assert health["cancelled"] == 2 and health["expired"] == 0 and health["completed"] == 0
+        assert [call[1] for call in server.tts.calls] == ["One. Two. Three."]
+
+    serve(test)
+
+
+def test_half_close_is_not_a_disconnect():
+    async def test(server, port):
+        server.tts.release.clear()
+        reader, writer = await send(port, {"text": "One. Two.", "voice": "alice"})
+        # the client is done sending, it still reads the response
+        writer.write_eof()
+        await asyncio.sleep(0.2)
+        server.tts.release.set()
+        response = await reader.read()
+        writer.close()
+        assert response.startswith(b"HTTP/1.1 200") and response.endswith(torch.arange(2, dtype=torch.int16)
+                                                                          .repeat_interleave(100).numpy().tobytes())
+        health = await wait_idle(port)
+        assert health["completed"] == 1 and health["cancelled"] == 0
+
+    serve(test)
+
+
+def test_deadline_stops_generation():
+    async def test(server, port):
+        start = time.monotonic()
+        status, _, body = await request(port, "POST", "/synthesize", {"text": "One. slow. Three.", "voice": "alice",
+                                                                      "timeout": 0.5})
+        # the slow sentence is stopped part way instead of after its 10 seconds
+        assert status == 504 and time.monotonic() - start < 5
+        assert server.tts.stopped == [("One. slow. Three.", 1)]
+        status, _, body = await request(port, "POST", "/stream", {"text": "One. slow. Three.", "voice": "alice",
+                                                                  "format": "pcm", "timeout": 0.5})
+        # the stream is cut short after the audio of the first sentence
+        assert status == 200 and len(body) == 200 and time.monotonic() - start < 10
+        health = await wait_idle(port)
+        assert health["expired"] == 2 and health["completed"] == 0
+
+    serve(test)
+
+
+if __name__ == "__main__":
+    test_wav_header()
+    test_endpoints()
+    test_full_queue_and_deadline()
+    test_disconnect_cancels()
+    test_half_close_is_not_a_disconnect()
+    test_deadline_stops_generation()
+    print("ok")
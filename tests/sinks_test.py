@@ -0,0 +1,91 @@
+import os
+import tempfile
+
+import numpy as np
+import soundfile
+import torch
+
+from indextts.utils.sinks import BackgroundSink, MemorySink, PCMSink, WavSink, open_sink, to_pcm16
+
+
+def chunks():
+    """The chunk formats produced by ``IndexTTS``: int16 (1, T) tensors, float tensors in the int16 range, (T, 1) numpy."""
+    torch.manual_seed(0)
+    audio = (torch.rand(3000) * 2 - 1) * 32767
+    return audio.type(torch.int16).numpy(), [audio[:1000].type(torch.int16).unsqueeze(0),
+                                             audio[1000:2000].unsqueeze(0),
+                                             audio[2000:].type(torch.int16).numpy()[:, None]]
+
+
+def test_to_pcm16():
+    assert to_pcm16(torch.tensor([[1.9, -3.2]])).tolist() == [1, -3]
+    assert to_pcm16(np.zeros((4, 1), dtype=np.int16)).shape == (4,)
+
+
+def test_memory_sink():
+    expected, parts = chunks()
+    with MemorySink() as sink:
+        for part in parts:
+            sink.write(part)
+        assert np.array_equal(sink.numpy(), expected)
+    assert sink.closed and sink.samples == 3000 and sink.seconds == 3000 / 24000
+
+
+def test_file_sinks():
+    expected, parts = chunks()
+    with tempfile.TemporaryDirectory() as out_dir:
+        for name, background in (("a.wav", False), ("b/a.wav", True), ("a.flac", True), ("a.pcm", False)):
+            path = os.path.join(out_dir, name)
+            sink = open_sink(path, background=background)
+            assert isinstance(sink, BackgroundSink) == background
+            for part in parts:
+                sink.write(part)
+            assert sink.close() == path
+            if name.endswith(".pcm"):
+                data = np.fromfile(path, dtype="<i2")
+            else:
+                data, sampling_rate = soundfile.read(path, dtype="int16")
+                assert sampling_rate == 24000
+            # lossless formats
+            assert np.array_equal(data, expected), name
+        path = os.path.join(out_dir, "a.opus")
+        with open_sink(path) as sink:
+            for part in parts:
+                sink.write(part)
+        data, sampling_rate = soundfile.read(path, dtype="int16")
+        assert sampling_rate == 24000 and abs(len(data) - len(expected)) < 1000
+
+
+def test_background_sink_errors():
+    class FailingSink(MemorySink):
+        def _write(self, pcm):
+            raise OSError("disk full")
+
+    sink = BackgroundSink(FailingSink())
+    sink.write(np.zeros(10, dtype=np.int16))
+    try:
+        sink.close()
+        assert False, "the writer exception is raised"
+    except OSError as e:
+        assert str(e) == "disk full"
+    assert sink.sink.closed
+
+
+def test_wav_sink_with_infer_outputs():
+    with tempfile.TemporaryDirectory() as out_dir:
+        path = os.path.join(out_dir, "a.wav")
+        with WavSink(path) as sink:
+            sink.write(torch.ones(1, 10, dtype=torch.int16))
+        assert soundfile.info(path).frames == 10
+        with PCMSink(os.path.join(out_dir, "a.raw")) as sink:
+            sink.write(torch.ones(1, 10))
+        assert os.path.getsize(os.path.join(out_dir, "a.raw")) == 20
+
+
+if __name__ == "__main__":
+    test_to_pcm16()
+    test_memory_sink()
+    test_file_sinks()
+    test_background_sink_errors()
+    test_wav_sink_with_infer_outputs()
+    print("ok")
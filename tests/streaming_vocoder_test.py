@@ -0,0 +1,103 @@
+import torch
+from omegaconf import OmegaConf
+
+from indextts.BigVGAN.models import BigVGAN
+from indextts.utils.streaming import Crossfader, LatentWindowVocoder
+
+
+def build_vocoder(cfg_path="checkpoints/config.yaml"):
+    """
+    A randomly initialized, narrow BigVGAN with the upsampling layout of the real model.
+    """
+    cfg = OmegaConf.load(cfg_path).bigvgan
+    cfg.upsample_initial_channel = 64
+    cfg.gpt_dim = 32
+    cfg.speaker_embedding_dim = 16
+    torch.manual_seed(0)
+    model = BigVGAN(cfg).eval()
+    model.remove_weight_norm()
+    speaker_embedding = torch.randn(1, 1, cfg.speaker_embedding_dim)
+
+    def vocode(latent):
+        with torch.no_grad():
+            wav, _ = model(latent, None, speaker_embedding=speaker_embedding)
+        return wav.squeeze(1)
+
+    return vocode, cfg.gpt_dim
+
+
+def stream(vocoder: LatentWindowVocoder, latent: torch.Tensor, step=1):
+    """feed the latents like a generation loop does, ``step`` frames at a time"""
+    chunks = []
+    for n in range(step, latent.shape[1], step):
+        chunks.extend(vocoder.push(latent[:, :n]))
+    chunks.extend(vocoder.flush(latent))
+    return torch.cat(chunks, dim=-1)
+
+
+def test_windowed_matches_one_shot():
+    vocode, dim = build_vocoder()
+    latent = torch.randn(1, 100, dim)
+    reference = vocode(latent)
+    vocoder = LatentWindowVocoder(vocode, hop_length=1024, window=16, left_context=24, lookahead=12, crossfade=2048)
+    wav = stream(vocoder, latent, step=3)
+    assert wav.shape == reference.shape
+    error = (wav - reference).abs().max().item()
+    assert error < 1e-2 * reference.abs().max().item(), error
+
+
+def test_windowed_length_without_context():
+    vocode, dim = build_vocoder()
+    latent = torch.randn(1, 37, dim)
+    vocoder = LatentWindowVocoder(vocode, hop_length=1024, window=8, left_context=0, lookahead=0, crossfade=1024)
+    wav = stream(vocoder, latent)
+    # crossfade is clamped to the left context, so windows are plainly concatenated
+    assert vocoder.crossfade == 0
+    assert wav.shape[-1] == 37 * 1024
+
+
+def crossfade(chunks, overlap, crossfades=None):
+    crossfader = Crossfader(overlap)
+    crossfades = crossfades or [True] * len(chunks)
+    parts = [crossfader.push(chunk, crossfade=flag) for chunk, flag in zip(chunks, crossfades)]
+    return parts, crossfader.flush()
+
+
+def test_crossfade_length_and_tail():
+    chunks = [torch.randn(1, n) for n in (500, 300, 64, 200)]
+    parts, tail = crossfade(chunks, overlap=100)
+    # every chunk but the first overlaps the previous one by up to 100 samples,
+    # the tail of the last one is only returned by flush()
+    assert [part.shape[-1] for part in parts] == [400, 200, 0, 100]
+    assert tail.shape[-1] == 100 and torch.equal(tail, chunks[-1][..., -100:])
+    assert sum(part.shape[-1] for part in parts) + tail.shape[-1] == 1064 - 100 - 64 - 100
+    # without crossfade the held tail is prepended unchanged
+    parts, tail = crossfade(chunks[:2], overlap=100, crossfades=[True, False])
+    assert torch.equal(torch.cat(parts + [tail], dim=-1), torch.cat(chunks[:2], dim=-1))
+    # no overlap passes the chunks through and holds nothing back
+    parts, tail = crossfade(chunks, overlap=0)
+    assert all(part is chunk for part, chunk in zip(parts, chunks)) and tail.shape[-1] == 0
+    assert Crossfader(100).flush().shape[-1] == 0
+
+
+def test_crossfade_seams():
+    overlap = 64
+    # equal chunks are joined seamlessly
+    parts, tail = crossfade([torch.full((1, 256), 3.0)] * 3, overlap)
+    wav = torch.cat(parts + [tail], dim=-1)
+    assert wav.shape[-1] == 3 * 256 - 2 * overlap and torch.allclose(wav, torch.full_like(wav, 3.0))
+    # the seam goes linearly from the tail of one chunk to the head of the next, without jumps
+    parts, tail = crossfade([torch.zeros(1, 256), torch.ones(1, 256)], overlap)
+    wav = torch.cat(parts + [tail], dim=-1)[0]
+    seam = wav[256 - overlap:256]
+    assert torch.all(wav[:256 - overlap] == 0) and torch.all(wav[256:] == 1)
+    assert torch.all(seam > 0) and torch.all(seam < 1) and torch.all(seam.diff() > 0)
+    assert torch.allclose(seam.diff(), torch.full_like(seam.diff(), 1 / (overlap + 1)))
+
+
+if __name__ == "__main__":
+    test_crossfade_length_and_tail()
+    test_crossfade_seams()
+    test_windowed_matches_one_shot()
+    test_windowed_length_without_context()
+    print("ok")
@@ -0,0 +1,119 @@
+import os
+import pickle
+import tempfile
+from types import SimpleNamespace
+
+import torch
+
+from indextts.infer import IndexTTS
+from indextts.utils.voice_cache import VoiceCache, VoiceConditioning, is_profile_of
+
+
+def make_voice(frames=10, key=None):
+    """a voice whose tensors take ``frames * 400`` bytes"""
+    return VoiceConditioning(torch.zeros(1, 100, frames), key=key)
+
+
+def test_lru_eviction():
+    cache = VoiceCache(capacity=2)
+    a, b, c = make_voice(key="a"), make_voice(key="b"), make_voice(key="c")
+    cache.put("a", a)
+    cache.put("b", b)
+    # "a" becomes the most recently used, "b" is evicted by "c"
+    assert cache.get("a") is a
+    cache.put("c", c)
+    assert "b" not in cache and cache.get("a") is a and cache.get("c") is c
+    assert cache.get("b") is None
+    assert cache.stats() == {"entries": 2, "bytes": 2 * a.nbytes(), "hits": 3, "misses": 1, "evictions": 1}
+
+
+def test_byte_budget():
+    voice_bytes = make_voice().nbytes()
+    cache = VoiceCache(capacity=8, max_bytes=2 * voice_bytes + voice_bytes // 2)
+    for key in "abc":
+        cache.put(key, make_voice(key=key))
+    assert list(cache._entries) == ["b", "c"] and cache.nbytes == 2 * voice_bytes
+    # replacing an entry only counts its new size
+    cache.put("c", make_voice(frames=5, key="c"))
+    assert cache.nbytes == voice_bytes + voice_bytes // 2 and len(cache) == 2
+    # an entry larger than the whole budget is not cached and evicts nothing
+    cache.put("big", make_voice(frames=30))
+    assert "big" not in cache and len(cache) == 2
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disabled():
+    cache = VoiceCache(capacity=0)
+    cache.put("a", make_voice())
+    assert len(cache) == 0 and cache.get("a") is None
+
+
+def test_content_hash_keys():
+    """the same path with edited content misses, a copy of the same content at another path hits"""
+    computed = []
+
+    def compute_voice_conditioning(audio_prompt, key=None):
+        computed.append(audio_prompt)
+        return make_voice(key=key)
+
+    tts = SimpleNamespace(voice_cache=VoiceCache(capacity=4), compute_voice_conditioning=compute_voice_conditioning)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path, copy = os.path.join(tmp_dir, "a.wav"), os.path.join(tmp_dir, "b.wav")
+        for name in (path, copy):
+            with open(name, "wb") as f:
+                f.write(b"RIFF-one")
+        voice = IndexTTS.get_voice_conditioning(tts, path)
+        assert IndexTTS.get_voice_conditioning(tts, path) is voice
+        assert IndexTTS.get_voice_conditioning(tts, copy) is voice
+        with open(path, "wb") as f:
+            f.write(b"RIFF-two")
+        edited = IndexTTS.get_voice_conditioning(tts, path)
+        assert edited is not voice and edited.key == VoiceCache.hash_bytes(b"RIFF-two")
+        assert voice.key == VoiceCache.hash_file(copy)
+    assert computed == [path, path]
+    assert tts.voice_cache.stats() == {"entries": 2, "bytes": 2 * voice.nbytes(), "hits": 2, "misses": 2,
+                                       "evictions": 0}
+
+
+def test_profile_round_trip():
+    torch.manual_seed(0)
+    tts = SimpleNamespace(device="cpu", is_fp16=False, model_version=1.5, voice_cache=VoiceCache(capacity=4),
+                          get_prefix_kv=lambda voice: None, get_vocoder_voice=lambda voice: None)
+    tts.compute_voice_conditioning = lambda audio_prompt, key=None: VoiceConditioning(
+        torch.randn(1, 100, 40), torch.randn(1, 32, 64), torch.randn(1, 1, 16), key=key)
+    tts.get_voice_conditioning = lambda audio_prompt: IndexTTS.get_voice_conditioning(tts, audio_prompt)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio, profile = os.path.join(tmp_dir, "a.wav"), os.path.join(tmp_dir, "voices", "a.voice")
+        with open(audio, "wb") as f:
+            f.write(b"RIFF-one")
+        assert not is_profile_of(profile, audio)
+        assert IndexTTS.export_voice_profile(tts, audio, profile) == profile
+        assert is_profile_of(profile, audio)
+        voice = IndexTTS.get_voice_conditioning(tts, audio)
+        loaded = IndexTTS.load_voice_profile(tts, profile, key="k")
+        assert loaded.key == "k" and VoiceConditioning.load(profile).key == VoiceCache.hash_file(audio)
+        for name, value in voice.tensors().items():
+            assert torch.equal(loaded.tensors()[name], value), name
+        # the profile is stale once the audio changes
+        with open(audio, "wb") as f:
+            f.write(b"RIFF-two")
+        assert not is_profile_of(profile, audio)
+
+        # anything but tensors and plain types is refused
+        malicious = os.path.join(tmp_dir, "b.voice")
+        torch.save({"gpt_cond_latent": SimpleNamespace()}, malicious)
+        try:
+            VoiceConditioning.load(malicious)
+            assert False, "the profile is not unpickled"
+        except pickle.UnpicklingError:
+            pass
+        assert not is_profile_of(malicious, audio)
+
+
+if __name__ == "__main__":
+    test_lru_eviction()
+    test_byte_budget()
+    test_disabled()
+    test_content_hash_keys()
+    test_profile_round_trip()
+    print("ok")
@@ -2,6 +2,7 @@ import json
 import os
 import time
 import traceback
+from concurrent.futures import wait
 from pathlib import Path
 
 import gradio as gr
@@ -9,10 +10,40 @@ import numpy as np
 from scipy.io import wavfile
 
 from indextts.infer import IndexTTS
+from indextts.utils.pipeline import PipelineStage
+from indextts.utils.sinks import MemorySink, WavSink
 from webui2.config import TEMP_DIR
 from webui2.utils import SubtitleManager, TTSManager, mix_audio_with_bgm
 
 
+def write_wav(item):
+    """Write one ``(path, sampling_rate, audio)`` item to a wav file."""
+    path, sampling_rate, audio = item
+    with WavSink(path, sampling_rate) as sink:
+        sink.write(audio)
+    return path
+
+
+def scheduler_synthesize(scheduler, progress, audio_prompt, text, output_path, **kwargs):
+    """
+    Synthesize through the batch scheduler and save the audio to ``output_path``,
+    the sentences done are reported to the gradio progress bar like ``tts.gr_progress`` does.
+    """
+    sentences = [0, 0]  # done, total, updated by the scheduler thread
+
+    def on_progress(done, total):
+        sentences[:] = [done, total]
+
+    future = scheduler.submit(audio_prompt, text, progress=on_progress, **kwargs)
+    while not wait([future], timeout=0.5).done:
+        done, total = sentences
+        if total > 0:
+            progress(0.2 + 0.7 * done / total, f"gpt inference speech... {done}/{total}")
+    sample_rate, audio_data = future.result()
+    wavfile.write(output_path, sample_rate, audio_data)
+    return output_path
+
+
 def gen_audio(
     tts: IndexTTS | None,
     subtitle_manager: SubtitleManager,
@@ -63,23 +94,28 @@ def gen_audio(
         additional_bgm = args[14] if len(args) > 14 else []
 
         # Generate audio
+        scheduler = TTSManager.get_instance().get_scheduler()
         if infer_mode == "普通推理":
-            _ = tts.infer(
-                prompt,
-                text,
-                audio_output_path,
-                verbose=True,  # cmd_args.verbose
-                max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
-                **kwargs,
-            )
+            with scheduler.exclusive():
+                _ = tts.infer(
+                    prompt,
+                    text,
+                    audio_output_path,
+                    verbose=True,  # cmd_args.verbose
+                    max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
+                    **kwargs,
+                )
         else:
-            _ = tts.infer_fast(
+            # sentences of concurrent sessions are batched together
+            progress(0.1, "排队生成中...")
+            _ = scheduler_synthesize(
+                scheduler,
+                progress,
                 prompt,
                 text,
-                audio_output_path,
-                verbose=True,  # cmd_args.verbose
+                str(audio_output_path),
                 max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
-                sentences_bucket_max_size=sentences_bucket_max_size,
+                sentences_bucket_max_size=int(sentences_bucket_max_size),
                 **kwargs,
             )
 
@@ -170,40 +206,52 @@ def gen_multi_dialog_audio(
         dialog_lines = parse_dialogs(dialog_text, speakers, progress)
 
         # Generate audio for each dialog line
-        audio_segments = []
+        dialog_sink = MemorySink()
+        # 单句音频由同一个后台线程依次写入磁盘，同时等待下一句的结果；对话音频直接在内存中拼接
+        line_writer = PipelineStage(write_wav, name="dialog-line-writer", max_pending=4)
         temp_files: list[tuple[str, str]] = []  # list of (text, audio_path)
         sample_rate = None
 
-        # TODO batch 合成
-        for i, line in enumerate(dialog_lines):
-            speaker = line["speaker"]
-            text = line["text"]
-
-            progress(
-                0.3 + 0.6 * i / len(dialog_lines),
-                f"生成 '{speaker}' 的对话 ({i + 1}/{len(dialog_lines)}): {text[:20]}...",
-            )
-            print(f"[webui2][Info] No.{i}\t正在生成 '{speaker}' 的对话: {text[:20]}...")
-
-            audio_output_path = os.path.join(
-                output_dir, f"{i}_{speaker}_{int(time.time())}.wav"
-            )
-            tts.infer(
-                speakers[speaker], text, audio_output_path, verbose=False, **kwargs
+        # 所有对话一次性提交，不同角色的句子在调度器中合并为同一批次
+        # 句子切分长度与之前逐句调用 tts.infer 时的默认值 (120) 相同
+        scheduler = TTSManager.get_instance().get_scheduler()
+        futures = [
+            scheduler.submit(
+                speakers[line["speaker"]],
+                line["text"],
+                max_text_tokens_per_sentence=120,
+                **kwargs,
             )
+            for line in dialog_lines
+        ]
+        try:
+            for i, (line, future) in enumerate(zip(dialog_lines, futures)):
+                speaker = line["speaker"]
+                text = line["text"]
 
-            sample_rate, audio_data = wavfile.read(audio_output_path)
+                progress(
+                    0.3 + 0.6 * i / len(dialog_lines),
+                    f"生成 '{speaker}' 的对话 ({i + 1}/{len(dialog_lines)}): {text[:20]}...",
+                )
+                print(f"[webui2][Info] No.{i}\t正在生成 '{speaker}' 的对话: {text[:20]}...")
 
-            audio_segments.append(audio_data)
+                audio_output_path = os.path.join(
+                    output_dir, f"{i}_{speaker}_{int(time.time())}.wav"
+                )
+                sample_rate, audio_data = future.result()
+                line_writer.put((audio_output_path, sample_rate, audio_data))
+                dialog_sink.write(audio_data)
 
-            if i < len(dialog_lines) - 1:
-                silence = np.zeros(int(interval * sample_rate), dtype=audio_data.dtype)
-                audio_segments.append(silence)
-            temp_files.append((f"[{speaker}] {text}", audio_output_path))
+                if i < len(dialog_lines) - 1:
+                    dialog_sink.write(np.zeros(int(interval * sample_rate), dtype=np.int16))
+                temp_files.append((f"[{speaker}] {text}", audio_output_path))
+        finally:
+            # 等待所有单句音频写完
+            line_writer.close()
 
         # Combine all audio segments
         progress(0.9, "正在合并对话音频...")
-        dialog_audio = np.concatenate(audio_segments)
+        dialog_audio = dialog_sink.close()
 
         audio_output_path = os.path.join("outputs", f"dialog_{int(time.time())}.wav")
         wavfile.write(audio_output_path, sample_rate, dialog_audio)
@@ -478,23 +526,26 @@ def regenerate_single(
 
         progress(0.3, "正在生成...")
         # Regenerate audio
+        scheduler = TTSManager.get_instance().get_scheduler()
         if infer_mode == "普通推理":
-            _ = tts.infer(
-                speakers[speaker],
-                text,
-                output_wav_path,
-                verbose=False,  # cmd_args.verbose
-                max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
-                **kwargs,
-            )
+            with scheduler.exclusive():
+                _ = tts.infer(
+                    speakers[speaker],
+                    text,
+                    output_wav_path,
+                    verbose=False,  # cmd_args.verbose
+                    max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
+                    **kwargs,
+                )
         else:
-            _ = tts.infer_fast(
+            _ = scheduler_synthesize(
+                scheduler,
+                progress,
                 speakers[speaker],
                 text,
-                output_wav_path,
-                verbose=False,  # cmd_args.verbose
+                str(output_wav_path),
                 max_text_tokens_per_sentence=int(max_text_tokens_per_sentence),
-                sentences_bucket_max_size=sentences_bucket_max_size,
+                sentences_bucket_max_size=int(sentences_bucket_max_size),
                 **kwargs,
             )
 
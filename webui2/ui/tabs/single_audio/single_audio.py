@@ -129,6 +129,8 @@ def create_single_audio_tab_page(session: gr.State):
             additional_bgm,
         ],
         outputs=[output_audio, subtitle_output],
+        # sessions run concurrently, the batch scheduler serializes model access
+        concurrency_limit=None,
     )
 
     output_audio.change(None, [], [], js=notify_done)
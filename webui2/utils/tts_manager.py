@@ -6,6 +6,7 @@ import json
 import os
 
 from indextts.infer import IndexTTS
+from indextts.scheduler import BatchScheduler
 from tools.i18n.i18n import I18nAuto
 
 
@@ -30,6 +31,7 @@ class TTSManager:
             self.model_dir = model_dir
             self.cfg_path = cfg_path
             self.tts = None
+            self.scheduler = None
             self.i18n = I18nAuto(language="zh_CN")
             self.example_cases = []
             self._load_tts()
@@ -64,6 +66,8 @@ class TTSManager:
             model_dir=self.model_dir,
             cfg_path=self.cfg_path,
         )
+        # batches sentences of concurrent sessions, direct calls to tts must hold scheduler.exclusive()
+        self.scheduler = BatchScheduler(self.tts).start()
 
     def _load_examples(self):
         """Load example cases from file"""
@@ -91,6 +95,10 @@ class TTSManager:
         """Get TTS instance"""
         return self.tts
 
+    def get_scheduler(self):
+        """Get the batch scheduler shared by all sessions"""
+        return self.scheduler
+
     def get_examples(self):
         """Get example cases"""
         return self.example_cases